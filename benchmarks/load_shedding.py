@@ -0,0 +1,124 @@
+# 同時実行数の制限とロードシェディングのベンチマーク
+# このファイルは、処理能力を超えるリクエストが届いたときのグッドプット（期限内に成功した応答の数）とレイテンシを、
+# 同時実行数の制限の有無で比較します
+# - データベースは、同時に処理する数が capacity を超えると1件あたりの処理時間がその分だけ伸びるものとして模擬します
+# - リクエストはポアソン到着で届き、クライアントは --timeout 秒を過ぎた応答を諦めます（諦めた後もサーバーは処理を続けます）
+# - 制限しない場合は処理中のリクエストが溜まり続けて全ての応答が遅くなり、期限内に返せる応答がほとんどなくなります
+#
+# 実行例:
+#   python benchmarks/load_shedding.py --capacity 20 --service-ms 20 --loads 0.5,1,1.5,2,3
+
+import argparse  # コマンドライン引数
+import asyncio  # 非同期処理の実行
+import os  # 環境変数
+import random  # 到着間隔の生成
+import sys  # インポートパスの設定
+import time  # 時間計測
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('SQLALCHEMY_DATABASE_URL', 'sqlite:///./bench_load_shedding.db')
+
+from concurrency import AIMDLimit, ConcurrencyLimiter, ConcurrencyLimitMiddleware  # 同時実行数の制限
+
+
+def percentile(values, q):
+    # 昇順に並べた値から q パーセンタイルを取得
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] if ordered else float('nan')
+
+
+class SimulatedBackend:
+    """
+    同時に処理する数が増えると遅くなるデータベースを模擬するASGIアプリケーション
+    """
+
+    def __init__(self, capacity: int, service_time: float):
+        self.capacity = capacity
+        self.service_time = service_time
+        self.active = 0
+
+    async def __call__(self, scope, receive, send):
+        self.active += 1
+        try:
+            await asyncio.sleep(self.service_time * max(1.0, self.active / self.capacity))
+        finally:
+            self.active -= 1
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'[]'})
+
+
+async def run(args, load: float, limited: bool):
+    backend = SimulatedBackend(args.capacity, args.service_ms / 1000)
+    limiter = None
+    if limited:
+        limiter = ConcurrencyLimiter(
+            AIMDLimit(args.capacity, 1, args.capacity * 10, latency_target=args.service_ms / 1000 * 2),
+            args.queue_size,
+        )
+        app = ConcurrencyLimitMiddleware(backend, limiter)
+    else:
+        app = backend
+
+    rate = load * args.capacity / (args.service_ms / 1000)
+    timeout_header = str(args.timeout).encode()
+    results = []
+
+    async def request(method):
+        scope = {
+            'type': 'http', 'method': method, 'path': '/items',
+            'headers': [(b'x-request-timeout', timeout_header)],
+        }
+        status = None
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        start = time.monotonic()
+        await app(scope, receive, send)
+        results.append((status, time.monotonic() - start))
+
+    # 到着時刻を先に決め、起きるたびに到着済みのリクエストをまとめて送る（sleep の粒度で到着率が下がらないようにする）
+    tasks = []
+    start = time.monotonic()
+    arrival = start
+    while arrival < start + args.duration:
+        while arrival <= time.monotonic():
+            tasks.append(asyncio.create_task(request('GET' if random.random() < 0.8 else 'POST')))
+            arrival += random.expovariate(rate)
+        await asyncio.sleep(max(0.0, arrival - time.monotonic()))
+    await asyncio.gather(*tasks)
+
+    good = [latency for status, latency in results if status == 200 and latency <= args.timeout]
+    shed = sum(1 for status, _ in results if status == 503)
+    limit = f'{limiter.limit.value:4d}' if limiter is not None else '   -'
+    print(
+        f'load={load:3.1f}x limiter={"on " if limited else "off"}: '
+        f'goodput={len(good) / args.duration:7.0f}/s ({len(good) / len(results):6.1%}) shed={shed:6d} '
+        f'p50={percentile(good, 50) * 1000:7.1f}ms p99={percentile(good, 99) * 1000:7.1f}ms limit={limit}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load shedding goodput benchmark')
+    parser.add_argument('--capacity', type=int, default=20, help='concurrent requests the backend handles without slowing down')
+    parser.add_argument('--service-ms', type=float, default=20.0, help='service time per request at or below capacity')
+    parser.add_argument('--loads', default='0.5,1,1.5,2,3', help='offered load as a multiple of capacity')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of traffic per run')
+    parser.add_argument('--timeout', type=float, default=1.0, help='client timeout in seconds')
+    parser.add_argument('--queue-size', type=int, default=100)
+    args = parser.parse_args()
+
+    random.seed(0)
+    for load in [float(value) for value in args.loads.split(',')]:
+        for limited in (False, True):
+            asyncio.run(run(args, load, limited))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# プロファイリングミドルウェアのオーバーヘッド計測ベンチマーク
+# このファイルは、計測しないリクエストに対する ProfilingMiddleware の追加コストを計測します
+# HTTPサーバーを介さずにASGIアプリケーションを直接呼び出し、1リクエストあたりの処理時間を比べます
+#
+# 実行例:
+#   python benchmarks/profiling_overhead.py --requests 20000
+
+import argparse  # コマンドライン引数
+import asyncio  # 非同期処理
+import os  # 環境変数
+import sys  # インポートパスの設定
+import time  # 時間計測
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('SQLALCHEMY_DATABASE_URL', 'sqlite://')
+
+from fastapi import FastAPI  # 計測対象のアプリケーション
+from profiling import ProfilingMiddleware, ProfileStore  # プロファイリング機能
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.get('/items/{id}')
+    async def find_by_id(id: int):
+        return {'id': id}
+
+    return app
+
+
+async def run(app, requests):
+    # 同じリクエストを requests 回処理し、1リクエストあたりの時間（マイクロ秒）を返す
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/items/1', 'raw_path': b'/items/1', 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'user-agent', b'bench'), (b'accept', b'*/*')],
+        'client': ('127.0.0.1', 1234), 'server': ('localhost', 80),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    for _ in range(requests // 10):
+        await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ProfilingMiddleware overhead benchmark')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    store = ProfileStore(keep=10)
+    variants = {
+        'no middleware': make_app(),
+        'disabled (no token, no sampling)': ProfilingMiddleware(make_app(), token='', sample_rate=0, profile_store=store),
+        'token configured, header absent': ProfilingMiddleware(make_app(), token='secret', sample_rate=0, profile_store=store),
+        'sampling 1 in 1000': ProfilingMiddleware(make_app(), token='secret', sample_rate=1000, profile_store=store),
+    }
+    # 実行順やウォームアップの影響を減らすため、各方式を交互に計測して最小値を使う
+    results = {name: float('inf') for name in variants}
+    for _ in range(args.rounds):
+        for name, app in variants.items():
+            results[name] = min(results[name], asyncio.run(run(app, args.requests)))
+    baseline = results['no middleware']
+    for name, elapsed in results.items():
+        print(f'{name:<36} {elapsed:8.2f} us/request  overhead {elapsed - baseline:+6.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# 類似商品の検索のベンチマーク
+# このファイルは、合成した商品データで類似商品の索引を作成し、作成・読み込み・検索の時間を計測します
+# - 索引の作成（定期ジョブで行う処理）
+# - 保存した索引のメモリマップでの読み込み（ワーカーの起動時に行う処理）
+# - 1件ずつの検索と、まとめての検索の1件あたりの時間
+#
+# 実行例:
+#   python benchmarks/similar_items.py --items 1000000
+
+import argparse  # コマンドライン引数
+import os  # 環境変数
+import random  # 合成データの作成
+import statistics  # 統計計算
+import sys  # インポートパスの設定
+import tempfile  # 索引の保存先
+import time  # 時間計測
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('SQLALCHEMY_DATABASE_URL', 'sqlite://')
+
+from similarity import SimilarIndex  # 類似商品の索引
+
+BRANDS = ['ソニー', 'パナソニック', 'シャープ', 'キヤノン', 'ニコン', 'Apple', 'Dell', 'HP', 'レノボ', '任天堂', '無印良品', 'ユニクロ', 'ナイキ', 'アディダス']
+KINDS = ['ノートPC', 'デジタルカメラ', 'ヘッドホン', 'スニーカー', 'ゲーム機', 'テレビ', '冷蔵庫', 'ジャケット', '腕時計', 'スマートフォン', 'タブレット', 'レンズ', 'マウス', 'キーボード']
+WORDS = ['美品', '新品', '中古', '未使用', 'ジャンク', '限定', 'ブラック', 'ホワイト', 'レッド', '大容量', '軽量', '2023年モデル', '箱付き', '送料無料']
+
+
+def listing(rng):
+    # 合成した商品名と説明（語彙が少ないため、実際のデータより検索の負荷が高くなります）
+    return f'{rng.choice(BRANDS)} {rng.choice(KINDS)} {rng.randint(1, 999)}', ' '.join(rng.sample(WORDS, 4))
+
+
+def percentile(values, q):
+    # 昇順に並べた値から q パーセンタイルを取得
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Similar item index benchmark')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--updates', type=int, default=1000, help='incremental updates applied after loading')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rows = [(i + 1, *listing(rng)) for i in range(args.items)]
+
+    start = time.perf_counter()
+    index = SimilarIndex.build(rows)
+    print(f'items={args.items} nnz={index.matrix.nnz} build={time.perf_counter() - start:.1f}s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        name = index.save(directory)
+        del index
+        start = time.perf_counter()
+        index = SimilarIndex.load(directory, name)
+        print(f'mmap load={(time.perf_counter() - start) * 1000:.1f}ms')
+
+        # 索引の作成後の変更（差分）がある状態で検索する
+        for i in range(args.updates):
+            index.upsert(args.items + i + 1, *listing(rng))
+            index.remove(rng.randint(1, args.items))
+
+        queries = [rows[rng.randrange(len(rows))] for _ in range(args.queries)]
+        index.similar(queries[:1])
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.similar([query])
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(
+            f'single query: p50={statistics.median(latencies):.2f}ms p99={percentile(latencies, 99):.2f}ms '
+            f'max={max(latencies):.2f}ms'
+        )
+
+        start = time.perf_counter()
+        for i in range(0, len(queries), args.batch):
+            index.similar(queries[i:i + args.batch])
+        print(f'batched query (batch={args.batch}): {(time.perf_counter() - start) * 1000 / len(queries):.2f}ms per query')
+        del index
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# よく使う検索のSQL文の使い回しのマイクロベンチマーク
+# このファイルは、呼び出しごとに db.query(...).filter(...) で式を組み立てる従来の書き方と、
+# モジュールで一度だけ組み立てたSQL文に bindparam で値を渡す現在の書き方のCPU時間を比べます
+# データベースの待ち時間を除くため、メモリ上のSQLiteを使います
+#
+# 実行例:
+#   python benchmarks/statement_cache.py --calls 5000
+
+import argparse  # コマンドライン引数
+import os  # 環境変数
+import sys  # インポートパスの設定
+import time  # 時間計測
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('SQLALCHEMY_DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import create_engine  # データベースエンジン作成
+from sqlalchemy.orm import sessionmaker  # データベースセッション作成
+from sqlalchemy.pool import StaticPool  # メモリ上のSQLiteを共有するため
+from database import Base  # データベースのベースクラス
+from models import User, Item  # データベースモデル
+from cruds import item as item_cruds, auth as auth_cruds  # 計測対象
+import statement_cache  # SQL文のキャッシュの利用状況
+
+
+def legacy_find_by_id(db, id, user_id):
+    return db.query(Item).filter(Item.id == id).filter(Item.user_id == user_id).first()
+
+
+def legacy_find_by_name(db, name):
+    return db.query(Item).filter(Item.name.like(f'%{name}%')).order_by(Item.id).all()
+
+
+def legacy_find_user(db, username):
+    return db.query(User).filter(User.username == username).first()
+
+
+def cpu_per_call(func, calls):
+    # 1回あたりのCPU時間（マイクロ秒）。ウォームアップ後に計測する
+    for _ in range(calls // 10):
+        func()
+    start = time.process_time()
+    for _ in range(calls):
+        func()
+    return (time.process_time() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prebuilt statement micro-benchmark')
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    user = User(username='seller', password='x', salt='x')
+    db.add(user)
+    db.commit()
+    db.add_all([Item(name=f'PC{i}', price=1000 + i, user_id=user.id) for i in range(20)])
+    db.commit()
+
+    # 従来の書き方と現在の書き方の組
+    cases = [
+        ('find_by_id', lambda: legacy_find_by_id(db, 5, user.id), lambda: item_cruds.find_by_id(db, 5, user.id)),
+        ('find_by_name', lambda: legacy_find_by_name(db, 'PC1'), lambda: item_cruds.find_by_name(db, 'PC1')),
+        ('find_all', lambda: db.query(Item).order_by(Item.id).all(), lambda: item_cruds.find_all(db)),
+        # authenticate_user のうちユーザー検索の部分（PBKDF2は変わらないため除く）
+        (
+            'user lookup',
+            lambda: legacy_find_user(db, 'seller'),
+            lambda: db.scalars(auth_cruds._FIND_USER_BY_USERNAME, {'username': 'seller'}).first(),
+        ),
+    ]
+    print(f'calls={args.calls} (min of {args.rounds} rounds, CPU us per call)')
+    for name, legacy, prebuilt in cases:
+        # それぞれ複数回計測して、最小値を比べる
+        legacy_us = min(cpu_per_call(legacy, args.calls) for _ in range(args.rounds))
+        statement_cache.reset()
+        prebuilt_us = min(cpu_per_call(prebuilt, args.calls) for _ in range(args.rounds))
+        hit_rate = statement_cache.snapshot()['hit_rate']
+        print(
+            f'{name:<12} legacy={legacy_us:7.1f}us prebuilt={prebuilt_us:7.1f}us '
+            f'saved={legacy_us - prebuilt_us:6.1f}us ({1 - prebuilt_us / legacy_us:4.0%}) cache hit rate={hit_rate:.4f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# 処理時間計測ミドルウェアのベンチマーク
+# このファイルは、以前の @app.middleware("http")（BaseHTTPMiddleware）による計測と、
+# ASGIミドルウェア（TimingMiddleware）による計測のオーバーヘッドを比べます
+# HTTPサーバーを介さずに、concurrency 件ずつ同時にASGIアプリケーションを呼び出して1リクエストあたりの時間を計測します
+#
+# 実行例:
+#   python benchmarks/timing_middleware.py --requests 20000 --concurrency 100
+
+import argparse  # コマンドライン引数
+import asyncio  # 非同期処理
+import os  # 環境変数
+import sys  # インポートパスの設定
+import time  # 時間計測
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('SQLALCHEMY_DATABASE_URL', 'sqlite://')
+
+from fastapi import FastAPI, Request  # 計測対象のアプリケーション
+from timing import TimingMiddleware, TimedRoute  # 処理時間の計測
+
+
+def make_app(middleware):
+    app = FastAPI()
+    app.router.route_class = TimedRoute
+
+    @app.get('/items/{id}')
+    async def find_by_id(id: int):
+        return {'id': id, 'name': 'PC', 'price': 10000}
+
+    if middleware == 'base_http':
+        # 以前の main.add_process_time_header と同じ実装
+        @app.middleware('http')
+        async def add_process_time_header(request: Request, call_next):
+            start_time = time.time()
+            response = await call_next(request)
+            process_time = time.time() - start_time
+            response.headers['X-Process-Time'] = str(process_time)
+            return response
+    elif middleware == 'asgi':
+        app.add_middleware(TimingMiddleware)
+    return app
+
+
+async def run(app, requests, concurrency):
+    # concurrency 件ずつ同時に処理し、1リクエストあたりの時間（マイクロ秒）を返す
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/items/1', 'raw_path': b'/items/1', 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'accept', b'*/*')],
+        'client': ('127.0.0.1', 1234), 'server': ('localhost', 80),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    async def batch():
+        await asyncio.gather(*(app(dict(scope), receive, send) for _ in range(concurrency)))
+
+    for _ in range(max(1, requests // concurrency // 10)):
+        await batch()
+    start = time.perf_counter()
+    for _ in range(requests // concurrency):
+        await batch()
+    return (time.perf_counter() - start) / (requests // concurrency * concurrency) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing middleware overhead benchmark')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    variants = {
+        'no middleware': make_app(None),
+        'BaseHTTPMiddleware (before)': make_app('base_http'),
+        'TimingMiddleware (ASGI)': make_app('asgi'),
+    }
+    # 実行順やウォームアップの影響を減らすため、各方式を交互に計測して最小値を使う
+    results = {name: float('inf') for name in variants}
+    for _ in range(args.rounds):
+        for name, app in variants.items():
+            results[name] = min(results[name], asyncio.run(run(app, args.requests, args.concurrency)))
+    baseline = results['no middleware']
+    for name, elapsed in results.items():
+        print(f'{name:<30} {elapsed:8.2f} us/request  {1e6 / elapsed:9.0f} req/s  overhead {elapsed - baseline:+7.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+# 同時実行数の制限とロードシェディング機能ファイル
+# このファイルは、データベースが遅くなったときにリクエストが際限なく溜まらないよう、ルーターの手前で同時実行数を制限します
+# - 同時実行数の上限は AIMD（応答が目標時間内なら少しずつ増やし、超えたら一定の割合で減らす）で自動調整します
+# - 上限を超えたリクエストは、ルートごとの優先度付きの有限のキューで待ちます（認証 → 商品の閲覧 → 書き込み → その他の順）
+# - 期限（X-Request-Timeout ヘッダー、またはルートごとの既定値）を過ぎたリクエストは、データベースに届く前に捨てます
+# - キューが満杯の場合は、待たせずにすぐ 503 と Retry-After ヘッダーを返します
+# 上限・処理中の数・キューの長さ・捨てた数は GET /metrics で確認できます
+# 注意：上限はAPIプロセス（uvicornのワーカー）ごとに管理します
+
+# 必要なライブラリをインポート
+import asyncio  # 待機中のリクエストの管理
+from collections import Counter  # 捨てた数の集計
+from dataclasses import dataclass, field  # 待機中のリクエストの入れ物
+import heapq  # 優先度付きキュー
+import itertools  # 到着順の番号
+import json  # エラーレスポンスの本文
+import time  # 時間計測
+from config import get_settings
+import timing  # キューで待った時間の記録
+
+
+# ルートごとの優先度と既定の期限（秒）
+# (メソッド（None は全て）, パスの先頭, 優先度（小さいほど先に処理）, 既定の期限)
+ROUTE_RULES = (
+    # ログイン・トークンの更新（他の全てのAPIの前提になるため最優先）
+    (None, '/auth', 0, 5.0),
+    # 商品の閲覧・検索（ユーザーが画面の表示を待っている）
+    ('GET', '/items', 1, 3.0),
+    # 商品の出品・更新・削除・購入
+    (None, '/items', 2, 10.0),
+)
+# どのルールにも当てはまらないルート（統計・プロファイリングなど）の優先度と既定の期限
+DEFAULT_PRIORITY = 3
+DEFAULT_TIMEOUT = 10.0
+# 制限の対象外のパス（過負荷の状態を調べるための計測値やドキュメント）
+EXEMPT_PATHS = ('/metrics', '/static', '/docs', '/redoc', '/openapi.json')
+# リクエストの期限をクライアントから指定するヘッダー（秒）
+TIMEOUT_HEADER = b'x-request-timeout'
+# 503 を返すときにクライアントへ再試行を待ってもらう秒数
+RETRY_AFTER = 1
+
+
+def route_rule(method: str, path: str):
+    """
+    リクエストの (優先度, 既定の期限) を返す関数
+    """
+    for rule_method, prefix, priority, timeout in ROUTE_RULES:
+        if (rule_method is None or rule_method == method) and path.startswith(prefix):
+            return priority, timeout
+    return DEFAULT_PRIORITY, DEFAULT_TIMEOUT
+
+
+class AIMDLimit:
+    """
+    同時実行数の上限を AIMD で調整するクラス
+    - 応答が latency_target 秒以内で、上限の半分以上を使っていれば、上限を 1/上限 ずつ増やします（おおよそ上限分の応答ごとに+1）
+    - 応答が latency_target 秒を超えた、またはサーバーエラーになった場合は、上限に backoff を掛けて減らします
+    上限を下げる前に受け付けたリクエストの応答では再び下げないため、遅い応答がまとめて返ってきても上限は1回だけ下がります
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, latency_target: float, backoff: float = 0.9):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self._decreased_at = 0.0
+
+    @property
+    def value(self):
+        return max(self.min_limit, int(self.limit))
+
+    def on_sample(self, started_at: float, latency: float, inflight: int, failed: bool):
+        """
+        1件の応答の結果から上限を更新する関数
+        """
+        if failed or latency > self.latency_target:
+            if started_at >= self._decreased_at:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._decreased_at = time.monotonic()
+        elif inflight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class Shed(Exception):
+    """
+    リクエストを捨てたことを表す例外
+    reason は queue_full（キューが満杯）・evicted（優先度の高いリクエストに押し出された）・deadline（期限切れ）のいずれかです
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass(order=True)
+class _Waiter:
+    # キューで待機中のリクエスト（優先度・到着順に並ぶ）
+    priority: int
+    seq: int
+    deadline: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class ConcurrencyLimiter:
+    """
+    同時実行数を制限し、上限を超えたリクエストを優先度付きのキューで待たせるクラス
+    1つのイベントループの中だけで使うため、ロックは使いません
+    """
+
+    def __init__(self, limit: AIMDLimit, queue_size: int):
+        self.limit = limit
+        self.queue_size = queue_size
+        # 処理中のリクエスト数
+        self.inflight = 0
+        # 捨てた理由ごとの数
+        self.shed = Counter()
+        # 待機中のリクエストの優先度付きキュー（期限切れ・押し出し・キャンセルで抜けたリクエストも、取り出すか詰め直すまで残る）
+        self._heap = []
+        # 待機中のリクエスト数（_heap のうちまだ抜けていないもの）
+        self._queued = 0
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int, deadline: float):
+        """
+        処理を始めてよくなるまで待つ関数
+        捨てられた場合は Shed 例外を送出します。処理が終わったら必ず release を呼んでください
+        """
+        if self.inflight < self.limit.value and self._queued == 0:
+            self.inflight += 1
+            return
+        if deadline <= time.monotonic():
+            self._shed('deadline')
+        if self._queued >= self.queue_size:
+            self._make_room(priority)
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), deadline, loop.create_future())
+        heapq.heappush(self._heap, waiter)
+        self._queued += 1
+        # 期限になったらキューから外す（イベントループ上で動くため、順番が回ってくる処理と競合しません）
+        timer = loop.call_at(loop.time() + deadline - time.monotonic(), self._expire, waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # クライアントが切断した場合など
+            if waiter.future.cancelled():
+                self._remove()
+            elif waiter.future.exception() is None:
+                # 順番が回ってきた直後にキャンセルされた場合は、受け取った枠を返す
+                self.inflight -= 1
+                self._grant()
+            raise
+        finally:
+            timer.cancel()
+
+    def release(self, started_at: float, failed: bool = False):
+        """
+        処理が終わったことを知らせる関数
+        応答時間から上限を調整し、空いた枠をキューの先頭のリクエストに渡します
+        """
+        self.limit.on_sample(started_at, time.monotonic() - started_at, self.inflight, failed)
+        self.inflight -= 1
+        self._grant()
+
+    def _grant(self):
+        # 上限に空きがある間、優先度の高い順に処理を始めさせる（期限切れのリクエストは捨てる）
+        while self._heap and self.inflight < self.limit.value:
+            waiter = heapq.heappop(self._heap)
+            if waiter.future.done():
+                continue
+            self._queued -= 1
+            if waiter.deadline <= time.monotonic():
+                self._reject(waiter, 'deadline')
+                continue
+            self.inflight += 1
+            waiter.future.set_result(None)
+
+    def _make_room(self, priority: int):
+        # キューが満杯の場合、より優先度の低いリクエストがあれば押し出し、なければ到着したリクエストを捨てる
+        lowest = max((waiter for waiter in self._heap if not waiter.future.done()), default=None)
+        if lowest is None or lowest.priority <= priority:
+            self._shed('queue_full')
+        self._reject(lowest, 'evicted')
+        self._remove()
+
+    def _expire(self, waiter: _Waiter):
+        if not waiter.future.done():
+            self._reject(waiter, 'deadline')
+            self._remove()
+
+    def _remove(self):
+        # 待機中のリクエストがキューから抜けたことを記録する
+        # 抜けたリクエストが待機中のリクエストより多くなったら詰め直し、_heap の長さを待機中の数の2倍以内に保つ
+        # （_make_room の走査と _grant の取り出しが、抜けたリクエストの分だけ遅くならないようにするため）
+        self._queued -= 1
+        if len(self._heap) > 2 * self._queued:
+            self._heap = [waiter for waiter in self._heap if not waiter.future.done()]
+            heapq.heapify(self._heap)
+
+    def _reject(self, waiter: _Waiter, reason: str):
+        self.shed[reason] += 1
+        waiter.future.set_exception(Shed(reason))
+
+    def _shed(self, reason: str):
+        self.shed[reason] += 1
+        raise Shed(reason)
+
+    def snapshot(self):
+        """
+        現在の上限・処理中の数・キューの長さ・捨てた数を返す関数
+        """
+        return {
+            'limit': self.limit.value,
+            'inflight': self.inflight,
+            'queued': self._queued,
+            'shed': {reason: self.shed[reason] for reason in ('queue_full', 'evicted', 'deadline')},
+        }
+
+
+def _create_limiter():
+    settings = get_settings()
+    if settings.concurrency_limit <= 0:
+        return None
+    return ConcurrencyLimiter(
+        AIMDLimit(
+            settings.concurrency_limit,
+            min_limit=1,
+            max_limit=settings.concurrency_max_limit,
+            latency_target=settings.concurrency_latency_target,
+        ),
+        settings.concurrency_queue_size,
+    )
+
+
+# アプリケーション全体で共有する同時実行数の制限（concurrency_limit が0の場合は None）
+limiter = _create_limiter()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    同時実行数を制限するASGIミドルウェア
+    捨てたリクエストには、アプリケーションを呼び出さずに 503 と Retry-After ヘッダーを返します
+    """
+
+    def __init__(self, app, concurrency_limiter=None):
+        self.app = app
+        self.limiter = concurrency_limiter if concurrency_limiter is not None else limiter
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http'
+            or self.limiter is None
+            or scope['method'] == 'OPTIONS'
+            or scope['path'].startswith(EXEMPT_PATHS)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        priority, timeout = route_rule(scope['method'], scope['path'])
+        deadline = time.monotonic() + _request_timeout(scope, timeout)
+        queued_at = time.perf_counter()
+        try:
+            await self.limiter.acquire(priority, deadline)
+        except Shed as e:
+            timing.record('queue', time.perf_counter() - queued_at)
+            await _reject(send, e.reason)
+            return
+        # キューで待った時間を Server-Timing の queue として記録する（検証・シリアライズの時間と区別するため）
+        timing.record('queue', time.perf_counter() - queued_at)
+
+        started_at = time.monotonic()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.limiter.release(started_at, failed=status_code >= 500)
+
+
+def _request_timeout(scope, default: float):
+    # クライアントが指定した期限（秒）。指定がない・不正な場合はルートの既定値
+    for name, value in scope.get('headers', []):
+        if name == TIMEOUT_HEADER:
+            try:
+                timeout = float(value)
+            except ValueError:
+                return default
+            return timeout if timeout > 0 else default
+    return default
+
+
+async def _reject(send, reason: str):
+    detail = 'Request deadline exceeded' if reason == 'deadline' else 'Server is overloaded'
+    body = json.dumps({'detail': detail}).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': 503,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'retry-after', str(RETRY_AFTER).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
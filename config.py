@@ -6,6 +6,90 @@ class Settings(BaseSettings):
     secret_key: str
     sqlalchemy_database_url: str
 
+    # psycopg（バージョン3）で同じSQL文を何回実行したらサーバー側のプリペアドステートメントにするか（負の値で無効）
+    db_prepare_threshold: int = 5
+
+    # 認証トークン関連の設定
+    # アクセストークンの有効期限（分）
+    access_token_minutes: int = 20
+    # アクセストークンの有効期限を短くする割合の最大値（多数のクライアントが同時に期限切れにならないようにする）
+    access_token_jitter: float = 0.1
+    # リフレッシュトークンの有効期限（日）
+    refresh_token_days: int = 14
+
+    # バックグラウンドジョブ関連の設定
+    # APIプロセス内で動かすワーカー数（0にすると組み込みワーカーを無効化し、jobs.workerを別プロセスで起動します）
+    job_workers: int = 2
+    # キューを確認する間隔（秒）
+    job_poll_interval: float = 1.0
+    # ジョブを取得してから他のワーカーに見えなくなる時間（秒）
+    job_visibility_timeout: int = 60
+    # 最大試行回数（超えると FAILED になります）
+    job_max_attempts: int = 5
+    # リトライ間隔の基準値と上限（秒）
+    job_retry_base: float = 2.0
+    job_retry_max: float = 600.0
+
+    # 同時実行数の制限関連の設定
+    # 同時に処理するリクエスト数の初期値（応答時間に応じて自動で増減する。既定で有効。0の場合は制限しない）
+    concurrency_limit: int = 20
+    # 同時に処理するリクエスト数の最大値
+    concurrency_max_limit: int = 200
+    # 上限を超えたリクエストを待たせるキューの長さ（満杯の場合は503を返す）
+    concurrency_queue_size: int = 100
+    # 応答時間の目標（秒）。超えた場合は同時に処理するリクエスト数を減らす
+    concurrency_latency_target: float = 0.5
+
+    # 商品テーブルのシャーディング関連の設定
+    # 商品を保存するシャードのデータベースURL（カンマ区切り。空の場合はシャーディングしない）
+    shard_database_urls: str = ''
+    # コンシステントハッシュで各シャードをリングに配置する仮想ノード数
+    shard_vnodes: int = 64
+    # 商品IDを予約する単位
+    shard_id_block_size: int = 100
+
+    # 書き込みのグループコミット関連の設定
+    # 商品の書き込みをまとめる待ち時間（ミリ秒。0の場合はまとめずに個別にコミットする）
+    write_batch_window_ms: float = 0.0
+    # 1つのトランザクションにまとめる書き込みの最大数
+    write_batch_max_size: int = 64
+
+    # 売り切れ商品のアーカイブ関連の設定
+    # 売り切れになってからアーカイブするまでの日数（0の場合はアーカイブしない）
+    archive_after_days: int = 30
+    # アーカイブの定期ジョブの実行間隔（秒）
+    archive_interval: int = 3600
+    # 1つのトランザクションで移動する商品の数
+    archive_batch_size: int = 500
+
+    # 類似商品の索引関連の設定
+    # 索引を保存するディレクトリ（全てのプロセスから読める場所。空の場合は保存せず、各プロセスがデータベースから作成する）
+    similar_index_dir: str = ''
+    # 索引を作り直す間隔（秒）。変更履歴はこの2倍の時間だけ残す
+    similar_rebuild_interval: int = 3600
+    # 商品の変更と、他のプロセスが保存した新しい索引を確認する間隔（秒）
+    similar_reload_interval: float = 10.0
+
+    # 統計情報の集計テーブルを商品テーブルと照合し直す間隔（秒）
+    stats_reconcile_interval: int = 3600
+    # 統計APIの結果をプロセス内に保持する時間（秒）
+    stats_cache_ttl: float = 1.0
+
+    # リクエスト単位のプロファイリング関連の設定
+    # X-Profile ヘッダーで計測を有効にするためのトークン（空の場合はヘッダーによる計測と結果の取得APIを無効化）
+    profiling_token: str = ''
+    # N件に1件のリクエストを計測する（0の場合はサンプリングしない）
+    profiling_sample_rate: int = 0
+    # スタックを記録する間隔（秒）
+    profiling_interval: float = 0.005
+    # プロセス内に保持する計測結果の件数
+    profiling_keep: int = 50
+    # 計測結果を書き出すディレクトリ（空の場合は書き出さない）
+    profiling_dir: str = ''
+
+    # 計測値関連の設定
+    # GET /metrics を取得するためのトークン（X-Metrics-Token ヘッダーで指定。空の場合は計測値のAPIを無効化）
+    metrics_token: str = ''
 
     model_config = SettingsConfigDict(env_file='.env')
 
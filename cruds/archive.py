@@ -0,0 +1,84 @@
+# 商品のアーカイブ関連のビジネスロジックファイル
+# このファイルは、古い売り切れ商品を商品テーブル（ホット）からアーカイブテーブル（コールド）へ移動する処理を担当します
+# 通常の検索は商品テーブルだけを対象にし、アーカイブ済みの商品は明示的に指定した場合だけ返します
+# 統計情報は商品テーブルにある商品だけを集計するため、移動・復元のたびに差分を反映します
+
+# 必要なライブラリをインポート
+from datetime import datetime, timedelta  # 日時計算
+from sqlalchemy import select  # SQL文の組み立て
+from sqlalchemy.exc import IntegrityError  # 一意制約違反
+from sqlalchemy.orm import Session  # データベースセッション
+from models import Item, ArchivedItem  # データベースモデル
+from schemas import ItemStatus  # 商品の状態
+from jobs import queue  # バックグラウンドジョブのキュー
+from cruds import stats  # 統計情報の差分更新
+from config import get_settings
+
+
+# 商品テーブルとアーカイブテーブルで共通の列
+_COLUMNS = ('id', 'name', 'price', 'description', 'status', 'created_at', 'updated_at', 'user_id')
+
+
+def archive_sold_out(db: Session, older_than: timedelta | None = None, batch_size: int | None = None):
+    """
+    売り切れから older_than 以上経った商品をアーカイブテーブルへ移動する関数
+    batch_size 件ずつ別のトランザクションでコミットするため、大量の商品があってもロックを長く持ちません
+    移動した商品の数を返します
+    """
+    settings = get_settings()
+    if older_than is None:
+        older_than = timedelta(days=settings.archive_after_days)
+    batch_size = batch_size or settings.archive_batch_size
+    cutoff = datetime.now() - older_than
+
+    archived = 0
+    while True:
+        items = db.scalars(
+            select(Item)
+            .where(Item.status == ItemStatus.SOLD_OUT, Item.updated_at < cutoff)
+            .order_by(Item.id)
+            .limit(batch_size)
+        ).all()
+        if not items:
+            return archived
+        for item in items:
+            db.add(ArchivedItem(**{column: getattr(item, column) for column in _COLUMNS}))
+            db.delete(item)
+            stats.apply_change(db, stats.snapshot(item), None)
+        db.commit()
+        archived += len(items)
+
+
+def find_by_id(db: Session, id: int, user_id: int):
+    """
+    指定されたIDのアーカイブ済みの商品を取得する関数
+    自分の商品のみ取得可能です
+    """
+    return db.scalars(
+        select(ArchivedItem).where(ArchivedItem.id == id).where(ArchivedItem.user_id == user_id)
+    ).first()
+
+
+def restore(db: Session, id: int, user_id: int):
+    """
+    アーカイブ済みの商品を商品テーブルへ戻す関数
+    自分の商品のみ復元可能で、見つからない場合はNoneを返します
+    商品テーブルに同じIDの商品が既にある場合も、復元せずにNoneを返します
+    復元した商品がすぐに再びアーカイブされないよう、更新日時は現在の日時にします
+    """
+    archived_item = find_by_id(db, id, user_id)
+    if archived_item is None or db.get(Item, id) is not None:
+        return None
+    item = Item(**{column: getattr(archived_item, column) for column in _COLUMNS if column != 'updated_at'})
+    db.delete(archived_item)
+    db.add(item)
+    stats.apply_change(db, None, stats.snapshot(item))
+    queue.enqueue(db, 'item.changed', {'item_id': item.id, 'user_id': user_id, 'action': 'restored'})
+    try:
+        db.commit()
+    except IntegrityError:
+        # 確認後に同じIDの商品が作成された場合
+        db.rollback()
+        return None
+    db.refresh(item)
+    return item
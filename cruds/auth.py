@@ -6,15 +6,22 @@
 from datetime import datetime, timedelta  # 日時と時間計算
 import hashlib  # パスワードのハッシュ化
 import base64  # バイナリデータのエンコード/デコード
+import hmac  # リフレッシュトークンのハッシュ化
 import os  # ランダムデータ生成
+import random  # 有効期限のゆらぎ（ジッター）
+import secrets  # リフレッシュトークンの生成
 from typing import Annotated  # 型注釈
 from fastapi import Depends  # 依存関係注入
 from fastapi.security import OAuth2PasswordBearer  # OAuth2認証スキーム
 from jose import jwt, JWTError  # JWTトークンの生成・検証
+from sqlalchemy import select, update, delete, bindparam  # SQL文の組み立て
 from sqlalchemy.orm import Session  # データベースセッション
 from schemas import UserCreate, DecodedToken  # データスキーマ
-from models import User  # ユーザーモデル
+from models import User, RefreshToken  # データベースモデル
 from config import get_settings
+from jobs import queue  # バックグラウンドジョブのキュー
+from cruds import stats  # 統計情報の差分更新
+import timing  # 処理時間の計測
 
 
 # JWTトークンの暗号化アルゴリズム
@@ -25,6 +32,9 @@ SECRET_KEY = get_settings().secret_key
 # OAuth2パスワード認証スキーム（ログインエンドポイントを指定）
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/auth/login')
 
+# ログイン時のユーザー検索のSQL文（一度だけ組み立てて使い回す）
+_FIND_USER_BY_USERNAME = select(User).where(User.username == bindparam('username'))
+
 
 def create_user(db: Session, user_create: UserCreate):
     """
@@ -46,19 +56,40 @@ def create_user(db: Session, user_create: UserCreate):
     )
     # データベースにユーザーを追加
     db.add(new_user)
+    # IDを確定させてから、副作用のジョブを同じトランザクションに登録
+    db.flush()
+    queue.enqueue(db, 'user.created', {'user_id': new_user.id})
     # 変更を保存
     db.commit()
 
     return new_user
 
 
+def delete_user(db: Session, user_id: int):
+    """
+    ユーザーを削除する関数
+    出品した商品とアーカイブ済みの商品も一緒に削除し、商品の削除を統計情報と副作用のジョブにも反映します
+    （User を直接削除すると、カスケードで消える商品の分だけ統計情報がずれるため、必ずこの関数を使ってください）
+    ユーザーが見つからない場合はNoneを返します
+    """
+    user = db.get(User, user_id)
+    if user is None:
+        return None
+    for item in user.items:
+        stats.apply_change(db, stats.snapshot(item), None)
+        queue.enqueue(db, 'item.changed', {'item_id': item.id, 'user_id': user_id, 'action': 'deleted'})
+    db.delete(user)
+    db.commit()
+    return user
+
+
 def authenticate_user(db: Session, username: str, password: str):
     """
     ユーザー認証を行う関数
     ユーザー名とパスワードを確認し、正しければユーザー情報を返します
     """
     # ユーザー名でユーザーを検索
-    user = db.query(User).filter(User.username == username).first()
+    user = db.scalars(_FIND_USER_BY_USERNAME, {'username': username}).first()
     if not user:
         # ユーザーが見つからない場合はNoneを返す
         return None
@@ -88,14 +119,118 @@ def create_access_token(username: str, user_id: int, expires_delta: timedelta):
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def access_token_expires():
+    """
+    アクセストークンの有効期間を計算する関数
+    設定した期間から最大 access_token_jitter の割合だけランダムに短くし、
+    同時にログインした多数のクライアントのトークンが同時に期限切れにならないようにします
+    """
+    settings = get_settings()
+    minutes = settings.access_token_minutes * (1 - random.uniform(0, settings.access_token_jitter))
+    return timedelta(minutes=minutes)
+
+
+def _hash_refresh_token(token: str):
+    # リフレッシュトークンのHMAC-SHA256ハッシュ値を計算（パスワードのような遅いハッシュは不要）
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+def create_refresh_token(db: Session, user_id: int, family_id: str | None = None):
+    """
+    リフレッシュトークンを発行する関数
+    family_id を省略すると新しいファミリーを作成します（ログイン時）
+    データベースにはハッシュ値だけを保存し、トークン本体を返します
+    """
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        token_hash=_hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        user_id=user_id,
+        expires_at=datetime.now() + timedelta(days=get_settings().refresh_token_days),
+    ))
+    db.commit()
+    return token
+
+
+def rotate_refresh_token(db: Session, token: str):
+    """
+    リフレッシュトークンを使って新しいリフレッシュトークンを発行する関数
+    パスワードのハッシュ計算は行わず、HMAC計算と一意インデックスでの検索1回でトークンを確認します
+    成功した場合は (ユーザー, 新しいリフレッシュトークン) を返し、失敗した場合はNoneを返します
+    使用済みのトークンが再び使われた場合は、同じファミリーのトークンを全て無効化します
+    """
+    # トークンとユーザー名を1回の検索で取得
+    found = db.execute(
+        select(RefreshToken, User)
+        .join(User, User.id == RefreshToken.user_id)
+        .where(RefreshToken.token_hash == _hash_refresh_token(token))
+    ).first()
+    if found is None:
+        return None
+    refresh_token, user = found
+
+    if refresh_token.expires_at < datetime.now():
+        # 期限切れ
+        return None
+    if refresh_token.revoked or refresh_token.used:
+        # 使用済みのトークンの再利用（盗まれた可能性がある）
+        revoke_family(db, refresh_token.family_id)
+        return None
+
+    # 未使用の場合だけ使用済みにする（同時に同じトークンが使われた場合は1つだけ成功する）
+    claimed = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == refresh_token.id, RefreshToken.used.is_(False))
+        .values(used=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        revoke_family(db, refresh_token.family_id)
+        return None
+
+    # 同じファミリーの新しいトークンを発行（使用済みへの変更と一緒にコミットされる）
+    new_token = create_refresh_token(db, user.id, refresh_token.family_id)
+    return user, new_token
+
+
+def revoke_family(db: Session, family_id: str):
+    """
+    同じファミリーのリフレッシュトークンを全て無効化する関数
+    """
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id)
+        .values(revoked=True)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def delete_expired_refresh_tokens(db: Session):
+    """
+    期限切れのリフレッシュトークンを削除する関数
+    削除した件数を返します
+    """
+    result = db.execute(
+        delete(RefreshToken)
+        .where(RefreshToken.expires_at < datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
 def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     """
     現在のユーザー情報を取得する関数
     JWTトークンからユーザー情報を復号化して返します
+    処理時間は Server-Timing ヘッダーの auth に計上されます
     """
     try:
         # JWTトークンを復号化
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with timing.phase('auth'):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         # ペイロードからユーザー情報を取得
         username = payload.get('sub')
         user_id = payload.get('id')
@@ -3,17 +3,55 @@
 # データベースとの直接的なやり取りを行い、商品データの管理を行います
 
 # 必要なライブラリをインポート
+import heapq  # 並び順を保った結合
+from operator import attrgetter  # 並び順のキー
+from sqlalchemy import select, bindparam  # SQL文の組み立て
 from sqlalchemy.orm import Session  # データベースセッション
-from schemas import ItemCreate, ItemUpdate  # データスキーマ（入力データの形式）
-from models import Item  # データベースモデル（商品テーブル）
+from schemas import ItemCreate, ItemUpdate, ItemStatus  # データスキーマ（入力データの形式）
+from models import Item, ArchivedItem  # データベースモデル（商品テーブル・アーカイブテーブル）
+from jobs import queue  # バックグラウンドジョブのキュー
+from cruds import stats  # 統計情報の差分更新
+import sharding  # 商品テーブルのシャーディング
+import similarity  # 類似商品の索引
 
 
-def find_all(db: Session):
+# よく使う検索のSQL文（モジュールの読み込み時に一度だけ組み立て、値は bindparam で実行時に渡す）
+# 同じSQL文のオブジェクトを使い回すため、呼び出しごとの式の組み立てとキャッシュキーの計算が不要になり、
+# コンパイル済みのSQLもエンジンのキャッシュから毎回再利用されます
+_FIND_ALL = {model: select(model).order_by(model.id) for model in (Item, ArchivedItem)}
+_FIND_BY_NAME = {
+    model: select(model).where(model.name.like(bindparam('pattern'))).order_by(model.id)
+    for model in (Item, ArchivedItem)
+}
+_FIND_BY_ID = select(Item).where(Item.id == bindparam('id'), Item.user_id == bindparam('user_id'))
+_FIND_ON_SALE_BY_IDS = (
+    select(Item)
+    .where(Item.id.in_(bindparam('ids', expanding=True)), Item.status == ItemStatus.ON_SALE)
+    .order_by(Item.id)
+)
+
+# 類似商品を探すときに、販売中でなくなった商品を除く分として多めに探す倍率と、探す件数の上限
+_SIMILAR_OVERFETCH = 2
+_SIMILAR_MAX_FETCH = 200
+
+
+def _search(db: Session, statements: dict, include_archived: bool, params: dict | None = None):
+    # 商品テーブル（指定された場合はアーカイブテーブルも）を検索し、ID順に結合して返す
+    results = [
+        sharding.scatter(db, statements[model], key=attrgetter('id'), params=params)
+        for model in ((Item, ArchivedItem) if include_archived else (Item,))
+    ]
+    return list(heapq.merge(*results, key=attrgetter('id')))
+
+
+def find_all(db: Session, include_archived: bool = False):
     """
     全ての商品を取得する関数
-    データベース内の全ての商品情報を返します
+    データベース内の全ての商品情報をID順に返します
+    include_archived が True の場合は、アーカイブ済みの商品も含めます
+    シャーディングしている場合は全シャードに並列で問い合わせて結合します
     """
-    return db.query(Item).all()
+    return _search(db, _FIND_ALL, include_archived)
 
 
 def find_by_id(db: Session, id: int, user_id: int):
@@ -21,17 +59,48 @@ def find_by_id(db: Session, id: int, user_id: int):
     指定されたIDの商品を取得する関数
     特定の商品IDとユーザーIDに一致する商品を検索します
     自分の商品のみ取得可能です
+    シャーディングしている場合は、出品者のシャードだけに問い合わせます
     """
-    return db.query(Item).filter(Item.id == id).filter(Item.user_id == user_id).first()
+    return db.scalars(_FIND_BY_ID, {'id': id, 'user_id': user_id}).first()
 
 
-def find_by_name(db: Session, name: str):
+def find_by_name(db: Session, name: str, include_archived: bool = False):
     """
     商品名で検索する関数
     商品名に指定された文字列が含まれる商品を全て取得します
     部分一致検索が可能です（例：「PC」で検索すると「PC1」「PC2」などがヒット）
+    include_archived が True の場合は、アーカイブ済みの商品も含めます
+    シャーディングしている場合は全シャードに並列で問い合わせて結合します
     """
-    return db.query(Item).filter(Item.name.like(f'%{name}%')).all()
+    return _search(db, _FIND_BY_NAME, include_archived, {'pattern': f'%{name}%'})
+
+
+def find_similar(db: Session, id: int, k: int = 10):
+    """
+    指定された商品に似ている販売中の商品を取得する関数
+    商品名と説明の文字n-gramのTF-IDFベクトルのコサイン類似度が高い順に、最大 k 件の {item, score} を返します
+    商品が見つからない場合はNoneを返します（索引の準備ができていない場合は空の一覧を返します）
+    """
+    item = db.get(Item, id)
+    if item is None:
+        return None
+    index = similarity.get_index()
+    if index is None:
+        return []
+    # 索引への反映前に売り切れ・削除された商品を除いても k 件残るよう、多めに探す
+    fetch = k * _SIMILAR_OVERFETCH
+    while True:
+        [neighbors] = index.similar([(item.id, item.name, item.description)], fetch)
+        scores = dict(neighbors)
+        found = sharding.scatter(db, _FIND_ON_SALE_BY_IDS, key=attrgetter('id'), params={'ids': list(scores)}) if scores else []
+        # 足りない場合は、索引にそれ以上の候補がないか上限に達するまで広げて探し直す
+        if len(found) >= k or len(neighbors) < fetch or fetch >= _SIMILAR_MAX_FETCH:
+            break
+        fetch = min(fetch * 4, _SIMILAR_MAX_FETCH)
+    return sorted(
+        ({'item': found_item, 'score': scores[found_item.id]} for found_item in found),
+        key=lambda result: (-result['score'], result['item'].id),
+    )[:k]
 
 
 def create(db: Session, item_create: ItemCreate, user_id: int):
@@ -46,6 +115,10 @@ def create(db: Session, item_create: ItemCreate, user_id: int):
     )
     # データベースに新しい商品を追加
     db.add(new_item)
+    # IDを確定させてから、統計情報と副作用のジョブを同じトランザクションで更新
+    db.flush()
+    stats.apply_change(db, None, stats.snapshot(new_item))
+    queue.enqueue(db, 'item.changed', {'item_id': new_item.id, 'user_id': user_id, 'action': 'created'})
     # 変更を保存
     db.commit()
     return new_item
@@ -61,6 +134,8 @@ def update(db: Session, id: int, item_update: ItemUpdate, user_id: int):
     if item is None:
         # 商品が見つからない場合はNoneを返す
         return None
+    # 統計情報の差分を計算するため、変更前の値を記録
+    before = stats.snapshot(item)
 
     # 各項目を更新（Noneの場合は元の値を保持）
     item.name = item.name if item_update.name is None else item_update.name
@@ -75,6 +150,9 @@ def update(db: Session, id: int, item_update: ItemUpdate, user_id: int):
     )
     # 更新された商品をデータベースに保存
     db.add(item)
+    # 統計情報と副作用のジョブを同じトランザクションで更新
+    stats.apply_change(db, before, stats.snapshot(item))
+    queue.enqueue(db, 'item.changed', {'item_id': item.id, 'user_id': user_id, 'action': 'updated'})
     # 変更を保存
     db.commit()
     return item
@@ -92,6 +170,9 @@ def delete(db: Session, id: int, user_id: int):
         return None
     # 商品を削除
     db.delete(item)
+    # 統計情報と副作用のジョブを同じトランザクションで更新
+    stats.apply_change(db, stats.snapshot(item), None)
+    queue.enqueue(db, 'item.changed', {'item_id': item.id, 'user_id': user_id, 'action': 'deleted'})
     # 変更を保存
     db.commit()
     return item
@@ -0,0 +1,81 @@
+# 注文（購入）関連のビジネスロジックファイル
+# このファイルは、商品の購入処理と注文データの取得を担当します
+# 人気商品に購入が集中しても二重販売が起きないよう、条件付きUPDATEで商品を確保します
+
+# 必要なライブラリをインポート
+from datetime import datetime  # 日時
+from sqlalchemy import select, update  # SQL文の組み立て
+from sqlalchemy.exc import IntegrityError  # 一意制約違反
+from sqlalchemy.orm import Session  # データベースセッション
+from models import Item, Order  # データベースモデル
+from schemas import ItemStatus  # 商品の状態
+from jobs import queue  # バックグラウンドジョブのキュー
+from cruds import stats  # 統計情報の差分更新
+
+
+def find_by_idempotency_key(db: Session, buyer_id: int, idempotency_key: str):
+    """
+    冪等キーで注文を検索する関数
+    同じ購入者が同じキーで作成した注文があれば返します
+    """
+    return db.scalars(
+        select(Order).where(Order.buyer_id == buyer_id, Order.idempotency_key == idempotency_key)
+    ).first()
+
+
+def purchase(db: Session, item_id: int, buyer_id: int, idempotency_key: str | None = None):
+    """
+    商品を購入する関数
+    販売中（ON_SALE）の商品を1つのUPDATE文で売り切れ（SOLD_OUT）に変更し、成功した場合だけ注文を作成します
+    同時に何人が購入しても、UPDATEの更新件数が1になるのは1人だけです
+    購入できなかった場合（商品がない・売り切れ・自分の商品・同じ冪等キーの注文が先に作成された）はNoneを返します
+    冪等キー付きでNoneが返った場合、呼び出し元はキーで注文を検索し直して再送かどうかを判断します
+    """
+    # 売り切れ済みの商品は行ロックを取らずにすぐ返す（購入集中時に待ち行列を作らないため）
+    current_status = db.scalar(select(Item.status).where(Item.id == item_id))
+    if current_status != ItemStatus.ON_SALE:
+        return None
+
+    # 販売中の場合だけ売り切れに変更し、購入時点の商品情報を同じ文で受け取る
+    claimed = db.execute(
+        update(Item)
+        .where(Item.id == item_id, Item.status == ItemStatus.ON_SALE, Item.user_id != buyer_id)
+        .values(status=ItemStatus.SOLD_OUT, updated_at=datetime.now())
+        .returning(Item.name, Item.price, Item.user_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if claimed is None:
+        # 他の購入者が先に確保した、または自分の商品だった
+        db.rollback()
+        return None
+
+    # 注文を作成
+    order = Order(
+        item_id=item_id,
+        item_name=claimed.name,
+        price=claimed.price,
+        seller_id=claimed.user_id,
+        buyer_id=buyer_id,
+        idempotency_key=idempotency_key,
+    )
+    db.add(order)
+    try:
+        db.flush()
+    except IntegrityError:
+        # 同じ冪等キーの注文が同時に作成された場合は、商品の確保ごと取り消す
+        # （先に作成された注文が同じ商品の再送かどうかは、呼び出し元がキーで検索し直して確認する）
+        db.rollback()
+        return None
+
+    # 統計情報と通知などの副作用のジョブを同じトランザクションで更新
+    stats.apply_change(
+        db,
+        (claimed.user_id, ItemStatus.ON_SALE, claimed.price),
+        (claimed.user_id, ItemStatus.SOLD_OUT, claimed.price),
+    )
+    queue.enqueue(db, 'order.created', {'order_id': order.id, 'item_id': item_id, 'buyer_id': buyer_id})
+    # 売り切れになったことを類似商品の索引などに反映する
+    queue.enqueue(db, 'item.changed', {'item_id': item_id, 'user_id': claimed.user_id, 'action': 'purchased'})
+    # 変更を保存（行ロックを持つ時間を短くするため、確保後すぐにコミット）
+    db.commit()
+    return order
@@ -0,0 +1,225 @@
+# 統計情報関連のビジネスロジックファイル
+# このファイルは、商品数・価格の合計・価格分布を集計テーブルで管理します
+# 商品の作成・更新・削除のたびに差分だけを加算するため、統計の取得で商品テーブルを全件走査しません
+# 集計テーブルと商品テーブルのずれは、定期ジョブ（stats.reconcile）で補正します
+
+# 必要なライブラリをインポート
+from collections import defaultdict  # 集計用の辞書
+import math  # 対数計算
+import time  # キャッシュの有効期限
+from sqlalchemy import select, update, insert, func  # SQL文の組み立て
+from sqlalchemy.exc import IntegrityError  # 一意制約違反
+from sqlalchemy.orm import Session  # データベースセッション
+from models import Item, SellerStats, PriceBucket  # データベースモデル
+from schemas import ItemStatus  # 商品の状態
+from config import get_settings
+
+
+# 価格分布スケッチの相対誤差（1%）
+RELATIVE_ACCURACY = 0.01
+# バケットの幅（隣り合うバケットの境界の比）
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# 統計APIで返すパーセンタイル
+PERCENTILES = (25, 50, 75, 90, 99)
+
+# 状態ごとの統計情報のプロセス内キャッシュ（有効期限, 結果）
+# 他のプロセスでの変更は stats_cache_ttl 秒以内に反映されます
+_summary_cache = (0.0, None)
+
+
+def bucket_of(price: int):
+    """
+    価格が入るバケット番号を計算する関数
+    バケット i には gamma^(i-1) < 価格 <= gamma^i の商品が入ります
+    """
+    return math.ceil(math.log(price) / _LOG_GAMMA)
+
+
+def bucket_value(bucket: int):
+    """
+    バケットの代表値を計算する関数
+    バケット内のどの価格に対しても相対誤差が RELATIVE_ACCURACY 以内になる値を返します
+    """
+    return round(2 * _GAMMA ** bucket / (_GAMMA + 1))
+
+
+def snapshot(item: Item):
+    """
+    集計に必要な商品の情報（出品者・状態・価格）を取り出す関数
+    変更前後のスナップショットを apply_change に渡して差分を反映します
+    """
+    return (item.user_id, item.status, item.price)
+
+
+def apply_change(db: Session, before, after):
+    """
+    商品の変更を集計テーブルに反映する関数
+    before/after は snapshot の戻り値で、作成時は before、削除時は after に None を渡します
+    コミットはせず、呼び出し元の商品の変更と同じトランザクションに含めます
+    """
+    global _summary_cache
+    if before == after:
+        return
+    # このプロセスでの変更は次の取得から反映する
+    _summary_cache = (0.0, None)
+    if before is not None:
+        _add(db, *before, sign=-1)
+    if after is not None:
+        _add(db, *after, sign=1)
+
+
+def _add(db: Session, user_id: int, status: ItemStatus, price: int, sign: int):
+    # 出品者ごとの集計と価格分布の両方に加算（sign=-1なら減算）
+    _increment(db, SellerStats, {'user_id': user_id, 'status': status}, sign, sign * price)
+    _increment(db, PriceBucket, {'status': status, 'bucket': bucket_of(price)}, sign, sign * price)
+
+
+def _increment(db: Session, model, keys: dict, count: int, price: int):
+    # 集計行に加算する（行がなければ作成する）
+    # 加算は1つのUPDATE文で行うため、同時に更新されても値が失われません
+    where = [getattr(model, key) == value for key, value in keys.items()]
+    statement = (
+        update(model)
+        .where(*where)
+        .values(item_count=model.item_count + count, total_price=model.total_price + price)
+        .execution_options(synchronize_session=False)
+    )
+    if db.execute(statement).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(model).values(**keys, item_count=count, total_price=price))
+    except IntegrityError:
+        # 同時に他のトランザクションが行を作成した場合は、その行に加算する
+        db.execute(statement)
+
+
+def _percentiles(buckets: list, count: int):
+    # バケットを小さい順にたどり、各パーセンタイルの順位に達したバケットの代表値を返す
+    result = {}
+    targets = iter(PERCENTILES)
+    target = next(targets)
+    seen = 0
+    for bucket, bucket_count in buckets:
+        seen += bucket_count
+        while target is not None and seen > target / 100 * (count - 1):
+            result[f'p{target}'] = bucket_value(bucket)
+            target = next(targets, None)
+        if target is None:
+            break
+    return result
+
+
+def summary(db: Session):
+    """
+    状態ごとの統計情報を取得する関数
+    価格分布のバケット（価格の桁数に比例する数の行）だけを読み込んで、件数・合計・パーセンタイルを計算します
+    計算結果は stats_cache_ttl 秒間プロセス内に保持します
+    """
+    global _summary_cache
+    now = time.monotonic()
+    expires_at, cached = _summary_cache
+    if cached is not None and now < expires_at:
+        return cached
+    result = _compute_summary(db)
+    _summary_cache = (now + get_settings().stats_cache_ttl, result)
+    return result
+
+
+def _compute_summary(db: Session):
+    # 価格分布のバケットから状態ごとの統計情報を計算する
+    rows = db.execute(
+        select(PriceBucket.status, PriceBucket.bucket, PriceBucket.item_count, PriceBucket.total_price)
+        .where(PriceBucket.item_count > 0)
+        .order_by(PriceBucket.status, PriceBucket.bucket)
+    ).all()
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.status].append(row)
+
+    result = []
+    for status in ItemStatus:
+        buckets = grouped[status]
+        count = sum(row.item_count for row in buckets)
+        total_price = sum(row.total_price for row in buckets)
+        result.append({
+            'status': status,
+            'count': count,
+            'total_price': total_price,
+            'average_price': total_price / count if count else None,
+            'percentiles': _percentiles([(row.bucket, row.item_count) for row in buckets], count),
+        })
+    return result
+
+
+def find_by_seller(db: Session, user_id: int):
+    """
+    出品者ごとの統計情報を取得する関数
+    主キーで集計行を読み込むだけなので、出品数に関係なく一定時間で返します
+    """
+    rows = db.scalars(select(SellerStats).where(SellerStats.user_id == user_id)).all()
+    by_status = {row.status: row for row in rows}
+    statuses = []
+    for status in ItemStatus:
+        row = by_status.get(status)
+        count = row.item_count if row else 0
+        total_price = row.total_price if row else 0
+        statuses.append({
+            'status': status,
+            'count': count,
+            'total_price': total_price,
+            'average_price': total_price / count if count else None,
+        })
+    return {'user_id': user_id, 'statuses': statuses}
+
+
+def reconcile(db: Session):
+    """
+    集計テーブルを商品テーブルと照合して補正する関数
+    差分更新の取りこぼし（手動でのデータ修正など）によるずれを補正します
+    商品テーブルと集計テーブルを1つのSERIALIZABLEトランザクションで同じ時点の状態として読み、
+    ずれている集計行にだけ「正しい値 - 現在の値」を加算します。照合中に他のトランザクションが加算した分は上書きせず、
+    競合した場合はコミットが失敗します（定期ジョブのリトライで再実行されます）
+    補正した集計行の数を返します
+    """
+    global _summary_cache
+    # 照合は専用のトランザクションで行うため、呼び出し元のトランザクションは先に終える
+    db.commit()
+    db.connection(bind_arguments={'mapper': SellerStats.__mapper__}, execution_options={'isolation_level': 'SERIALIZABLE'})
+    # 商品テーブルから正しい集計を計算
+    expected_sellers = defaultdict(lambda: (0, 0))
+    for row in db.execute(
+        select(Item.user_id, Item.status, func.count().label('count'), func.sum(Item.price).label('total'))
+        .group_by(Item.user_id, Item.status)
+    ):
+        count, total = expected_sellers[(row.user_id, row.status)]
+        expected_sellers[(row.user_id, row.status)] = (count + row.count, total + row.total)
+    expected_buckets = defaultdict(lambda: (0, 0))
+    for row in db.execute(
+        select(Item.status, Item.price, func.count().label('count')).group_by(Item.status, Item.price)
+    ):
+        count, total = expected_buckets[(row.status, bucket_of(row.price))]
+        expected_buckets[(row.status, bucket_of(row.price))] = (count + row.count, total + row.price * row.count)
+
+    # 現在の集計と比べ、ずれている行に差分を加算する
+    current_sellers = {
+        (row.user_id, row.status): (row.item_count, row.total_price) for row in db.scalars(select(SellerStats))
+    }
+    current_buckets = {
+        (row.status, row.bucket): (row.item_count, row.total_price) for row in db.scalars(select(PriceBucket))
+    }
+    drift = 0
+    for model, key_names, expected, current in (
+        (SellerStats, ('user_id', 'status'), expected_sellers, current_sellers),
+        (PriceBucket, ('status', 'bucket'), expected_buckets, current_buckets),
+    ):
+        for key in expected.keys() | current.keys():
+            count, total = expected.get(key, (0, 0))
+            current_count, current_total = current.get(key, (0, 0))
+            if (count, total) != (current_count, current_total):
+                drift += 1
+                _increment(db, model, dict(zip(key_names, key)), count - current_count, total - current_total)
+    db.commit()
+    _summary_cache = (0.0, None)
+    return drift
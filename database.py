@@ -3,22 +3,41 @@
 # SQLAlchemyというライブラリを使用してデータベース操作を行います
 
 # SQLAlchemyライブラリから必要な機能をインポート
-from sqlalchemy import create_engine  # データベースエンジンを作成するため
-from sqlalchemy.orm import sessionmaker, declarative_base  # データベースセッションとベースクラスを作成するため
+from sqlalchemy import create_engine, make_url  # データベースエンジンを作成するため
+from sqlalchemy.orm import declarative_base  # ベースクラスを作成するため
 from config import get_settings
+import sharding  # 商品テーブルのシャーディング
 
 
 # PostgreSQLデータベースへの接続URL
 # 形式: postgresql://ユーザー名:パスワード@ホスト:ポート/データベース名
 SQLALCHEMY_DATABASE_URL = get_settings().sqlalchemy_database_url
 
+
+def connect_args(url: str):
+    """
+    ドライバーに渡す接続時の引数を返す関数
+    psycopg（バージョン3）では、同じSQL文を db_prepare_threshold 回実行した時点でサーバー側のプリペアドステートメントを使います
+    """
+    if make_url(url).get_driver_name() == 'psycopg':
+        threshold = get_settings().db_prepare_threshold
+        return {'prepare_threshold': threshold if threshold >= 0 else None}
+    return {}
+
+
 # データベースエンジンを作成（データベースとの接続を管理）
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args(SQLALCHEMY_DATABASE_URL))
 
 # データベースセッションを作成するためのファクトリ（工場）
 # autocommit=False: 自動的に変更を保存しない
 # autoflush=False: 自動的にデータベースを更新しない
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# シャードが設定されている場合は、商品を出品者ごとにシャードへ振り分けるセッションを作成します
+SessionLocal = sharding.make_sessionmaker(
+    engine,
+    [url.strip() for url in get_settings().shard_database_urls.split(',') if url.strip()],
+    vnodes=get_settings().shard_vnodes,
+    id_block_size=get_settings().shard_id_block_size,
+)
 
 # SQLAlchemyのベースクラスを作成
 # このクラスを継承してデータベースのテーブルを定義します
@@ -0,0 +1,2 @@
+# バックグラウンドジョブ パッケージの初期化ファイル
+# このファイルは、jobsディレクトリをPythonパッケージとして認識させるためのファイルです
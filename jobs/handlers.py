@@ -0,0 +1,138 @@
+# ジョブハンドラー定義ファイル
+# このファイルは、ジョブの種類（名前）と実際の処理を関連付けます
+# ハンドラーは (db, payload) を受け取る関数で、同期関数・非同期関数のどちらでも登録できます
+# 可視性タイムアウトやリトライで同じジョブが複数回実行されることがあるため、冪等に書いてください
+
+# 必要なライブラリをインポート
+import logging  # ログ出力
+from sqlalchemy.orm import Session  # データベースセッション
+from cruds import stats, auth, archive  # 統計情報・認証・アーカイブ
+from config import get_settings
+import similarity  # 類似商品の索引
+
+
+logger = logging.getLogger(__name__)
+
+# ジョブ名とハンドラーの対応表
+_handlers = {}
+# 定期実行するジョブ名と実行間隔（秒）の対応表
+_periodic = {}
+
+
+def handler(name: str):
+    """
+    ジョブハンドラーを登録するデコレーター
+    例: @handler('item.changed') を付けた関数が 'item.changed' ジョブを処理します
+    """
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def get_handler(name: str):
+    """
+    ジョブ名に対応するハンドラーを取得する関数
+    登録されていない場合はNoneを返します
+    """
+    return _handlers.get(name)
+
+
+def periodic(name: str, seconds: float):
+    """
+    ジョブを定期実行するよう登録する関数
+    ワーカーが seconds 秒ごとにジョブを登録します（前回分が実行待ちの場合は登録しません）
+    """
+    _periodic[name] = seconds
+
+
+def get_periodic():
+    """
+    定期実行するジョブ名と実行間隔（秒）の対応表を取得する関数
+    """
+    return dict(_periodic)
+
+
+@handler('item.changed')
+def item_changed(db: Session, payload: dict):
+    """
+    商品の作成・更新・削除後に実行されるジョブ
+    検索インデックスやキャッシュの更新、通知などの副作用はここに追加します
+    """
+    logger.info('item %s %s by user %s', payload.get('item_id'), payload.get('action'), payload.get('user_id'))
+    # 変更履歴に記録し、全てのプロセスの類似商品の索引に反映させる
+    similarity.record_change(db, payload['item_id'])
+
+
+@handler('user.created')
+def user_created(db: Session, payload: dict):
+    """
+    ユーザー登録後に実行されるジョブ
+    ウェルカム通知などの副作用はここに追加します
+    """
+    logger.info('user %s created', payload.get('user_id'))
+
+
+@handler('order.created')
+def order_created(db: Session, payload: dict):
+    """
+    商品購入後に実行されるジョブ
+    出品者・購入者への通知などの副作用はここに追加します
+    """
+    logger.info('order %s created for item %s', payload.get('order_id'), payload.get('item_id'))
+
+
+@handler('stats.reconcile')
+def stats_reconcile(db: Session, payload: dict):
+    """
+    統計情報の集計テーブルを商品テーブルと照合して補正する定期ジョブ
+    """
+    drift = stats.reconcile(db)
+    if drift:
+        logger.warning('stats reconcile corrected %s drifted rows', drift)
+
+
+periodic('stats.reconcile', get_settings().stats_reconcile_interval)
+
+
+@handler('auth.cleanup_refresh_tokens')
+def cleanup_refresh_tokens(db: Session, payload: dict):
+    """
+    期限切れのリフレッシュトークンを削除する定期ジョブ
+    """
+    deleted = auth.delete_expired_refresh_tokens(db)
+    logger.info('deleted %s expired refresh tokens', deleted)
+
+
+periodic('auth.cleanup_refresh_tokens', 24 * 60 * 60)
+
+
+@handler('items.archive')
+def archive_items(db: Session, payload: dict):
+    """
+    古い売り切れ商品をアーカイブテーブルへ移動する定期ジョブ
+    """
+    if get_settings().archive_after_days <= 0:
+        return
+    archived = archive.archive_sold_out(db)
+    logger.info('archived %s sold-out items', archived)
+
+
+periodic('items.archive', get_settings().archive_interval)
+
+
+@handler('items.similar_rebuild')
+def similar_rebuild(db: Session, payload: dict):
+    """
+    類似商品の索引を作り直して保存する定期ジョブ
+    古い変更履歴も削除します。保存先が設定されていない場合は、各プロセスが自分で索引を作り直します
+    """
+    pruned = similarity.prune_changes(db)
+    logger.info('pruned %s old item changes', pruned)
+    if not get_settings().similar_index_dir:
+        return
+    indexed = similarity.rebuild(db)
+    logger.info('rebuilt similar item index with %s items', indexed)
+
+
+periodic('items.similar_rebuild', get_settings().similar_rebuild_interval)
@@ -0,0 +1,145 @@
+# ジョブキュー操作ファイル
+# このファイルは、データベース上のjobsテーブルを永続的なキューとして扱うための関数を提供します
+# ジョブの登録（エンキュー）、取得（可視性タイムアウト付き）、完了、失敗（バックオフ付きリトライ）を担当します
+
+# 必要なライブラリをインポート
+from datetime import datetime, timedelta  # 日時と時間計算
+import random  # リトライ間隔のゆらぎ（ジッター）
+from sqlalchemy import select, update, delete, or_, event  # SQL文の組み立て
+from sqlalchemy.orm import Session  # データベースセッション
+from models import Job  # ジョブモデル
+from schemas import JobStatus  # ジョブの状態
+from config import get_settings
+
+
+# コミット後に呼び出す通知先（組み込みワーカーをポーリング間隔を待たずに起こすため）
+_listeners = []
+
+
+def add_listener(callback):
+    """
+    ジョブ登録の通知先を追加する関数
+    ジョブを含むトランザクションがコミットされると、callbackが引数なしで呼び出されます
+    """
+    _listeners.append(callback)
+
+
+def remove_listener(callback):
+    """
+    ジョブ登録の通知先を削除する関数
+    """
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def _notify(session):
+    # コミット完了時に全ての通知先を呼び出す
+    for callback in list(_listeners):
+        callback()
+
+
+def enqueue(db: Session, name: str, payload: dict | None = None, delay: timedelta | None = None):
+    """
+    ジョブをキューに登録する関数
+    コミットはせず、呼び出し元のトランザクションに含めます（トランザクショナル・アウトボックス）
+    呼び出し元がコミットした時点で初めてジョブがワーカーから見えるようになり、
+    ロールバックされた場合はジョブも一緒に取り消されます
+    """
+    job = Job(
+        name=name,
+        payload=payload or {},
+        max_attempts=get_settings().job_max_attempts,
+        run_at=datetime.now() + (delay or timedelta()),
+    )
+    db.add(job)
+    if _listeners:
+        # コミット後に一度だけワーカーへ通知する
+        event.listen(db, 'after_commit', _notify, once=True)
+    return job
+
+
+def enqueue_once(db: Session, name: str, payload: dict | None = None):
+    """
+    同じ名前の実行待ちジョブがない場合だけジョブを登録する関数
+    定期ジョブが前回分の完了前に積み重ならないようにするために使います
+    """
+    pending = db.scalar(
+        select(Job.id).where(Job.name == name, Job.status == JobStatus.PENDING).limit(1)
+    )
+    if pending is not None:
+        return None
+    return enqueue(db, name, payload)
+
+
+def claim(db: Session, visibility_timeout: int):
+    """
+    実行可能なジョブを1件取得する関数
+    条件付きUPDATEで locked_until を設定し、成功したワーカーだけがジョブを処理します
+    処理中にワーカーが停止しても、locked_until を過ぎれば他のワーカーが再取得できます
+    """
+    now = datetime.now()
+    # 実行可能で、他のワーカーが処理中でないジョブの候補を取得
+    visible = or_(Job.locked_until.is_(None), Job.locked_until < now)
+    candidates = db.scalars(
+        select(Job.id)
+        .where(Job.status == JobStatus.PENDING, Job.run_at <= now, visible)
+        .order_by(Job.run_at, Job.id)
+        .limit(10)
+    ).all()
+
+    for job_id in candidates:
+        lease = now + timedelta(seconds=visibility_timeout)
+        # 他のワーカーと競合した場合は更新件数が0になる
+        result = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.PENDING, visible)
+            .values(locked_until=lease, attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return db.get(Job, job_id)
+    return None
+
+
+def complete(db: Session, job: Job):
+    """
+    ジョブを完了させる関数
+    成功したジョブはキューから削除します
+    可視性タイムアウトを過ぎて他のワーカーが再取得していた場合は何もしません
+    """
+    db.execute(
+        delete(Job)
+        .where(Job.id == job.id, Job.locked_until == job.locked_until)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def backoff(attempts: int):
+    """
+    リトライまでの待ち時間（秒）を計算する関数
+    指数バックオフにジッターを加え、失敗したジョブが同時に再実行されないようにします
+    """
+    settings = get_settings()
+    delay = min(settings.job_retry_base * 2 ** (attempts - 1), settings.job_retry_max)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def fail(db: Session, job: Job, error: str):
+    """
+    ジョブの失敗を記録する関数
+    最大試行回数に達していなければバックオフ後に再実行し、達していれば FAILED にします
+    """
+    values = {'locked_until': None, 'last_error': error[:1000]}
+    if job.attempts >= job.max_attempts:
+        values['status'] = JobStatus.FAILED
+    else:
+        values['run_at'] = datetime.now() + timedelta(seconds=backoff(job.attempts))
+    db.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_until == job.locked_until)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
@@ -0,0 +1,180 @@
+# バックグラウンドジョブ ワーカーファイル
+# このファイルは、jobsテーブルからジョブを取り出して実行するasyncioワーカープールを提供します
+# APIプロセス内に組み込んで使うほか、重い処理をAPIから切り離すために単独でも起動できます
+#   python -m jobs.worker
+
+# 必要なライブラリをインポート
+import asyncio  # 非同期処理
+import inspect  # ハンドラーが非同期関数かどうかの判定
+import logging  # ログ出力
+import signal  # 終了シグナルの処理
+import time  # 定期ジョブの時刻管理
+from jobs import queue, handlers  # キュー操作とジョブハンドラー
+from config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """
+    ジョブを並行して処理するワーカープール
+    concurrency個のタスクがキューを監視し、ジョブがなければpoll_interval秒ごとに確認します
+    同じプロセス内でジョブが登録された場合は、コミット直後に起こされます
+    """
+
+    def __init__(self, session_factory=None, concurrency=None, poll_interval=None, visibility_timeout=None):
+        settings = get_settings()
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        # ジョブごとに新しいセッションを作成するためのファクトリ
+        self.session_factory = session_factory
+        # 同時に処理するジョブ数
+        self.concurrency = concurrency or settings.job_workers or 1
+        # キューを確認する間隔（秒）
+        self.poll_interval = poll_interval or settings.job_poll_interval
+        # 可視性タイムアウト（秒）
+        self.visibility_timeout = visibility_timeout or settings.job_visibility_timeout
+        self._tasks = []
+        self._loop = None
+        self._wakeup = None
+
+    async def start(self):
+        """
+        ワーカータスクを起動する関数
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        queue.add_listener(self.wake)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        if handlers.get_periodic():
+            self._tasks.append(asyncio.create_task(self._schedule()))
+
+    async def stop(self):
+        """
+        ワーカータスクを停止する関数
+        処理中のジョブは中断されますが、可視性タイムアウト後に再実行されます
+        """
+        queue.remove_listener(self.wake)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """
+        待機中のワーカーを起こす関数（どのスレッドから呼び出しても安全です）
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def run_once(self):
+        """
+        ジョブを1件取得して実行する関数
+        ジョブを処理した場合はTrue、実行可能なジョブがなかった場合はFalseを返します
+        """
+        job = await asyncio.to_thread(self._with_session, queue.claim, self.visibility_timeout)
+        if job is None:
+            return False
+
+        func = handlers.get_handler(job.name)
+        try:
+            if func is None:
+                raise LookupError(f'No handler registered for job {job.name!r}')
+            if inspect.iscoroutinefunction(func):
+                await self._run_async(func, job)
+            else:
+                await asyncio.to_thread(self._with_session, self._run_sync, func, job)
+        except Exception as e:
+            # 失敗した場合はバックオフ後にリトライ（上限に達したらFAILED）
+            logger.exception('Job %s (%s) failed on attempt %s', job.id, job.name, job.attempts)
+            await asyncio.to_thread(self._with_session, queue.fail, job, repr(e))
+        else:
+            await asyncio.to_thread(self._with_session, queue.complete, job)
+        return True
+
+    async def _run(self):
+        # ジョブがある間は連続で処理し、なくなったら通知かポーリング間隔まで待つ
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # データベースに接続できない場合なども、ワーカーは止めずに次の周期で再試行する
+                logger.exception('Job worker poll failed')
+                processed = False
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _schedule(self):
+        # 定期ジョブを実行間隔ごとにキューへ登録する
+        intervals = handlers.get_periodic()
+        next_run = {name: time.monotonic() + seconds for name, seconds in intervals.items()}
+        while True:
+            await asyncio.sleep(max(0.0, min(next_run.values()) - time.monotonic()))
+            now = time.monotonic()
+            for name, due in next_run.items():
+                if due > now:
+                    continue
+                next_run[name] = now + intervals[name]
+                try:
+                    await asyncio.to_thread(self._with_session, self._enqueue_periodic, name)
+                except Exception:
+                    logger.exception('Failed to schedule periodic job %s', name)
+
+    @staticmethod
+    def _enqueue_periodic(db, name):
+        # 前回分が実行待ちでなければ登録してコミットする
+        queue.enqueue_once(db, name)
+        db.commit()
+
+    def _with_session(self, func, *args):
+        # 新しいセッションで処理を実行し、必ず閉じる
+        db = self.session_factory()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _run_sync(db, func, job):
+        # 同期ハンドラーを実行し、ハンドラー内の変更をコミットする
+        func(db, job.payload)
+        db.commit()
+
+    async def _run_async(self, func, job):
+        # 非同期ハンドラーを実行し、ハンドラー内の変更をコミットする
+        db = self.session_factory()
+        try:
+            await func(db, job.payload)
+            db.commit()
+        finally:
+            db.close()
+
+
+async def main():
+    """
+    単独起動用のエントリーポイント
+    SIGINT/SIGTERMを受け取るまでジョブを処理し続けます
+    """
+    worker = JobWorker()
+    await worker.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    logger.info('Job worker started with %s tasks', worker.concurrency)
+    await stop.wait()
+    await worker.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
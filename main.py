@@ -2,18 +2,43 @@
 # このファイルは、Webアプリケーションのエントリーポイント（開始点）です
 # アプリケーション全体の設定と、各機能（ルーター）を統合します
 
-import time
+from contextlib import asynccontextmanager
 # FastAPIフレームワークをインポート（Webアプリケーションを作成するためのライブラリ）
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 # 各機能のルーター（URLの処理を担当するファイル）をインポート
-from routers import item, auth
+from routers import item, auth, stats, profiles, metrics
 from fastapi.middleware.cors import CORSMiddleware
 # 静的ファイルを提供するための機能をインポート
 from fastapi.staticfiles import StaticFiles
+# バックグラウンドジョブのワーカー
+from jobs.worker import JobWorker
+# リクエスト単位のプロファイリング
+from profiling import ProfilingMiddleware
+# 同時実行数の制限とロードシェディング
+from concurrency import ConcurrencyLimitMiddleware
+# フェーズごとの処理時間の計測
+from timing import TimingMiddleware
+from config import get_settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    アプリケーションの起動・終了時の処理
+    設定で有効な場合、プロセス内でバックグラウンドジョブのワーカーを動かします
+    """
+    worker = None
+    if get_settings().job_workers > 0:
+        worker = JobWorker()
+        await worker.start()
+    yield
+    if worker is not None:
+        await worker.stop()
+
 
 # FastAPIアプリケーションのインスタンスを作成
 # これがWebアプリケーションの本体になります
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,15 +46,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# 認証用ヘッダー付き、またはN件に1件のリクエストだけをプロファイリング（設定がなければ何もしません）
+app.add_middleware(ProfilingMiddleware)
+# 同時に処理するリクエスト数を制限し、溢れたリクエストは優先度付きのキューで待たせる（満杯・期限切れの場合は503）
+# プロファイリングより外側に置くため、キューで待っている時間はプロファイルに含まれません
+app.add_middleware(ConcurrencyLimitMiddleware)
+# 処理時間の内訳（キューでの待ち時間・認証・DB・処理・検証/シリアライズ）を Server-Timing ヘッダーで返す
+# 最後に追加したミドルウェアが一番外側で動くため、他のミドルウェアの時間も total に含まれます
+app.add_middleware(TimingMiddleware)
 
 
 # 静的ファイル（HTML、CSS、JavaScript）を提供するための設定
@@ -40,3 +64,9 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(item.router)
 # 認証関連の機能（ユーザー登録・ログインなど）をアプリケーションに追加
 app.include_router(auth.router)
+# 統計情報の機能（商品数・価格分布など）をアプリケーションに追加
+app.include_router(stats.router)
+# プロファイリング結果の取得機能をアプリケーションに追加
+app.include_router(profiles.router)
+# 内部状態の計測値（SQL文のキャッシュのヒット率など）の取得機能をアプリケーションに追加
+app.include_router(metrics.router)
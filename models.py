@@ -4,10 +4,10 @@
 
 # 必要なライブラリをインポート
 from datetime import datetime  # 日時を扱うためのライブラリ
-from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey  # SQLAlchemyのデータ型
+from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, JSON, UniqueConstraint, Boolean, Index  # SQLAlchemyのデータ型
 from sqlalchemy.orm import relationship  # テーブル間の関係を定義するため
 from database import Base  # データベースのベースクラス
-from schemas import ItemStatus  # アイテムの状態を表す列挙型
+from schemas import ItemStatus, JobStatus  # 状態を表す列挙型
 
 
 class Item(Base):
@@ -17,6 +17,9 @@ class Item(Base):
     """
     # データベースのテーブル名を指定
     __tablename__ = 'items'
+    # アーカイブ対象（古い売り切れ商品）を全件走査せずに探すためのインデックス
+    # SQLiteでも削除・アーカイブした商品のIDを使い回さない（アーカイブ済みの商品とIDが重なり、復元できなくなるため）
+    __table_args__ = (Index('ix_items_status_updated_at', 'status', 'updated_at'), {'sqlite_autoincrement': True})
 
     # 商品のID（主キー：データベース内で一意に識別するための番号）
     id = Column(Integer, primary_key=True)
@@ -39,6 +42,38 @@ class Item(Base):
     user = relationship('User', back_populates='items')
 
 
+class ArchivedItem(Base):
+    """
+    アーカイブされた商品を表すデータベースモデル
+    売り切れから一定期間が過ぎた商品は、定期ジョブで商品テーブルからこのテーブルへ移動します
+    商品テーブルを販売中・最近の商品だけに保つことで、通常の検索とインデックスを小さく保ちます
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'archived_items'
+
+    # 商品のID（商品テーブルでのIDをそのまま使う）
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    # 商品名
+    name = Column(String, nullable=False)
+    # 価格
+    price = Column(Integer, nullable=False)
+    # 商品の説明
+    description = Column(String, nullable=True)
+    # 商品の状態
+    status = Column(Enum(ItemStatus), nullable=False)
+    # 商品の作成日時
+    created_at = Column(DateTime)
+    # 商品の更新日時
+    updated_at = Column(DateTime)
+    # アーカイブした日時
+    archived_at = Column(DateTime, nullable=False, default=datetime.now)
+    # 商品を出品したユーザーのID（外部キー：usersテーブルと関連付け）
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # ユーザーテーブルとの関係を定義（1対多：1人のユーザーが複数のアーカイブ済み商品を持つ）
+    user = relationship('User', back_populates='archived_items')
+
+
 class User(Base):
     """
     ユーザーを表すデータベースモデル
@@ -61,4 +96,170 @@ class User(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     # アイテムテーブルとの関係を定義（1対多：1人のユーザーが複数の商品を出品可能）
-    items = relationship('Item', back_populates='user')
+    # ユーザーを削除すると、商品とアーカイブ済みの商品も一緒に削除します
+    # （シャードには外部キー制約がないため、データベースのカスケードに任せずに読み込んで削除します）
+    # 統計情報も更新するため、ユーザーの削除は cruds.auth.delete_user から行います
+    items = relationship('Item', back_populates='user', cascade='all, delete-orphan')
+    archived_items = relationship('ArchivedItem', back_populates='user', cascade='all, delete-orphan')
+
+
+class RefreshToken(Base):
+    """
+    リフレッシュトークンを表すデータベースモデル
+    トークン本体は保存せず、HMAC-SHA256のハッシュ値だけを保存します
+    ログインごとに1つの「ファミリー」を作り、更新のたびに同じファミリーの新しいトークンに置き換えます
+    使用済みのトークンが再び使われた場合は盗まれたとみなし、ファミリー全体を無効化します
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'refresh_tokens'
+
+    # リフレッシュトークンのID（主キー）
+    id = Column(Integer, primary_key=True)
+    # トークンのハッシュ値（一意インデックスで1回の検索で見つけられる）
+    token_hash = Column(String(64), nullable=False, unique=True)
+    # トークンのファミリー（同じログインから更新されたトークンの集まり）
+    family_id = Column(String(32), nullable=False, index=True)
+    # トークンを発行したユーザーのID（外部キー：usersテーブルと関連付け）
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    # 使用済みかどうか（一度更新に使ったトークンは再利用できない）
+    used = Column(Boolean, nullable=False, default=False)
+    # 無効化されたかどうか（再利用を検知した場合にファミリー全体を無効化する）
+    revoked = Column(Boolean, nullable=False, default=False)
+    # 有効期限
+    expires_at = Column(DateTime, nullable=False)
+    # 発行日時（自動設定）
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class Order(Base):
+    """
+    注文を表すデータベースモデル
+    購入が成立した商品と購入者を記録します
+    商品が後から削除・変更されても注文内容が残るよう、商品名と価格は購入時点の値を保存します
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'orders'
+    # 同じ購入者が同じ冪等キーで注文を二重に作成しないようにする
+    __table_args__ = (UniqueConstraint('buyer_id', 'idempotency_key'),)
+
+    # 注文のID（主キー）
+    id = Column(Integer, primary_key=True)
+    # 購入した商品のID（商品削除後も注文を残すため外部キーにはしない）
+    item_id = Column(Integer, nullable=False, index=True)
+    # 購入時点の商品名
+    item_name = Column(String, nullable=False)
+    # 購入時点の価格
+    price = Column(Integer, nullable=False)
+    # 出品者のユーザーID
+    seller_id = Column(Integer, nullable=False)
+    # 購入者のユーザーID（外部キー：usersテーブルと関連付け）
+    buyer_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    # 冪等キー（クライアントが再送しても同じ注文を返すため）
+    idempotency_key = Column(String, nullable=True)
+    # 注文日時（自動設定）
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class Job(Base):
+    """
+    バックグラウンドジョブを表すデータベースモデル
+    検索インデックス更新・通知・後片付けなどの後回しにできる処理を永続的なキューとして管理します
+    商品の変更と同じトランザクションで登録する（トランザクショナル・アウトボックス）ため、
+    コミットされた変更に対するジョブだけが実行されます
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'jobs'
+
+    # ジョブのID（主キー）
+    id = Column(Integer, primary_key=True)
+    # ジョブの種類（jobs.handlers に登録された名前）
+    name = Column(String, nullable=False)
+    # ジョブに渡すデータ（JSON）
+    payload = Column(JSON, nullable=False, default=dict)
+    # ジョブの状態（実行待ち/失敗）
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.PENDING)
+    # これまでの試行回数
+    attempts = Column(Integer, nullable=False, default=0)
+    # 最大試行回数
+    max_attempts = Column(Integer, nullable=False, default=5)
+    # 実行可能になる日時（リトライ時は後ろにずらす）
+    run_at = Column(DateTime, nullable=False, default=datetime.now, index=True)
+    # 可視性タイムアウト（この日時まではワーカーが処理中。過ぎたら他のワーカーが再取得できる）
+    locked_until = Column(DateTime, nullable=True)
+    # 最後に発生したエラー内容
+    last_error = Column(String, nullable=True)
+    # ジョブの作成日時（自動設定）
+    created_at = Column(DateTime, default=datetime.now)
+    # ジョブの更新日時（自動更新）
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class ItemChange(Base):
+    """
+    商品の変更履歴を表すデータベースモデル
+    item.changed ジョブが記録し、各プロセスがIDの順に読んで類似商品の索引に反映します
+    （ジョブは1つのプロセスでしか実行されないため、他のプロセスはこのテーブルから変更を知ります）
+    古い履歴は定期ジョブで削除します
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'item_changes'
+    # SQLiteでも削除済みのIDを使い回さない（古い履歴を削除した後にIDが戻ると、読んだ位置より前に記録されてしまうため）
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # 変更履歴のID（主キー。各プロセスはどこまで読んだかをこのIDで管理する）
+    id = Column(Integer, primary_key=True)
+    # 変更された商品のID
+    item_id = Column(Integer, nullable=False)
+    # 記録日時（自動設定）
+    created_at = Column(DateTime, default=datetime.now, index=True)
+
+
+class SellerStats(Base):
+    """
+    出品者ごと・状態ごとの集計を表すデータベースモデル
+    商品の作成・更新・削除のたびに差分で更新され、全件走査せずに出品者の集計を返せます
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'seller_stats'
+
+    # 出品者のユーザーID（主キー）
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    # 商品の状態（主キー）
+    status = Column(Enum(ItemStatus), primary_key=True)
+    # 商品数
+    item_count = Column(Integer, nullable=False, default=0)
+    # 価格の合計
+    total_price = Column(Integer, nullable=False, default=0)
+
+
+class PriceBucket(Base):
+    """
+    状態ごとの価格分布（ヒストグラム）を表すデータベースモデル
+    価格を相対誤差1%の対数バケットに分けて数えるスケッチで、差分更新と合算ができます
+    バケット数は価格の桁数に比例するだけなので、商品数が増えても中央値やパーセンタイルを一定時間で計算できます
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'price_buckets'
+
+    # 商品の状態（主キー）
+    status = Column(Enum(ItemStatus), primary_key=True)
+    # バケット番号（主キー）
+    bucket = Column(Integer, primary_key=True)
+    # バケットに含まれる商品数
+    item_count = Column(Integer, nullable=False, default=0)
+    # バケットに含まれる商品の価格の合計
+    total_price = Column(Integer, nullable=False, default=0)
+
+
+class IdBlock(Base):
+    """
+    シャーディング時の商品IDの採番状況を表すデータベースモデル
+    各プロセスはこのテーブルからIDの範囲をまとめて予約し、全シャードで重複しないIDを割り当てます
+    """
+    # データベースのテーブル名を指定
+    __tablename__ = 'id_blocks'
+
+    # 採番対象のテーブル名（主キー）
+    name = Column(String, primary_key=True)
+    # 次に予約できるIDの先頭
+    next_id = Column(Integer, nullable=False)
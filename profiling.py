@@ -0,0 +1,264 @@
+# リクエスト単位のプロファイリング機能ファイル
+# このファイルは、本番環境で遅いエンドポイントを再デプロイなしで調べるためのサンプリングプロファイラーを提供します
+# - 認証用ヘッダー（X-Profile）付きのリクエスト、またはN件に1件のリクエストだけを計測します
+# - 計測中は別スレッドが一定間隔でイベントループのスタックを記録します
+# - 結果はflamegraph.plやspeedscopeで読める collapsed stack 形式（"関数;関数;関数 回数"）で保存します
+# 注意：非同期エンドポイントは同じイベントループで動くため、同時に処理中の他のリクエストのスタックが混ざることがあります
+
+# 必要なライブラリをインポート
+import asyncio  # ファイルの書き出しを別スレッドで行う
+from collections import Counter, deque  # スタックの集計と保存件数の制限
+from dataclasses import dataclass, field  # 計測結果の入れ物
+from datetime import datetime  # 計測日時
+import hmac  # トークンの安全な比較
+import itertools  # サンプリング用のカウンター
+import json  # 計測結果の概要の保存
+import os  # ファイルパスの操作
+import re  # 計測結果のIDの確認
+import sys  # スタックフレームの取得
+import threading  # サンプリングスレッド
+import time  # 時間計測
+import uuid  # 計測結果のID
+from config import get_settings
+
+
+@dataclass
+class Profile:
+    """
+    1リクエスト分の計測結果
+    """
+    # 計測結果のID
+    id: str
+    # ルートのラベル（例: "GET /items/{id}"）
+    route: str
+    # 実際のリクエストパス
+    path: str
+    # 計測開始日時
+    started_at: datetime
+    # リクエストの処理時間（ミリ秒）
+    duration_ms: float = 0.0
+    # 取得したサンプル数
+    samples: int = 0
+    # collapsed stack ごとのサンプル数
+    stacks: Counter = field(default_factory=Counter)
+
+    def collapsed(self):
+        """
+        collapsed stack 形式の文字列を返す関数
+        各行の先頭にルートのラベルを付けるため、複数の計測結果を結合しても区別できます
+        """
+        label = self.route.replace(';', ':').replace(' ', '_')
+        return ''.join(f'{label};{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class StackSampler:
+    """
+    指定したスレッドのスタックを一定間隔で記録するサンプリングプロファイラー
+    計測対象のコードには手を加えないため、計測しないリクエストへの影響はありません
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        # 計測対象のスレッドID
+        self.thread_id = thread_id
+        # サンプリング間隔（秒）
+        self.interval = interval
+        # collapsed stack ごとのサンプル数
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        # 停止するまで interval 秒ごとに対象スレッドのスタックを記録する
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    # フレームをたどり、呼び出し元から順に "ファイル名:関数名" をセミコロンでつなげる
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}'.replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfileStore:
+    """
+    最近の計測結果を保存するストア
+    プロセス内に最大 keep 件を保持し、directory を指定した場合は save でファイルにも書き出します
+    （{id}.collapsed にスタック、{id}.json に概要を書き出します）
+    複数のプロセスで動かしている場合、他のプロセスが計測した結果は directory のファイルから読み込みます
+    """
+
+    def __init__(self, keep: int, directory: str = ''):
+        self.directory = directory
+        self._profiles = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def save(self, profile: Profile):
+        # ファイルへの書き出し（ディスクを待つため、イベントループからは別スレッドで呼び出す）
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f'{profile.id}.collapsed'), 'w') as f:
+                f.write(profile.collapsed())
+            # 概要は最後に書き出し、読み込む側が書きかけのファイルを読まないよう名前を変えて置き換える
+            path = os.path.join(self.directory, f'{profile.id}.json')
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump({
+                    'route': profile.route,
+                    'path': profile.path,
+                    'started_at': profile.started_at.isoformat(),
+                    'duration_ms': profile.duration_ms,
+                    'samples': profile.samples,
+                }, f)
+            os.replace(f'{path}.tmp', path)
+
+    def list(self):
+        # 新しい順に最大 keep 件を返す（directory がある場合は他のプロセスの計測結果も含む）
+        with self._lock:
+            profiles = {p.id: p for p in self._profiles}
+        if self.directory:
+            for profile_id in self._saved_ids():
+                if profile_id not in profiles:
+                    profile = self._load(profile_id, with_stacks=False)
+                    if profile is not None:
+                        profiles[profile_id] = profile
+        return sorted(profiles.values(), key=lambda p: p.started_at, reverse=True)[:self._profiles.maxlen]
+
+    def get(self, profile_id: str):
+        # プロセス内にない場合は directory のファイルから読み込む（ディスクを読むため、別スレッドで呼び出す）
+        with self._lock:
+            profile = next((p for p in self._profiles if p.id == profile_id), None)
+        if profile is None and self.directory:
+            profile = self._load(profile_id)
+        return profile
+
+    def _saved_ids(self):
+        # directory に保存された計測結果のIDを新しい順に最大 keep 件返す
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [entry.name[:-len('.json')] for entry in entries[:self._profiles.maxlen]]
+
+    def _load(self, profile_id: str, with_stacks: bool = True):
+        # ファイルから計測結果を読み込む（IDは16進数の文字列だけを受け付け、directory の外のファイルは読まない）
+        if not re.fullmatch(r'[0-9a-f]+', profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f'{profile_id}.json')) as f:
+                summary = json.load(f)
+            stacks = Counter()
+            if with_stacks:
+                with open(os.path.join(self.directory, f'{profile_id}.collapsed')) as f:
+                    for line in f:
+                        # 各行の先頭のルートのラベルを除いて集計し直す（collapsed で付け直すため）
+                        stack, count = line.rstrip('\n').rsplit(' ', 1)
+                        stacks[stack.split(';', 1)[1]] += int(count)
+        except (FileNotFoundError, ValueError, IndexError):
+            return None
+        return Profile(
+            id=profile_id,
+            route=summary['route'],
+            path=summary['path'],
+            started_at=datetime.fromisoformat(summary['started_at']),
+            duration_ms=summary['duration_ms'],
+            samples=summary['samples'],
+            stacks=stacks,
+        )
+
+
+# アプリケーション全体で共有する計測結果のストア
+store = ProfileStore(get_settings().profiling_keep, get_settings().profiling_dir)
+
+
+def is_authorized(token: str | None):
+    """
+    プロファイリング用のトークンが正しいかを確認する関数
+    トークンが設定されていない場合は常にFalseを返します
+    """
+    expected = get_settings().profiling_token
+    return bool(expected) and token is not None and hmac.compare_digest(token, expected)
+
+
+class ProfilingMiddleware:
+    """
+    リクエスト単位でサンプリングプロファイラーを動かすASGIミドルウェア
+    X-Profile ヘッダーに正しいトークンが付いたリクエストと、profiling_sample_rate 件に1件のリクエストを計測します
+    どちらも無効な場合は、何もせずに次の処理を呼び出すだけです
+    """
+
+    def __init__(self, app, token=None, sample_rate=None, interval=None, profile_store=None):
+        settings = get_settings()
+        self.app = app
+        self.token = (settings.profiling_token if token is None else token).encode()
+        self.sample_rate = settings.profiling_sample_rate if sample_rate is None else sample_rate
+        self.interval = settings.profiling_interval if interval is None else interval
+        self.store = store if profile_store is None else profile_store
+        self.enabled = bool(self.token) or self.sample_rate > 0
+        self._counter = itertools.count(1)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope['type'] != 'http' or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:16]
+
+        async def send_with_profile_id(message):
+            # 計測結果のIDをレスポンスヘッダーで返す
+            if message['type'] == 'http.response.start':
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + [(b'x-profile-id', profile_id.encode())]
+            await send(message)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        started_at = datetime.now()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.stop()
+            # ルーティング後に設定されるルートのテンプレート（例: /items/{id}）でラベルを付ける
+            route = scope.get('route')
+            path = getattr(route, 'path', scope['path'])
+            profile = Profile(
+                id=profile_id,
+                route=f"{scope['method']} {path}",
+                path=scope['path'],
+                started_at=started_at,
+                duration_ms=(time.perf_counter() - start) * 1000,
+                samples=sum(sampler.stacks.values()),
+                stacks=sampler.stacks,
+            )
+            self.store.add(profile)
+            if self.store.directory:
+                # 他のリクエストを止めないよう、ファイルへの書き出しはイベントループの外で行う
+                await asyncio.to_thread(self.store.save, profile)
+
+    def _should_profile(self, scope):
+        # N件に1件のサンプリング
+        if self.sample_rate > 0 and next(self._counter) % self.sample_rate == 0:
+            return True
+        # 認証用ヘッダーによる計測
+        if self.token:
+            for name, value in scope['headers']:
+                if name == b'x-profile':
+                    return hmac.compare_digest(value, self.token)
+        return False
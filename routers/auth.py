@@ -3,20 +3,19 @@
 # FastAPIのルーターを使用して、認証関連のURLパスと処理を関連付けます
 
 # 必要なライブラリをインポート
-from datetime import timedelta  # 時間の計算を行うためのライブラリ
-
 from typing import Annotated  # 型注釈をより詳細に書くためのライブラリ
 from fastapi import APIRouter, Depends, HTTPException  # FastAPIの機能
 from fastapi.security import OAuth2PasswordRequestForm  # パスワード認証フォーム
 from sqlalchemy.orm import Session  # データベースセッション
 from starlette import status  # HTTPステータスコード
 from cruds import auth as auth_cruds  # 認証関連のビジネスロジック
-from schemas import UserCreate, UserResponse, Token  # データスキーマ
+from schemas import UserCreate, UserResponse, Token, RefreshRequest  # データスキーマ
 from database import get_db  # データベース接続取得関数
+from timing import TimedRoute  # 処理時間を計測するルート
 
 
 # 認証関連のAPIルーターを作成（URLの先頭に"/auth"が付きます）
-router = APIRouter(prefix='/auth', tags=['auth'])
+router = APIRouter(prefix='/auth', tags=['auth'], route_class=TimedRoute)
 
 # データベースセッションの依存関係を定義（自動的にデータベース接続を提供）
 DbDependency = Annotated[Session, Depends(get_db)]
@@ -48,7 +47,39 @@ async def login(db: DbDependency, form_data: FormDependency):
         # 認証に失敗した場合は401エラーを返す
         raise HTTPException(status_code=401, detail='Incorrect username or password')
 
-    # 認証成功時、20分間有効なアクセストークンを作成
-    token = auth_cruds.create_access_token(user.username, user.id, timedelta(minutes=20))
+    # 認証成功時、アクセストークン（約20分間有効）とリフレッシュトークンを作成
+    expires = auth_cruds.access_token_expires()
+    token = auth_cruds.create_access_token(user.username, user.id, expires)
+    refresh_token = auth_cruds.create_refresh_token(db, user.id)
     # 認証成功メッセージとトークンを返す
-    return {'Message': 'Successful Authentication!', 'access_token': token, 'token_type': 'bearer'}
+    return {
+        'Message': 'Successful Authentication!',
+        'access_token': token,
+        'token_type': 'bearer',
+        'refresh_token': refresh_token,
+        'expires_in': int(expires.total_seconds()),
+    }
+
+
+@router.post('/refresh', status_code=status.HTTP_200_OK, response_model=Token)
+async def refresh(db: DbDependency, refresh_request: RefreshRequest):
+    """
+    トークン更新APIエンドポイント
+    POST /auth/refresh でアクセスすると、リフレッシュトークンを新しいアクセストークンとリフレッシュトークンに交換します
+    パスワードを再入力せずにログイン状態を続けられます（使ったリフレッシュトークンは使えなくなります）
+    """
+    rotated = auth_cruds.rotate_refresh_token(db, refresh_request.refresh_token)
+    if rotated is None:
+        # 無効・期限切れ・再利用されたトークンの場合は401エラーを返す
+        raise HTTPException(status_code=401, detail='Invalid refresh token')
+    user, refresh_token = rotated
+
+    expires = auth_cruds.access_token_expires()
+    token = auth_cruds.create_access_token(user.username, user.id, expires)
+    return {
+        'Message': 'Token refreshed',
+        'access_token': token,
+        'token_type': 'bearer',
+        'refresh_token': refresh_token,
+        'expires_in': int(expires.total_seconds()),
+    }
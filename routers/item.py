@@ -4,12 +4,16 @@
 
 # 必要なライブラリをインポート
 from typing import Annotated  # 型注釈をより詳細に書くためのライブラリ
-from fastapi import APIRouter, Path, Query, HTTPException, Depends  # FastAPIの機能
+from fastapi import APIRouter, Path, Query, HTTPException, Depends, Header, Response  # FastAPIの機能
 from sqlalchemy.orm import Session  # データベースセッション
 from starlette import status  # HTTPステータスコード
-from cruds import item as item_cruds, auth as auth_cruds  # ビジネスロジック（CRUD操作）
-from schemas import ItemCreate, ItemUpdate, ItemResponse, DecodedToken  # データスキーマ
+from cruds import item as item_cruds, auth as auth_cruds, order as order_cruds, archive as archive_cruds  # ビジネスロジック（CRUD操作）
+from schemas import ItemCreate, ItemUpdate, ItemResponse, SimilarItemResponse, OrderResponse, DecodedToken  # データスキーマ
+from models import Item  # データベースモデル
 from database import get_db  # データベース接続取得関数
+from timing import TimedRoute  # 処理時間を計測するルート
+import write_batch  # 書き込みのグループコミット
+import similarity  # 類似商品の索引
 
 
 # データベースセッションの依存関係を定義（自動的にデータベース接続を提供）
@@ -19,16 +23,44 @@ DbDependency = Annotated[Session, Depends(get_db)]
 UserDependency = Annotated[DecodedToken, Depends(auth_cruds.get_current_user)]
 
 # 商品関連のAPIルーターを作成（URLの先頭に"/items"が付きます）
-router = APIRouter(prefix="/items", tags=["Items"])
+router = APIRouter(prefix="/items", tags=["Items"], route_class=TimedRoute)
+
+
+async def _write(db: Session, operation):
+    """
+    商品の書き込み操作を実行する関数
+    グループコミットが有効な場合は他のリクエストの書き込みとまとめてコミットし、
+    無効な場合はこのリクエストのセッションで実行します
+    """
+    if write_batch.enabled():
+        return await write_batch.get_batcher().run(operation)
+    return operation(db)
+
+
+def _find_replayed_order(db: Session, response: Response, user_id: int, item_id: int, idempotency_key: str):
+    """
+    冪等キーで既存の注文を検索する関数
+    同じ購入者・同じ商品の注文があれば再送として返し、なければNoneを返します
+    別の商品の購入に同じキーが使われていた場合は422エラーにします
+    """
+    existing_order = order_cruds.find_by_idempotency_key(db, user_id, idempotency_key)
+    if existing_order is None:
+        return None
+    if existing_order.item_id != item_id:
+        # 別の商品の購入に同じキーが使われた場合は422エラーを返す
+        raise HTTPException(status_code=422, detail='Idempotency-Key already used for another item')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return existing_order
 
 
 @router.get('', response_model=list[ItemResponse], status_code=status.HTTP_200_OK)
-async def find_all(db: DbDependency):
+async def find_all(db: DbDependency, include_archived: bool = Query(False)):
     """
     全ての商品を取得するAPIエンドポイント
     GET /items でアクセスすると、データベース内の全ての商品情報を返します
+    ?include_archived=true を付けると、アーカイブ済みの商品も含めます
     """
-    return item_cruds.find_all(db)
+    return item_cruds.find_all(db, include_archived)
 
 
 @router.get('/{id}', response_model=ItemResponse, status_code=status.HTTP_200_OK)
@@ -46,13 +78,33 @@ async def find_by_id(db:DbDependency, user: UserDependency, id: int=Path(gt=0)):
     return found_item
 
 
+@router.get('/{id}/similar', response_model=list[SimilarItemResponse], status_code=status.HTTP_200_OK)
+async def find_similar(db: DbDependency, id: int = Path(gt=0), k: int = Query(10, ge=1, le=50)):
+    """
+    類似商品を取得するAPIエンドポイント
+    GET /items/{id}/similar でアクセスすると、商品名と説明が似ている販売中の商品を類似度の高い順に返します
+    索引の読み込み・作成中は503エラーを返します
+    """
+    if similarity.get_index() is None:
+        # 索引はバックグラウンドで準備しているため、少し待ってから再試行してもらう
+        raise HTTPException(status_code=503, detail='Similar item index is not ready', headers={'Retry-After': '5'})
+    similar_items = item_cruds.find_similar(db, id, k)
+    if similar_items is None:
+        # 商品が見つからない場合は404エラーを返す
+        raise HTTPException(status_code=404, detail='Item not found')
+    return similar_items
+
+
 @router.get('/', response_model=list[ItemResponse], status_code=status.HTTP_200_OK)
-async def find_by_name(db:DbDependency, name: str = Query(min_length=2, max_length=20)):
+async def find_by_name(
+    db: DbDependency, name: str = Query(min_length=2, max_length=20), include_archived: bool = Query(False)
+):
     """
     商品名で検索するAPIエンドポイント
     GET /items/?name=検索したい商品名 でアクセスすると、商品名に一致する商品を返します
+    ?include_archived=true を付けると、アーカイブ済みの商品も含めます
     """
-    return item_cruds.find_by_name(db, name)
+    return item_cruds.find_by_name(db, name, include_archived)
 
 @router.post('', response_model=ItemResponse, status_code=status.HTTP_201_CREATED)
 async def create(db:DbDependency, user: UserDependency, item_create: ItemCreate):
@@ -61,7 +113,7 @@ async def create(db:DbDependency, user: UserDependency, item_create: ItemCreate)
     POST /items でアクセスすると、新しい商品をデータベースに登録します
     認証が必要で、ログインユーザーが商品の出品者になります
     """
-    return item_cruds.create(db, item_create, user.user_id)
+    return await _write(db, lambda session: item_cruds.create(session, item_create, user.user_id))
 
 
 @router.put('/{id}', response_model=ItemResponse, status_code=status.HTTP_200_OK)
@@ -72,7 +124,7 @@ async def update(db: DbDependency, user: UserDependency, item_update: ItemUpdate
     認証が必要で、自分の商品のみ更新可能です
     """
     # 指定されたIDの商品を更新（自分の商品のみ）
-    updated_item = item_cruds.update(db, id, item_update, user.user_id)
+    updated_item = await _write(db, lambda session: item_cruds.update(session, id, item_update, user.user_id))
     if not updated_item:
         # 更新に失敗した場合は404エラーを返す
         raise HTTPException(status_code=404, detail='Item not updated')
@@ -87,8 +139,63 @@ async def delete(db: DbDependency, user: UserDependency, id: int = Path(gt=0)):
     認証が必要で、自分の商品のみ削除可能です
     """
     # 指定されたIDの商品を削除（自分の商品のみ）
-    deleted_item = item_cruds.delete(db, id, user.user_id)
+    deleted_item = await _write(db, lambda session: item_cruds.delete(session, id, user.user_id))
     if not deleted_item:
         # 削除に失敗した場合は404エラーを返す
         raise HTTPException(status_code=404, detail='Item not deleted')
     return deleted_item
+
+
+@router.post('/{id}/restore', response_model=ItemResponse, status_code=status.HTTP_200_OK)
+async def restore(db: DbDependency, user: UserDependency, id: int = Path(gt=0)):
+    """
+    アーカイブ済みの商品を復元するAPIエンドポイント
+    POST /items/{id}/restore でアクセスすると、アーカイブされた商品を商品テーブルへ戻します
+    認証が必要で、自分の商品のみ復元可能です
+    """
+    restored_item = archive_cruds.restore(db, id, user.user_id)
+    if not restored_item:
+        if archive_cruds.find_by_id(db, id, user.user_id) is not None:
+            # 商品テーブルに同じIDの商品がある場合は409エラーを返す
+            raise HTTPException(status_code=409, detail='Item id already in use')
+        # アーカイブ済みの商品が見つからない場合は404エラーを返す
+        raise HTTPException(status_code=404, detail='Archived item not found')
+    return restored_item
+
+
+@router.post('/{id}/purchase', response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
+async def purchase(
+    db: DbDependency,
+    user: UserDependency,
+    response: Response,
+    id: int = Path(gt=0),
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
+):
+    """
+    商品を購入するAPIエンドポイント
+    POST /items/{id}/purchase でアクセスすると、販売中の商品を購入して注文を作成します
+    認証が必要で、自分の商品は購入できません
+    Idempotency-Key ヘッダーを付けると、同じキーで再送しても注文は1つだけ作成されます
+    """
+    if idempotency_key is not None:
+        # 同じキーの注文が既にあれば、その注文をそのまま返す（クライアントの再送対策）
+        existing_order = _find_replayed_order(db, response, user.user_id, id, idempotency_key)
+        if existing_order is not None:
+            return existing_order
+
+    # 商品を購入（販売中の場合だけ成功する）
+    order = order_cruds.purchase(db, id, user.user_id, idempotency_key)
+    if order is None:
+        if idempotency_key is not None:
+            # 同じキーの再送が同時に届き、もう一方が先に購入した場合はその注文を返す
+            existing_order = _find_replayed_order(db, response, user.user_id, id, idempotency_key)
+            if existing_order is not None:
+                return existing_order
+        # 購入できなかった理由に応じてエラーを返す
+        item = db.get(Item, id)
+        if item is None:
+            raise HTTPException(status_code=404, detail='Item not found')
+        if item.user_id == user.user_id:
+            raise HTTPException(status_code=400, detail='Cannot purchase your own item')
+        raise HTTPException(status_code=409, detail='Item sold out')
+    return order
@@ -0,0 +1,43 @@
+# 内部状態の計測値関連のAPIエンドポイント定義ファイル
+# このファイルは、SQL文のキャッシュのヒット率や同時実行数の制限の状態など、プロセス内の計測値を返す機能を提供します
+# 値はAPIプロセスごとに集計されるため、複数のプロセスで動かしている場合はプロセスごとの値になります
+# X-Metrics-Token ヘッダーに設定済みのトークンを付けた場合だけアクセスできます
+
+# 必要なライブラリをインポート
+import hmac  # トークンの安全な比較
+from typing import Annotated  # 型注釈をより詳細に書くためのライブラリ
+from fastapi import APIRouter, Depends, Header, HTTPException  # FastAPIの機能
+from starlette import status  # HTTPステータスコード
+from config import get_settings
+import statement_cache  # SQL文のキャッシュの利用状況
+import concurrency  # 同時実行数の制限
+from schemas import MetricsResponse  # データスキーマ
+from timing import TimedRoute  # 処理時間を計測するルート
+
+
+def verify_metrics_token(x_metrics_token: Annotated[str | None, Header()] = None):
+    """
+    計測値を取得するためのトークンを確認する関数
+    トークンが設定されていない場合、または正しくない場合は403エラーを返します
+    """
+    expected = get_settings().metrics_token
+    if not expected or x_metrics_token is None or not hmac.compare_digest(x_metrics_token, expected):
+        raise HTTPException(status_code=403, detail='Not authorized')
+
+
+# 計測値のAPIルーターを作成（URLの先頭に"/metrics"が付きます）
+router = APIRouter(
+    prefix="/metrics", tags=["Metrics"], dependencies=[Depends(verify_metrics_token)], route_class=TimedRoute
+)
+
+
+@router.get('', response_model=MetricsResponse, status_code=status.HTTP_200_OK)
+async def find_all():
+    """
+    プロセス内の計測値を取得するAPIエンドポイント
+    GET /metrics でアクセスすると、SQL文のキャッシュのヒット率や同時実行数の上限・キューの長さ・捨てた数を返します
+    """
+    return {
+        'statement_cache': statement_cache.snapshot(),
+        'concurrency': concurrency.limiter.snapshot() if concurrency.limiter is not None else None,
+    }
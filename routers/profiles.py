@@ -0,0 +1,54 @@
+# プロファイリング結果関連のAPIエンドポイント定義ファイル
+# このファイルは、最近計測したリクエストのプロファイルの一覧取得とダウンロード機能を提供します
+# X-Profile-Token ヘッダーに設定済みのトークンを付けた場合だけアクセスできます
+
+# 必要なライブラリをインポート
+import asyncio  # ファイルの読み込みを別スレッドで行う
+from typing import Annotated  # 型注釈をより詳細に書くためのライブラリ
+from fastapi import APIRouter, Depends, Header, HTTPException  # FastAPIの機能
+from fastapi.responses import PlainTextResponse  # テキスト形式のレスポンス
+from starlette import status  # HTTPステータスコード
+import profiling  # プロファイリング機能
+from schemas import ProfileResponse  # データスキーマ
+from timing import TimedRoute  # 処理時間を計測するルート
+
+
+def verify_profile_token(x_profile_token: Annotated[str | None, Header()] = None):
+    """
+    プロファイリング用のトークンを確認する関数
+    トークンが正しくない場合は403エラーを返します
+    """
+    if not profiling.is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail='Not authorized')
+
+
+# プロファイリング結果のAPIルーターを作成（URLの先頭に"/profiles"が付きます）
+router = APIRouter(
+    prefix="/profiles", tags=["Profiles"], dependencies=[Depends(verify_profile_token)], route_class=TimedRoute
+)
+
+
+@router.get('', response_model=list[ProfileResponse], status_code=status.HTTP_200_OK)
+async def find_all():
+    """
+    最近の計測結果の一覧を取得するAPIエンドポイント
+    GET /profiles でアクセスすると、新しい順に計測結果の概要を返します
+    """
+    # 他のプロセスの計測結果をファイルから読み込むことがあるため、イベントループの外で実行する
+    return await asyncio.to_thread(profiling.store.list)
+
+
+@router.get('/{id}', response_class=PlainTextResponse, status_code=status.HTTP_200_OK)
+async def download(id: str):
+    """
+    計測結果をダウンロードするAPIエンドポイント
+    GET /profiles/{id} でアクセスすると、collapsed stack 形式のテキストを返します
+    flamegraph.pl や speedscope にそのまま読み込めます
+    """
+    profile = await asyncio.to_thread(profiling.store.get, id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail='Profile not found')
+    return PlainTextResponse(
+        profile.collapsed(),
+        headers={'Content-Disposition': f'attachment; filename="{profile.id}.collapsed"'},
+    )
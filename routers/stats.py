@@ -0,0 +1,38 @@
+# 統計情報関連のAPIエンドポイント定義ファイル
+# このファイルは、ダッシュボード向けに商品数・価格分布・出品者ごとの集計を提供します
+# 集計テーブルを読むだけなので、商品数に関係なく一定時間で応答します
+
+# 必要なライブラリをインポート
+from typing import Annotated  # 型注釈をより詳細に書くためのライブラリ
+from fastapi import APIRouter, Path, Depends  # FastAPIの機能
+from sqlalchemy.orm import Session  # データベースセッション
+from starlette import status  # HTTPステータスコード
+from cruds import stats as stats_cruds  # 統計情報のビジネスロジック
+from schemas import StatusStats, SellerStatsResponse  # データスキーマ
+from database import get_db  # データベース接続取得関数
+from timing import TimedRoute  # 処理時間を計測するルート
+
+
+# データベースセッションの依存関係を定義（自動的にデータベース接続を提供）
+DbDependency = Annotated[Session, Depends(get_db)]
+
+# 統計情報のAPIルーターを作成（URLの先頭に"/stats"が付きます）
+router = APIRouter(prefix="/stats", tags=["Stats"], route_class=TimedRoute)
+
+
+@router.get('', response_model=list[StatusStats], status_code=status.HTTP_200_OK)
+async def summary(db: DbDependency):
+    """
+    商品の状態ごとの統計情報を取得するAPIエンドポイント
+    GET /stats でアクセスすると、商品数・価格の合計と平均・価格のパーセンタイルを返します
+    """
+    return stats_cruds.summary(db)
+
+
+@router.get('/sellers/{user_id}', response_model=SellerStatsResponse, status_code=status.HTTP_200_OK)
+async def find_by_seller(db: DbDependency, user_id: int = Path(gt=0)):
+    """
+    出品者ごとの統計情報を取得するAPIエンドポイント
+    GET /stats/sellers/{user_id} でアクセスすると、出品者の状態ごとの商品数と価格の合計を返します
+    """
+    return stats_cruds.find_by_seller(db, user_id)
@@ -18,6 +18,15 @@ class ItemStatus(Enum):
     SOLD_OUT = "SOLD_OUT"    # 売り切れ
 
 
+class JobStatus(Enum):
+    """
+    バックグラウンドジョブの状態を表す列挙型
+    成功したジョブはキューから削除されるため、待機中か失敗のどちらかになります
+    """
+    PENDING = "PENDING"      # 実行待ち（実行中・リトライ待ちを含む）
+    FAILED = "FAILED"        # 最大試行回数を超えて失敗
+
+
 class ItemCreate(BaseModel):
     """
     商品作成時に使用するデータスキーマ
@@ -72,6 +81,89 @@ class ItemResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class SimilarItemResponse(BaseModel):
+    """
+    類似商品を返す際に使用するデータスキーマ
+    """
+    # 類似商品の情報
+    item: ItemResponse
+    # 類似度（コサイン類似度。1に近いほど似ている）
+    score: float = Field(examples=[0.42])
+
+
+class OrderResponse(BaseModel):
+    """
+    注文情報を返す際に使用するデータスキーマ
+    商品購入APIのレスポンス形式を定義します
+    """
+    # 注文のID
+    id: int = Field(gt=0, examples=[1])
+    # 購入した商品のID
+    item_id: int = Field(gt=0, examples=[1])
+    # 購入時点の商品名
+    item_name: str = Field(examples=["PC"])
+    # 購入時点の価格
+    price: int = Field(gt=0, examples=[10000])
+    # 出品者のユーザーID
+    seller_id: int
+    # 購入者のユーザーID
+    buyer_id: int
+    # 注文日時
+    created_at: datetime
+
+    # データベースモデルから自動的にデータを取得する設定
+    model_config = ConfigDict(from_attributes=True)
+
+
+class StatusStats(BaseModel):
+    """
+    商品の状態ごとの統計情報を表すデータスキーマ
+    パーセンタイルは相対誤差1%以内の近似値です
+    """
+    # 商品の状態
+    status: ItemStatus = Field(examples=[ItemStatus.ON_SALE])
+    # 商品数
+    count: int = Field(ge=0, examples=[120])
+    # 価格の合計
+    total_price: int = Field(ge=0, examples=[1200000])
+    # 価格の平均
+    average_price: Optional[float] = Field(None, examples=[10000.0])
+    # 価格のパーセンタイル（例: {"p50": 9800, "p90": 30000}）
+    percentiles: dict[str, int] = Field(default_factory=dict, examples=[{"p50": 9800}])
+
+
+class SellerStatsResponse(BaseModel):
+    """
+    出品者ごとの統計情報を表すデータスキーマ
+    """
+    # 出品者のユーザーID
+    user_id: int
+    # 状態ごとの商品数と価格の合計
+    statuses: list[StatusStats]
+
+
+class ProfileResponse(BaseModel):
+    """
+    プロファイリング結果の概要を表すデータスキーマ
+    スタックの内容は GET /profiles/{id} で collapsed stack 形式で取得します
+    """
+    # 計測結果のID
+    id: str
+    # ルートのラベル
+    route: str = Field(examples=["GET /items/{id}"])
+    # 実際のリクエストパス
+    path: str = Field(examples=["/items/1"])
+    # 計測開始日時
+    started_at: datetime
+    # リクエストの処理時間（ミリ秒）
+    duration_ms: float
+    # 取得したサンプル数
+    samples: int
+
+    # 計測結果のオブジェクトから自動的にデータを取得する設定
+    model_config = ConfigDict(from_attributes=True)
+
+
 class UserCreate(BaseModel):
     """
     ユーザー作成時に使用するデータスキーマ
@@ -112,6 +204,18 @@ class Token(BaseModel):
     access_token: str
     # トークンの種類（通常は"bearer"）
     token_type: str
+    # リフレッシュトークン（アクセストークンの期限が切れたら /auth/refresh で新しいトークンを取得する）
+    refresh_token: Optional[str] = None
+    # アクセストークンの有効期間（秒）
+    expires_in: Optional[int] = None
+
+
+class RefreshRequest(BaseModel):
+    """
+    トークン更新時に使用するデータスキーマ
+    """
+    # ログインまたは前回の更新で受け取ったリフレッシュトークン
+    refresh_token: str = Field(min_length=1)
 
 
 class DecodedToken(BaseModel):
@@ -123,3 +227,53 @@ class DecodedToken(BaseModel):
     username: str
     # ユーザーのID
     user_id: int
+
+
+class StatementCacheStats(BaseModel):
+    """
+    SQL文のキャッシュの利用状況を表すデータスキーマ
+    """
+    # コンパイル済みのSQL文を再利用できた実行回数
+    hit: int = Field(examples=[980])
+    # SQL文を新たにコンパイルした実行回数
+    miss: int = Field(examples=[20])
+    # キャッシュの対象外の実行回数（テキストSQL・DDLなど）
+    other: int = Field(examples=[3])
+    # キャッシュの対象となった実行のうち、再利用できた割合
+    hit_rate: float = Field(examples=[0.98])
+
+
+class ShedCounts(BaseModel):
+    """
+    捨てたリクエストの理由ごとの数を表すデータスキーマ
+    """
+    # キューが満杯だったため捨てた数
+    queue_full: int = Field(examples=[0])
+    # 優先度の高いリクエストにキューから押し出された数
+    evicted: int = Field(examples=[0])
+    # 処理を始める前に期限を過ぎたため捨てた数
+    deadline: int = Field(examples=[0])
+
+
+class ConcurrencyStats(BaseModel):
+    """
+    同時実行数の制限の状態を表すデータスキーマ
+    """
+    # 現在の同時実行数の上限
+    limit: int = Field(examples=[20])
+    # 処理中のリクエスト数
+    inflight: int = Field(examples=[3])
+    # キューで待っているリクエスト数
+    queued: int = Field(examples=[0])
+    # 捨てたリクエストの数
+    shed: ShedCounts
+
+
+class MetricsResponse(BaseModel):
+    """
+    プロセスの内部状態の計測値を返す際に使用するデータスキーマ
+    """
+    # SQL文のキャッシュの利用状況
+    statement_cache: StatementCacheStats
+    # 同時実行数の制限の状態（制限しない設定の場合は null）
+    concurrency: Optional[ConcurrencyStats] = None
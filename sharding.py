@@ -0,0 +1,369 @@
+# 商品テーブルの水平シャーディング機能ファイル
+# このファイルは、商品（items・archived_items）を出品者のユーザーIDごとに複数のデータベース（シャード）へ振り分ける機能を提供します
+# - ユーザーIDのコンシステントハッシュでシャードを決めるため、シャードを追加しても移動する出品者は一部だけです
+# - 商品以外のテーブル（ユーザー・ジョブ・注文・統計など）は従来どおりメインのデータベースに置きます
+# - 出品者が決まっている操作（find_by_id・create・update・delete）は、そのシャードだけにアクセスします
+# - 出品者が決まらない検索（find_all・find_by_name）は全シャードに並列で問い合わせ、ID順に結合します
+# shard_database_urls が空の場合（既定）はシャーディングを行わず、従来どおり1つのデータベースを使います
+#
+# 使い方:
+#   SHARD_DATABASE_URLS=sqlite:///./shard0.db,sqlite:///./shard1.db python -m sharding init       # シャードにテーブルを作成
+#   SHARD_DATABASE_URLS=sqlite:///./shard0.db,sqlite:///./shard1.db python -m sharding rebalance  # シャード追加後に商品を移動
+# 既存の環境でシャーディングを有効にした場合、メインのデータベースにある商品は rebalance でシャードへ移動するまで見えません
+# 注意：商品とメインのデータベースの変更は別々にコミットされ、全体として原子的ではありません（make_sessionmaker を参照）
+
+# 必要なライブラリをインポート
+import argparse  # コマンドライン引数
+import bisect  # ハッシュリングの探索
+from concurrent.futures import ThreadPoolExecutor  # 全シャードへの並列問い合わせ
+import hashlib  # シャードを決めるハッシュ関数
+import heapq  # 並び順を保った結合
+import threading  # ID割り当てのロック
+from sqlalchemy import create_engine, select, update, insert, delete, func, event, bindparam  # SQLAlchemyの機能
+from sqlalchemy.exc import IntegrityError  # 一意制約違反
+from sqlalchemy.ext.horizontal_shard import ShardedSession  # SQLAlchemyのシャーディング用セッション
+from sqlalchemy.orm import Session, sessionmaker  # データベースセッション
+from sqlalchemy.schema import CreateTable  # テーブル作成
+from sqlalchemy.sql import operators, visitors  # WHERE句の解析
+import timing  # 並列問い合わせの処理時間の計測
+
+
+# メインのデータベースのシャードID
+PRIMARY = 'primary'
+# シャードに分割するテーブル（出品者のユーザーIDを user_id 列に持つテーブル）
+SHARDED_TABLES = {'items', 'archived_items'}
+
+
+def _hash(key: str):
+    # プロセスや実行環境によらず同じ値になるハッシュ関数
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ShardMap:
+    """
+    ユーザーIDからシャードを決めるコンシステントハッシュのリング
+    各シャードを vnodes 個の仮想ノードとしてリング上に配置し、ユーザーIDのハッシュ値の次にあるノードのシャードを選びます
+    シャードを追加したときに移動するのは、おおよそ「1 / シャード数」の出品者だけです
+    """
+
+    def __init__(self, shard_ids: list[str], vnodes: int = 64):
+        self.shard_ids = list(shard_ids)
+        ring = sorted((_hash(f'{shard_id}#{i}'), shard_id) for shard_id in self.shard_ids for i in range(vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [shard_id for _, shard_id in ring]
+
+    def shard_for(self, user_id: int):
+        """
+        ユーザーIDの商品を置くシャードIDを返す関数
+        """
+        index = bisect.bisect(self._points, _hash(str(user_id))) % len(self._points)
+        return self._owners[index]
+
+
+class IdAllocator:
+    """
+    全シャードで重複しない商品IDを割り当てるクラス
+    メインのデータベースの id_blocks テーブルから block_size 個ずつIDの範囲を予約し、プロセス内で順番に配ります
+    """
+
+    def __init__(self, engine, shard_engines: dict, block_size: int = 100):
+        self.engine = engine
+        self.shard_engines = shard_engines
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self, table_name: str):
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self._reserve(table_name)
+                self._end = self._next + self.block_size
+            self._next += 1
+            return self._next - 1
+
+    def _reserve(self, table_name: str):
+        # 予約した範囲の先頭のIDを返す（呼び出し元のトランザクションとは別にすぐコミットする）
+        from models import IdBlock
+        id_blocks = IdBlock.__table__
+        with self.engine.begin() as conn:
+            reserved = conn.execute(
+                update(id_blocks)
+                .where(id_blocks.c.name == table_name)
+                .values(next_id=id_blocks.c.next_id + self.block_size)
+                .returning(id_blocks.c.next_id)
+            ).scalar()
+        if reserved is not None:
+            return reserved - self.block_size
+
+        # 初回は既存の商品IDの最大値の次から始める
+        # アーカイブ済みの商品も同じIDを使い続けるため、メインのデータベース（シャーディング前の商品）と
+        # 全シャードの商品・アーカイブ済みの商品のIDの最大値を使う
+        start = 1 + max(_max_id(engine) for engine in (self.engine, *self.shard_engines.values()))
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(id_blocks).values(name=table_name, next_id=start + self.block_size))
+            return start
+        except IntegrityError:
+            # 他のプロセスが先に作成した場合は、もう一度予約する
+            return self._reserve(table_name)
+
+
+def _max_id(engine):
+    # 商品とアーカイブ済みの商品のIDの最大値を返す
+    from database import Base
+    with engine.connect() as conn:
+        return max(
+            conn.execute(select(func.max(Base.metadata.tables[table_name].c.id))).scalar() or 0
+            for table_name in SHARDED_TABLES
+        )
+
+
+def _table_name(mapper):
+    return mapper.local_table.name if mapper is not None else None
+
+
+def _user_ids(statement, parameters=None):
+    # WHERE句から「シャード対象テーブル.user_id == 値」の条件を探し、値の一覧を返す
+    # 値を後から渡す bindparam('user_id') の場合は、実行時のパラメーターから値を取り出します
+    # AND で結合された条件を前提としています（OR で別の出品者を指定する検索は全シャードに問い合わせてください）
+    whereclause = getattr(statement, 'whereclause', None)
+    if whereclause is None:
+        return set()
+    user_ids = set()
+    for element in visitors.iterate(whereclause):
+        left = getattr(element, 'left', None)
+        right = getattr(element, 'right', None)
+        if (
+            getattr(element, 'operator', None) is operators.eq
+            and getattr(left, 'name', None) == 'user_id'
+            and getattr(getattr(left, 'table', None), 'name', None) in SHARDED_TABLES
+            and hasattr(right, 'effective_value')
+        ):
+            value = right.effective_value
+            if value is None and isinstance(parameters, dict):
+                value = parameters.get(right.key)
+            if value is not None:
+                user_ids.add(value)
+    return user_ids
+
+
+def make_sessionmaker(engine, shard_urls: list[str], vnodes: int = 64, id_block_size: int = 100):
+    """
+    データベースセッションを作成するファクトリを返す関数
+    shard_urls が空の場合は通常のセッション、指定された場合は商品をシャードに振り分けるセッションを作成します
+
+    注意：シャーディングしている場合、1回の commit はメインのデータベースとシャードのトランザクションを順番にコミットするだけで、
+    2相コミットではありません。商品（シャード）と、同じ処理で書き込むジョブ・統計情報・注文（メインのデータベース）の
+    片方だけがコミットされることがあり、トランザクショナル・アウトボックス（jobs.queue.enqueue）の保証は
+    シャーディングしていない場合に限られます。取りこぼしは次のように補われます
+    - 統計情報: stats.reconcile の定期ジョブが商品テーブルと照合して補正します
+    - 類似商品の索引: 定期的に作り直す索引に含まれます（item.changed ジョブは商品の現在の状態を読み直すため、商品の変更なしに実行されても害はありません）
+    - 通知などの副作用: 失われることがあります
+    """
+    if not shard_urls:
+        return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    shard_engines = {f'shard{i}': _create_engine(url) for i, url in enumerate(shard_urls)}
+    shard_map = ShardMap(list(shard_engines), vnodes)
+    allocator = IdAllocator(engine, shard_engines, id_block_size)
+
+    def shard_chooser(mapper, instance, clause=None):
+        # 商品は出品者のユーザーIDで、それ以外はメインのデータベースに保存する
+        if _table_name(mapper) in SHARDED_TABLES and instance is not None:
+            return shard_map.shard_for(instance.user_id)
+        return PRIMARY
+
+    def identity_chooser(mapper, primary_key, **kw):
+        # 主キーだけでは出品者が分からないため、商品は全シャードを探す
+        if _table_name(mapper) in SHARDED_TABLES:
+            return shard_map.shard_ids
+        return [PRIMARY]
+
+    def execute_chooser(context):
+        # 出品者が指定されていればそのシャードだけ、指定されていなければ全シャードに問い合わせる
+        if _table_name(context.bind_mapper) not in SHARDED_TABLES:
+            return [PRIMARY]
+        user_ids = _user_ids(context.statement, context.parameters)
+        if user_ids:
+            return sorted({shard_map.shard_for(user_id) for user_id in user_ids})
+        return shard_map.shard_ids
+
+    class ItemShardedSession(ShardedSession):
+        pass
+
+    # シャードごとの通常のセッションのファクトリ（並列問い合わせ・再配置ツール用）
+    ItemShardedSession.shard_factories = {
+        shard_id: sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+        for shard_id, shard_engine in shard_engines.items()
+    }
+    ItemShardedSession.shard_map = shard_map
+
+    @event.listens_for(ItemShardedSession, 'before_flush')
+    def assign_ids(session, flush_context, instances):
+        # 新しい商品には全シャードで一意なIDを割り当てる（シャードごとの自動採番は使わない）
+        for obj in session.new:
+            table_name = _table_name(getattr(obj, '__mapper__', None))
+            if table_name in SHARDED_TABLES and obj.id is None:
+                obj.id = allocator.next_id(table_name)
+
+    return sessionmaker(
+        class_=ItemShardedSession,
+        autocommit=False,
+        autoflush=False,
+        shards={PRIMARY: engine, **shard_engines},
+        shard_chooser=shard_chooser,
+        identity_chooser=identity_chooser,
+        execute_chooser=execute_chooser,
+    )
+
+
+def _create_engine(url: str):
+    if url.startswith('sqlite'):
+        return create_engine(url, connect_args={'check_same_thread': False})
+    from database import connect_args
+    return create_engine(url, connect_args=connect_args(url))
+
+
+# 全シャードへの並列問い合わせに使うスレッドプール
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='shard-scatter')
+
+
+def scatter(db: Session, statement, key, params: dict | None = None):
+    """
+    商品の検索を全シャードに並列で問い合わせ、key の順に結合して返す関数
+    statement は key と同じ順で並べ替える ORDER BY を含めてください
+    params には statement の bindparam に渡す値を指定します
+    シャーディングしていない場合は、そのまま db で実行します
+    """
+    factories = getattr(db, 'shard_factories', None)
+    if not factories:
+        return db.scalars(statement, params).all()
+
+    def run(factory):
+        with factory() as session:
+            return session.scalars(statement, params).all()
+
+    # 各スレッドのクエリ時間を足し合わせると実際の待ち時間より長くなるため、
+    # 全シャードの結果がそろうまでの時間を1回だけ db の時間として記録する
+    with timing.phase('db'):
+        futures = [_executor.submit(run, factory) for factory in factories.values()]
+        results = [future.result() for future in futures]
+    return list(heapq.merge(*results, key=key))
+
+
+def create_shard_schema(shard_engine):
+    """
+    シャードに商品のテーブルを作成する関数
+    ユーザーテーブルはメインのデータベースにあるため、外部キー制約は作成しません
+    """
+    from database import Base
+    with shard_engine.begin() as conn:
+        for table_name in SHARDED_TABLES:
+            table = Base.metadata.tables[table_name]
+            conn.execute(CreateTable(table, include_foreign_key_constraints=[], if_not_exists=True))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def rebalance(session_factory, batch_size: int = 500, dry_run: bool = False):
+    """
+    シャードの追加・削除後に、担当ではないシャードにある商品を担当のシャードへ移動する関数
+    出品者ごとに「移動先へコピーしてコミット → コピーした商品だけを移動元から削除してコミット」を行うため、
+    途中で止まっても再実行すれば続きから移動できます（コピー済みの商品は重複して作成しません）
+    移動中に移動元へ書き込まれた商品も失わずに移動します
+    シャーディングを有効にする前にメインのデータベースに保存された商品も、担当のシャードへ移動します
+    移動した商品の件数を返します
+    """
+    from database import Base
+    factories = session_factory.class_.shard_factories
+    shard_map = session_factory.class_.shard_map
+    sources = dict(factories)
+    primary_engine = session_factory.kw['shards'][PRIMARY]
+    shard_urls = {_url(factory.kw['bind']) for factory in factories.values()}
+    if _url(primary_engine) not in shard_urls:
+        # メインのデータベースはどの出品者の担当でもないため、残っている商品は全て移動する
+        # （メインのデータベースをシャードとしても指定している場合は、そのシャードとして扱う）
+        sources = {PRIMARY: sessionmaker(autocommit=False, autoflush=False, bind=primary_engine), **sources}
+    moved = 0
+    for source_id, source_factory in sources.items():
+        with source_factory() as source:
+            for table_name in SHARDED_TABLES:
+                table = Base.metadata.tables[table_name]
+                last_user_id = None
+                while True:
+                    # このシャードにいる出品者を batch_size 人ずつ確認する
+                    query = select(table.c.user_id).distinct().order_by(table.c.user_id).limit(batch_size)
+                    if last_user_id is not None:
+                        query = query.where(table.c.user_id > last_user_id)
+                    user_ids = source.scalars(query).all()
+                    if not user_ids:
+                        break
+                    last_user_id = user_ids[-1]
+                    for user_id in user_ids:
+                        target_id = shard_map.shard_for(user_id)
+                        if target_id != source_id:
+                            moved += _move(table, user_id, source, factories[target_id], dry_run)
+    return moved
+
+
+def _url(engine):
+    return engine.url.render_as_string(hide_password=False)
+
+
+def _move(table, user_id: int, source: Session, target_factory, dry_run: bool):
+    # 出品者の商品を移動先にコピーしてから、コピーした内容のままの商品だけを移動元から削除する
+    # コピーの後に移動元で追加・更新された商品（古いリングを使うプロセスが書き込んだ場合など）は削除せず、
+    # 移動元に商品がなくなるまでコピーと削除を繰り返す
+    moved = 0
+    while True:
+        rows = [dict(row) for row in source.execute(select(table).where(table.c.user_id == user_id)).mappings()]
+        if dry_run or not rows:
+            return moved + len(rows)
+        ids = [row['id'] for row in rows]
+        with target_factory() as target:
+            # 前回の途中までのコピーや更新前のコピーは、最新の内容で置き換える
+            target.execute(delete(table).where(table.c.id.in_(ids)))
+            target.execute(insert(table), rows)
+            target.commit()
+        deleted = source.execute(
+            delete(table).where(
+                table.c.id == bindparam('moved_id'),
+                table.c.updated_at.is_not_distinct_from(bindparam('moved_updated_at')),
+            ),
+            [{'moved_id': row['id'], 'moved_updated_at': row['updated_at']} for row in rows],
+        ).rowcount
+        source.commit()
+        moved += deleted
+
+
+def main():
+    """
+    シャードの管理コマンド
+    init: 全シャードに商品のテーブルを作成します
+    rebalance: 担当ではないシャードにある商品を担当のシャードへ移動します
+    """
+    parser = argparse.ArgumentParser(description='Item shard management')
+    parser.add_argument('command', choices=['init', 'rebalance'])
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    import models  # noqa: F401  テーブル定義を読み込む
+    from database import Base, engine, SessionLocal
+    factories = getattr(SessionLocal.class_, 'shard_factories', None)
+    if not factories:
+        parser.error('SHARD_DATABASE_URLS is not configured')
+
+    if args.command == 'init':
+        Base.metadata.create_all(bind=engine)
+        for factory in factories.values():
+            create_shard_schema(factory.kw['bind'])
+        print(f'created item tables on {len(factories)} shards')
+    else:
+        moved = rebalance(SessionLocal, args.batch_size, args.dry_run)
+        print(f"{'would move' if args.dry_run else 'moved'} {moved} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+# 類似商品の検索機能ファイル
+# このファイルは、商品名と説明の文字n-gramのTF-IDFベクトルで「似ている商品」を探す機能を提供します
+# - 文字の2-gram・3-gramを使うため、日本語のように単語の区切りがない文章でも部分的な一致を拾えます
+# - n-gramはハッシュで固定の次元（N_FEATURES）に割り当てるため、語彙の辞書を持ちません
+# - ベクトルは特徴量ごとに商品を並べた疎行列（CSC形式）で持ち、転置インデックスと同じく
+#   問い合わせに含まれる特徴量の列だけを読んでコサイン類似度を計算します
+# - 販売中の商品だけを索引に入れます。商品の変更は item.changed ジョブが変更履歴（item_changes テーブル）に記録し、
+#   各プロセスが similar_reload_interval 秒ごとに読んで差分として反映します
+# - 索引の読み込み・作成はバックグラウンドのスレッドで行い、リクエストを処理するイベントループを止めません
+# - similar_index_dir を指定すると定期ジョブで作り直した索引をファイルに保存し、各プロセスはメモリマップで読み込むため
+#   100万件の商品があってもワーカーはすぐに起動できます。指定しない場合は各プロセスが自分で作り直します
+
+# 必要なライブラリをインポート
+from collections import Counter  # n-gramの出現回数
+from datetime import datetime, timedelta  # 変更履歴の保存期間
+import logging  # ログ出力
+from operator import attrgetter  # 並び順のキー
+import os  # ファイルの保存
+import shutil  # 古い索引の削除
+import threading  # 索引の更新のロック
+import time  # 索引の読み直しの間隔
+import unicodedata  # 文字の正規化
+import zlib  # n-gramのハッシュ
+import numpy as np  # ベクトル計算
+from scipy import sparse  # 疎行列
+from sqlalchemy import select, delete, func, or_, bindparam  # SQL文の組み立て
+from sqlalchemy.orm import Session  # データベースセッション
+from models import Item, ItemChange  # データベースモデル
+from schemas import ItemStatus  # 商品の状態
+from config import get_settings
+import sharding  # 商品テーブルのシャーディング
+
+
+logger = logging.getLogger(__name__)
+
+
+# n-gramを割り当てる特徴量の次元数（2のべき乗）
+N_FEATURES = 1 << 18
+# 使用する文字n-gramの長さ
+NGRAMS = (2, 3)
+# 商品名のn-gramの重み（説明より短く、商品の特定に効くため）
+NAME_WEIGHT = 2
+# 問い合わせに使う特徴量の最大数（重みの大きいものから使う）
+MAX_QUERY_TERMS = 48
+# 問い合わせに使う特徴量の出現商品数の上限（商品数に対する割合）
+# ほとんどの商品に出てくるn-gramはIDFが小さく順位にほぼ影響しないため、読み飛ばして計算量を抑えます
+# 商品が少ないうちは読み飛ばさないよう、上限は MIN_MAX_DF 件より小さくしません
+MAX_DF_RATIO = 0.05
+MIN_MAX_DF = 10000
+# 一度に読む変更履歴の件数
+CHANGE_BATCH_SIZE = 1000
+# 変更履歴のIDの抜けを、まだコミットされていない変更として読み直す秒数
+CHANGE_GAP_TIMEOUT = 60
+
+# 索引に入れる商品（販売中の商品の ID・商品名・説明）
+_INDEXED_ITEMS = (
+    select(Item.id, Item.name, Item.description).where(Item.status == ItemStatus.ON_SALE).order_by(Item.id)
+)
+# 変更履歴に記録された商品の現在の状態
+_FIND_BY_IDS = select(Item).where(Item.id.in_(bindparam('ids', expanding=True))).order_by(Item.id)
+
+
+def ngram_counts(name: str, description: str | None):
+    """
+    商品名と説明から、特徴量ごとのn-gramの出現回数を数える関数
+    """
+    counts = Counter()
+    for text, weight in ((name, NAME_WEIGHT), (description, 1)):
+        if not text:
+            continue
+        # 全角・半角や大文字・小文字の違いをそろえ、前後に空白を付けて先頭・末尾の文字も拾う
+        text = f" {unicodedata.normalize('NFKC', text).lower()} "
+        for n in NGRAMS:
+            for i in range(len(text) - n + 1):
+                counts[zlib.crc32(text[i:i + n].encode()) & (N_FEATURES - 1)] += weight
+    return counts
+
+
+class SimilarIndex:
+    """
+    類似商品の索引
+    作成時点の商品の疎行列（ベース）と、その後に変更された商品の差分を持ちます
+    ベースの配列は読み取り専用（メモリマップの場合もある）で、変更は差分と削除フラグにだけ書き込みます
+    watermark は反映済みの変更履歴のIDで、これより後の変更を変更履歴から読んで反映します
+    """
+
+    def __init__(self, ids, matrix, idf, watermark: int = 0):
+        # ベースの商品ID（昇順）。行番号 i の商品IDが ids[i]
+        self.ids = ids
+        # ベースの商品ベクトル（商品数 × N_FEATURES、CSC形式、各行はL2正規化済み）
+        self.matrix = matrix
+        # 特徴量ごとのIDF（索引の作成時点の値。差分の商品にも同じ値を使う）
+        self.idf = idf
+        # 特徴量ごとの出現商品数（問い合わせで読み飛ばす特徴量の判定に使う）
+        self.df = np.diff(matrix.indptr)
+        # 差分で置き換え・削除されたベースの行番号
+        self._dead = set()
+        # 索引の作成後に変更された商品（商品ID → (特徴量, 重み)。削除された商品は None）
+        self._delta = {}
+        # 差分の商品ベクトル（問い合わせ時に必要になったら作成する）
+        self._delta_matrix = None
+        self._lock = threading.Lock()
+        # 反映済みの変更履歴のIDと、まだコミットされていない可能性がある抜けたID（ID → 見つけた時刻）
+        self.watermark = watermark
+        self.gaps = {}
+        # 索引を作成・読み込みした時刻
+        self.built_at = time.time()
+
+    @classmethod
+    def build(cls, rows, watermark: int = 0):
+        """
+        (商品ID, 商品名, 説明) の一覧から索引を作成する関数
+        rows は商品IDの昇順に並べてください。watermark には rows を読む前の変更履歴の最新のIDを指定します
+        """
+        ids, row_numbers, columns, counts = [], [], [], []
+        for row, (item_id, name, description) in enumerate(rows):
+            ids.append(item_id)
+            for column, count in ngram_counts(name, description).items():
+                row_numbers.append(row)
+                columns.append(column)
+                counts.append(count)
+        n = len(ids)
+        tf = sparse.csr_matrix(
+            (np.asarray(counts, dtype=np.float32), (np.asarray(row_numbers, dtype=np.int32), np.asarray(columns, dtype=np.int32))),
+            shape=(n, N_FEATURES),
+        )
+        # IDF（出現する商品が少ないn-gramほど大きい）
+        df = np.bincount(tf.indices, minlength=N_FEATURES)
+        idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+        # 出現回数は対数で抑えてからIDFを掛け、行ごとにL2正規化する
+        tf.data = (1 + np.log(tf.data)) * idf[tf.indices]
+        norms = np.sqrt(np.asarray(tf.multiply(tf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms).dot(tf).tocsc().astype(np.float32)
+        return cls(np.asarray(ids, dtype=np.int64), matrix, idf, watermark)
+
+    def save(self, directory: str):
+        """
+        索引のベースをファイルに保存する関数
+        新しいディレクトリに書き出してから CURRENT ファイルを置き換えるため、読み込み中のプロセスに影響しません
+        保存したディレクトリ名を返します
+        """
+        name = f'index-{time.time_ns()}'
+        path = os.path.join(directory, name)
+        os.makedirs(path)
+        for key, array in self._arrays().items():
+            np.save(os.path.join(path, f'{key}.npy'), array)
+        tmp = os.path.join(directory, 'CURRENT.tmp')
+        with open(tmp, 'w') as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(directory, 'CURRENT'))
+        return name
+
+    def _arrays(self):
+        return {
+            'ids': self.ids,
+            'idf': self.idf,
+            'data': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+            'watermark': np.asarray([self.watermark], dtype=np.int64),
+        }
+
+    @classmethod
+    def load(cls, directory: str, name: str):
+        """
+        保存した索引をメモリマップで読み込む関数
+        配列はファイルから必要な部分だけ読み込まれるため、索引が大きくてもすぐに使い始められます
+        """
+        arrays = {
+            key: np.load(os.path.join(directory, name, f'{key}.npy'), mmap_mode='r')
+            for key in ('ids', 'idf', 'data', 'indices', 'indptr', 'watermark')
+        }
+        matrix = sparse.csc_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']), shape=(len(arrays['ids']), N_FEATURES), copy=False
+        )
+        return cls(arrays['ids'], matrix, arrays['idf'], int(arrays['watermark'][0]))
+
+    def vector(self, name: str, description: str | None):
+        """
+        商品名と説明のベクトル（特徴量, 重み）を計算する関数
+        """
+        counts = ngram_counts(name, description)
+        columns = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[columns]
+        norm = np.sqrt(np.dot(weights, weights))
+        return columns, (weights / norm if norm else weights).astype(np.float32)
+
+    def upsert(self, item_id: int, name: str, description: str | None):
+        """
+        商品を索引に追加・更新する関数
+        """
+        self._set(item_id, self.vector(name, description))
+
+    def remove(self, item_id: int):
+        """
+        商品を索引から削除する関数
+        """
+        self._set(item_id, None)
+
+    def _set(self, item_id: int, vector):
+        with self._lock:
+            row = self._row_of(item_id)
+            if row is not None:
+                self._dead.add(row)
+            self._delta[item_id] = vector
+            self._delta_matrix = None
+
+    def _row_of(self, item_id: int):
+        # ベースでの行番号（ベースにない場合は None）
+        row = int(np.searchsorted(self.ids, item_id))
+        return row if row < len(self.ids) and self.ids[row] == item_id else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self.ids) - len(self._dead) + sum(1 for vector in self._delta.values() if vector is not None)
+
+    def similar(self, queries: list, k: int = 10):
+        """
+        複数の商品に似ている商品をまとめて探す関数
+        queries は (商品ID, 商品名, 説明) の一覧で、それぞれ自分以外の上位 k 件の (商品ID, 類似度) を返します
+        """
+        with self._lock:
+            dead_rows = np.fromiter(self._dead, dtype=np.int64, count=len(self._dead))
+            delta_ids, delta_matrix = self._delta_snapshot()
+
+        results = []
+        for item_id, name, description in queries:
+            columns, weights = self._query_terms(*self.vector(name, description))
+            candidates = []
+            if len(columns):
+                # 問い合わせに含まれる特徴量の列（その特徴量を持つ商品の一覧）だけを読んで類似度を計算する
+                scores = self.matrix[:, columns].dot(weights)
+                scores[dead_rows] = 0
+                candidates += _top_k(self.ids, scores, k + 1)
+                if delta_matrix is not None:
+                    candidates += _top_k(delta_ids, delta_matrix[:, columns].dot(weights), k + 1)
+            candidates = [(candidate, score) for candidate, score in candidates if candidate != item_id]
+            candidates.sort(key=lambda candidate: (-candidate[1], candidate[0]))
+            results.append(candidates[:k])
+        return results
+
+    def _query_terms(self, columns, weights):
+        # 問い合わせに使う特徴量を選ぶ
+        # ほとんどの商品に出てくる特徴量と、重みの小さい特徴量は読み飛ばす
+        keep = self.df[columns] <= max(MIN_MAX_DF, int(len(self.ids) * MAX_DF_RATIO))
+        columns, weights = columns[keep], weights[keep]
+        order = np.argsort(-weights)[:MAX_QUERY_TERMS]
+        return columns[order], weights[order]
+
+    def _delta_snapshot(self):
+        # 差分の商品ベクトルを疎行列にまとめる（変更があるまで使い回す）
+        if self._delta_matrix is None:
+            entries = sorted((item_id, vector) for item_id, vector in self._delta.items() if vector is not None)
+            ids = np.asarray([item_id for item_id, _ in entries], dtype=np.int64)
+            if entries:
+                indptr = np.cumsum([0] + [len(columns) for _, (columns, _) in entries])
+                matrix = sparse.csr_matrix(
+                    (
+                        np.concatenate([weights for _, (_, weights) in entries]),
+                        np.concatenate([columns for _, (columns, _) in entries]),
+                        indptr,
+                    ),
+                    shape=(len(entries), N_FEATURES),
+                ).tocsc()
+            else:
+                matrix = None
+            self._delta_matrix = (ids, matrix)
+        return self._delta_matrix
+
+
+def _top_k(ids, scores, k: int):
+    # 類似度が0より大きい商品から上位 k 件の (商品ID, 類似度) を返す
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+    return [(int(ids[row]), float(scores[row])) for row in candidates]
+
+
+# プロセス内で共有する索引（バックグラウンドのスレッドで読み込み・作成する）
+_index = None
+# 読み込んだ保存済みの索引の名前と、最後に索引を最新にし始めた時刻
+_loaded_name = None
+_checked_at = 0.0
+# 索引を最新にしているバックグラウンドのスレッド
+_refresher = None
+_lock = threading.Lock()
+# 索引の読み込み・作成に使うセッションのファクトリ（None の場合は database.SessionLocal を使う）
+session_factory = None
+
+
+def build_from_db(db: Session):
+    """
+    データベースの販売中の商品から索引を作成する関数
+    商品を読む前に変更履歴の最新のIDを記録し、作成中の変更は後から変更履歴で反映します
+    """
+    watermark = db.scalar(select(func.max(ItemChange.id))) or 0
+    return SimilarIndex.build(db.execute(_INDEXED_ITEMS), watermark)
+
+
+def get_index():
+    """
+    プロセス内で共有する索引を取得する関数
+    索引の準備ができていない場合は None を返します
+    読み込み・作成と変更の反映はバックグラウンドのスレッドで行うため、呼び出し元を待たせません
+    （最初の呼び出しで始まり、その後は similar_reload_interval 秒ごとに最新にします）
+    """
+    global _checked_at, _refresher
+    with _lock:
+        now = time.monotonic()
+        idle = _refresher is None or not _refresher.is_alive()
+        if idle and now - _checked_at >= get_settings().similar_reload_interval:
+            _checked_at = now
+            _refresher = threading.Thread(target=_refresh_in_background, name='similar-refresh', daemon=True)
+            _refresher.start()
+        return _index
+
+
+def _refresh_in_background():
+    factory = session_factory
+    if factory is None:
+        from database import SessionLocal as factory
+    try:
+        with factory() as db:
+            refresh(db)
+    except Exception:
+        # データベースに接続できない場合なども、次の周期で再試行する
+        logger.exception('Failed to refresh similar item index')
+
+
+def refresh(db: Session):
+    """
+    プロセス内の索引を最新にする関数
+    - 別のプロセスが保存した新しい索引があれば、メモリマップで読み込みます
+    - 索引がまだない場合、変更履歴が削除済みで追いつけない場合、
+      similar_index_dir を指定せずに similar_rebuild_interval 秒以上経った場合は、データベースから作り直します
+    - 索引の作成後の変更を変更履歴から反映します
+    """
+    global _index, _loaded_name
+    settings = get_settings()
+    with _lock:
+        index, name = _index, _loaded_name
+    current = _current_name(settings.similar_index_dir) if settings.similar_index_dir else None
+    if current is not None and current != name:
+        index, name = SimilarIndex.load(settings.similar_index_dir, current), current
+    stale = not settings.similar_index_dir and index is not None and time.time() - index.built_at >= settings.similar_rebuild_interval
+    if index is None or stale or _missed_changes(db, index):
+        index = build_from_db(db)
+    apply_changes(db, index)
+    with _lock:
+        _index, _loaded_name = index, name
+
+
+def _missed_changes(db: Session, index: SimilarIndex):
+    # 索引が読んだ位置より後の変更履歴が既に削除されているかどうか
+    oldest = db.scalar(select(func.min(ItemChange.id)))
+    return oldest is not None and oldest > index.watermark + 1
+
+
+def apply_changes(db: Session, index: SimilarIndex):
+    """
+    索引の作成後に記録された商品の変更を、変更履歴から索引に反映する関数
+    販売中の商品は追加・更新し、売り切れ・削除された商品は索引から外します
+    IDの抜けはまだコミットされていない変更の可能性があるため、CHANGE_GAP_TIMEOUT 秒の間は読み直します
+    反映した商品の数を返します
+    """
+    applied = 0
+    while True:
+        now = time.monotonic()
+        index.gaps = {change_id: seen for change_id, seen in index.gaps.items() if now - seen < CHANGE_GAP_TIMEOUT}
+        condition = ItemChange.id > index.watermark
+        if index.gaps:
+            condition = or_(condition, ItemChange.id.in_(list(index.gaps)))
+        changes = db.execute(
+            select(ItemChange.id, ItemChange.item_id).where(condition).order_by(ItemChange.id).limit(CHANGE_BATCH_SIZE)
+        ).all()
+        for change in changes:
+            if change.id > index.watermark:
+                index.gaps.update(dict.fromkeys(range(max(index.watermark + 1, change.id - CHANGE_BATCH_SIZE), change.id), now))
+                index.watermark = change.id
+            else:
+                index.gaps.pop(change.id, None)
+        applied += _apply_items(db, index, sorted({change.item_id for change in changes}))
+        if len(changes) < CHANGE_BATCH_SIZE:
+            return applied
+
+
+def _apply_items(db: Session, index: SimilarIndex, item_ids: list):
+    # 商品の現在の状態を読み、販売中なら索引に追加・更新し、それ以外は索引から外す
+    if not item_ids:
+        return 0
+    found = {item.id: item for item in sharding.scatter(db, _FIND_BY_IDS, key=attrgetter('id'), params={'ids': item_ids})}
+    for item_id in item_ids:
+        item = found.get(item_id)
+        if item is not None and item.status == ItemStatus.ON_SALE:
+            index.upsert(item_id, item.name, item.description)
+        else:
+            index.remove(item_id)
+    return len(item_ids)
+
+
+def record_change(db: Session, item_id: int):
+    """
+    商品の変更を変更履歴に記録する関数（item.changed ジョブから呼び出します）
+    コミットはせず、呼び出し元のトランザクションに含めます
+    """
+    db.add(ItemChange(item_id=item_id))
+
+
+def prune_changes(db: Session):
+    """
+    古い変更履歴を削除する関数（定期ジョブから呼び出します）
+    similar_rebuild_interval の2倍より前の変更は作り直した索引に含まれているため、読む必要がありません
+    削除した件数を返します
+    """
+    cutoff = datetime.now() - timedelta(seconds=2 * get_settings().similar_rebuild_interval)
+    return db.execute(
+        delete(ItemChange).where(ItemChange.created_at < cutoff).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _current_name(directory: str):
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def rebuild(db: Session):
+    """
+    索引を作り直して similar_index_dir に保存する関数（定期ジョブから呼び出します）
+    各プロセスは保存された索引を similar_reload_interval 秒以内にメモリマップで読み込み、
+    保存後の変更は変更履歴から反映します。古い索引のファイルは削除します
+    索引に入れた商品の数を返します
+    """
+    directory = get_settings().similar_index_dir
+    index = build_from_db(db)
+    name = index.save(directory)
+    _remove_old_indexes(directory, keep=name)
+    return len(index)
+
+
+def _remove_old_indexes(directory: str, keep: str):
+    # 古い索引のディレクトリを削除する（読み込み中のプロセスはメモリマップを開いたままなので影響しません）
+    for name in os.listdir(directory):
+        if name.startswith('index-') and name != keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
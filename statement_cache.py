@@ -0,0 +1,46 @@
+# SQL文のキャッシュ状況の計測ファイル
+# このファイルは、SQLAlchemyのコンパイル済みSQL文のキャッシュがどれだけ使われているかを数えます
+# - hit   : コンパイル済みのSQL文を再利用できた実行
+# - miss  : SQL文を新たにコンパイルした実行（起動直後や、毎回形の変わるSQL文）
+# - other : キャッシュの対象外の実行（テキストSQL・DDLなど）
+# ヒット率が低い場合は、呼び出しごとにSQL文の形が変わる書き方（IN句の要素数の違いなど）をしていないか確認してください
+
+# 必要なライブラリをインポート
+import threading  # カウンターのロック
+from sqlalchemy import event  # データベースのイベント
+from sqlalchemy.engine import Engine  # データベースエンジン
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS  # キャッシュの状態
+
+
+# 実行結果ごとの回数
+_counts = {'hit': 0, 'miss': 0, 'other': 0}
+_lock = threading.Lock()
+
+
+# SQL文の実行ごとにキャッシュの状態を数える（全てのエンジンが対象）
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    cache_hit = getattr(context, 'cache_hit', None)
+    key = 'hit' if cache_hit is CACHE_HIT else 'miss' if cache_hit is CACHE_MISS else 'other'
+    with _lock:
+        _counts[key] += 1
+
+
+def snapshot():
+    """
+    現在までのキャッシュの利用状況を返す関数
+    hit_rate はキャッシュの対象となった実行のうち、再利用できた割合です
+    """
+    with _lock:
+        counts = dict(_counts)
+    cacheable = counts['hit'] + counts['miss']
+    return {**counts, 'hit_rate': counts['hit'] / cacheable if cacheable else 0.0}
+
+
+def reset():
+    """
+    回数を0に戻す関数（ベンチマーク・テスト用）
+    """
+    with _lock:
+        for key in _counts:
+            _counts[key] = 0
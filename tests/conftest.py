@@ -3,6 +3,11 @@
 # pytestフレームワークでテストを実行する際の環境を整えます
 
 # 必要なライブラリをインポート
+import os  # 環境変数の設定
+
+# テスト中はプロセス内のジョブワーカーを起動しない（ジョブはテストから直接実行します）
+os.environ.setdefault('JOB_WORKERS', '0')
+
 import pytest  # テストフレームワーク
 from fastapi.testclient import TestClient  # FastAPIのテストクライアント
 from sqlalchemy import create_engine  # データベースエンジン作成
@@ -0,0 +1,95 @@
+# 商品のアーカイブ関連のテストファイル
+# このファイルは、古い売り切れ商品がアーカイブテーブルへ移動されるかを確認します
+# - 通常の検索はアーカイブ済みの商品を返さず、include_archived を指定した場合だけ返すこと
+# - 復元・ユーザーの削除がアーカイブテーブルにも反映されること
+# - アーカイブした商品のIDが新しい商品に使い回されないこと
+
+from datetime import datetime, timedelta  # 日時計算
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from cruds import auth as auth_cruds, item as item_cruds, archive as archive_cruds, stats as stats_cruds  # ビジネスロジック
+from main import app  # FastAPIアプリケーション
+from models import Item, ArchivedItem  # データベースモデル
+from schemas import ItemStatus, ItemCreate, UserCreate, DecodedToken  # データスキーマ
+
+
+def sell_out(db, item, days_ago):
+    # 商品を指定した日数前に売り切れになったことにする
+    item.status = ItemStatus.SOLD_OUT
+    item.updated_at = datetime.now() - timedelta(days=days_ago)
+    db.commit()
+
+
+def test_古い売り切れ商品だけがアーカイブされる(db_fixture, item_fixture):
+    stats_cruds.reconcile(db_fixture)
+    sell_out(db_fixture, item_fixture[0], days_ago=60)
+    stats_cruds.reconcile(db_fixture)
+
+    assert archive_cruds.archive_sold_out(db_fixture, timedelta(days=30), batch_size=1) == 1
+    assert [item.name for item in item_cruds.find_all(db_fixture)] == ["PC2"]
+    assert [item.name for item in item_cruds.find_all(db_fixture, include_archived=True)] == ["PC1", "PC2"]
+    assert [item.name for item in item_cruds.find_by_name(db_fixture, "PC1", include_archived=True)] == ["PC1"]
+    # 統計情報は商品テーブルと一致している
+    assert stats_cruds.reconcile(db_fixture) == 0
+
+    # 最近売り切れになった商品は移動しない
+    sell_out(db_fixture, item_fixture[1], days_ago=1)
+    assert archive_cruds.archive_sold_out(db_fixture, timedelta(days=30)) == 0
+
+
+def test_アーカイブ済みの商品を復元できる(client_fixture: TestClient, db_fixture, item_fixture):
+    sell_out(db_fixture, item_fixture[0], days_ago=60)
+    archive_cruds.archive_sold_out(db_fixture, timedelta(days=30))
+
+    assert [item["name"] for item in client_fixture.get("/items").json()] == ["PC2"]
+    response = client_fixture.get("/items", params={"include_archived": True})
+    assert [item["name"] for item in response.json()] == ["PC1", "PC2"]
+
+    app.dependency_overrides[auth_cruds.get_current_user] = lambda: DecodedToken(username="testuser", user_id=1)
+    try:
+        # アーカイブされていない商品は復元できない
+        assert client_fixture.post("/items/2/restore").status_code == 404
+        response = client_fixture.post("/items/1/restore")
+    finally:
+        app.dependency_overrides.pop(auth_cruds.get_current_user)
+    assert response.status_code == 200
+    assert response.json()["id"] == 1
+    assert response.json()["status"] == "SOLD_OUT"
+    assert db_fixture.query(ArchivedItem).count() == 0
+    # 復元した商品は更新日時が新しくなるため、すぐには再びアーカイブされない
+    assert archive_cruds.archive_sold_out(db_fixture, timedelta(days=30)) == 0
+
+
+def test_アーカイブした商品のIDは使い回さない(client_fixture: TestClient, db_fixture, user_fixture, item_fixture):
+    sell_out(db_fixture, item_fixture[1], days_ago=60)
+    archive_cruds.archive_sold_out(db_fixture, timedelta(days=30))
+
+    # 最大のIDの商品をアーカイブした後でも、新しい商品には次のIDが割り当てられる
+    new_item = item_cruds.create(db_fixture, ItemCreate(name="PC3", price=30000), user_fixture.id)
+    assert new_item.id == 3
+    assert [item.id for item in item_cruds.find_all(db_fixture, include_archived=True)] == [1, 2, 3]
+
+    # 商品テーブルに同じIDの商品がある場合（IDを使い回していた既存のデータベースなど）は復元できない
+    db_fixture.add(Item(id=2, name="PC2", price=20000, user_id=user_fixture.id))
+    db_fixture.commit()
+    app.dependency_overrides[auth_cruds.get_current_user] = lambda: DecodedToken(username="testuser", user_id=1)
+    try:
+        response = client_fixture.post("/items/2/restore")
+    finally:
+        app.dependency_overrides.pop(auth_cruds.get_current_user)
+    assert response.status_code == 409
+    assert db_fixture.query(ArchivedItem).count() == 1
+
+
+def test_ユーザーの削除で両方のテーブルの商品が削除される(db_fixture, user_fixture, item_fixture):
+    other = auth_cruds.create_user(db_fixture, UserCreate(username="other", password="password"))
+    item_cruds.create(db_fixture, ItemCreate(name="PC3", price=30000), other.id)
+    sell_out(db_fixture, item_fixture[0], days_ago=60)
+    archive_cruds.archive_sold_out(db_fixture, timedelta(days=30))
+    stats_cruds.reconcile(db_fixture)
+
+    assert auth_cruds.delete_user(db_fixture, user_fixture.id) is not None
+    assert [item.name for item in db_fixture.query(Item)] == ["PC3"]
+    assert db_fixture.query(ArchivedItem).count() == 0
+    # 削除した商品の分も統計情報に反映されている
+    assert stats_cruds.reconcile(db_fixture) == 0
+    assert auth_cruds.delete_user(db_fixture, user_fixture.id) is None
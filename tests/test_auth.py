@@ -0,0 +1,58 @@
+# 認証関連のテストファイル
+# このファイルは、ログインとリフレッシュトークンによるトークン更新が正しく動作するかを確認します
+# - ログインでリフレッシュトークンが発行され、パスワードなしで新しいトークンに交換できること
+# - 使用済みのリフレッシュトークンが再利用されたら、同じファミリーのトークンが全て無効になること
+
+from datetime import timedelta  # 時間計算
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from cruds import auth as auth_cruds  # 認証関連のビジネスロジック
+
+
+def login(client: TestClient):
+    client.post("/auth/signup", json={"username": "user1", "password": "test1234"})
+    response = client.post("/auth/login", data={"username": "user1", "password": "test1234"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_login_リフレッシュトークン発行(client_fixture: TestClient):
+    token = login(client_fixture)
+    assert token["refresh_token"]
+    # 有効期限はジッターで最大10%短くなる
+    assert 18 * 60 - 1 <= token["expires_in"] <= 20 * 60
+
+
+def test_refresh_正常系(client_fixture: TestClient):
+    token = login(client_fixture)
+    response = client_fixture.post("/auth/refresh", json={"refresh_token": token["refresh_token"]})
+    assert response.status_code == 200
+    refreshed = response.json()
+    assert refreshed["access_token"]
+    assert refreshed["refresh_token"] != token["refresh_token"]
+    assert auth_cruds.get_current_user(refreshed["access_token"]).username == "user1"
+
+    # 新しいリフレッシュトークンで続けて更新できる
+    response = client_fixture.post("/auth/refresh", json={"refresh_token": refreshed["refresh_token"]})
+    assert response.status_code == 200
+
+
+def test_refresh_再利用検知(client_fixture: TestClient):
+    token = login(client_fixture)
+    refreshed = client_fixture.post("/auth/refresh", json={"refresh_token": token["refresh_token"]}).json()
+
+    # 使用済みのトークンを再利用すると失敗し、ファミリー全体が無効になる
+    response = client_fixture.post("/auth/refresh", json={"refresh_token": token["refresh_token"]})
+    assert response.status_code == 401
+    response = client_fixture.post("/auth/refresh", json={"refresh_token": refreshed["refresh_token"]})
+    assert response.status_code == 401
+
+
+def test_refresh_異常系(client_fixture: TestClient):
+    response = client_fixture.post("/auth/refresh", json={"refresh_token": "invalid"})
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Invalid refresh token"
+
+
+def test_access_token_expires():
+    for _ in range(100):
+        assert timedelta(minutes=18) <= auth_cruds.access_token_expires() <= timedelta(minutes=20)
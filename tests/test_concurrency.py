@@ -0,0 +1,178 @@
+# 同時実行数の制限関連のテストファイル
+# このファイルは、上限を超えたリクエストが優先度の順に処理され、満杯・期限切れの場合は捨てられるかを確認します
+
+import asyncio  # 非同期処理の実行
+import time  # 期限の計算
+import pytest
+from fastapi import FastAPI  # テスト用のアプリケーション
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from config import get_settings
+from concurrency import AIMDLimit, ConcurrencyLimiter, ConcurrencyLimitMiddleware, Shed, route_rule
+
+
+def make_limiter(limit=1, queue_size=2):
+    return ConcurrencyLimiter(AIMDLimit(limit, 1, 100, latency_target=60), queue_size)
+
+
+def later(seconds=10):
+    return time.monotonic() + seconds
+
+
+def test_ルートごとの優先度():
+    assert route_rule('POST', '/auth/login')[0] == 0
+    assert route_rule('GET', '/items/1')[0] == 1
+    assert route_rule('POST', '/items')[0] == 2
+    assert route_rule('GET', '/stats/summary')[0] == 3
+
+
+def test_優先度の高い順に処理を始める():
+    async def scenario():
+        limiter = make_limiter(queue_size=10)
+        await limiter.acquire(0, later())
+        order = []
+
+        async def request(priority):
+            await limiter.acquire(priority, later())
+            order.append(priority)
+            limiter.release(time.monotonic())
+
+        tasks = [asyncio.create_task(request(priority)) for priority in (3, 1, 2)]
+        await asyncio.sleep(0)
+        assert limiter.snapshot()['queued'] == 3
+        limiter.release(time.monotonic())
+        await asyncio.gather(*tasks)
+        return order, limiter.snapshot()
+
+    order, snapshot = asyncio.run(scenario())
+    assert order == [1, 2, 3]
+    assert snapshot['inflight'] == 0 and snapshot['queued'] == 0
+
+
+def test_キューが満杯の場合は優先度の低いリクエストを押し出す():
+    async def scenario():
+        limiter = make_limiter(queue_size=1)
+        await limiter.acquire(0, later())
+        low = asyncio.create_task(limiter.acquire(3, later()))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(limiter.acquire(1, later()))
+        await asyncio.sleep(0)
+        with pytest.raises(Shed, match='evicted'):
+            await low
+        # 同じ優先度のリクエストは押し出さず、到着したリクエストを捨てる
+        with pytest.raises(Shed, match='queue_full'):
+            await limiter.acquire(1, later())
+        limiter.release(time.monotonic())
+        await high
+        return limiter.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot['shed'] == {'queue_full': 1, 'evicted': 1, 'deadline': 0}
+    assert snapshot['inflight'] == 1 and snapshot['queued'] == 0
+
+
+def test_期限を過ぎたリクエストは処理を始めずに捨てる():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire(0, later())
+        with pytest.raises(Shed, match='deadline'):
+            await limiter.acquire(1, later(0.05))
+        return limiter.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot['shed']['deadline'] == 1
+    assert snapshot['inflight'] == 1 and snapshot['queued'] == 0
+
+
+def test_待機中にキャンセルされたリクエストは枠を使わない():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire(0, later())
+        task = asyncio.create_task(limiter.acquire(1, later()))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        limiter.release(time.monotonic())
+        return limiter.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot['inflight'] == 0 and snapshot['queued'] == 0
+
+
+def test_キューから抜けたリクエストは溜め続けない():
+    async def scenario():
+        limiter = make_limiter(queue_size=100)
+        await limiter.acquire(0, later())
+        waiting = asyncio.create_task(limiter.acquire(2, later()))
+        heap_sizes = []
+        for _ in range(50):
+            # 待機中にキャンセルされたリクエストと期限切れになったリクエスト
+            task = asyncio.create_task(limiter.acquire(3, later()))
+            await asyncio.sleep(0)
+            task.cancel()
+            expired = asyncio.create_task(limiter.acquire(3, later(0.001)))
+            await asyncio.sleep(0.002)
+            heap_sizes.append(len(limiter._heap))
+            await asyncio.gather(task, expired, return_exceptions=True)
+        limiter.release(time.monotonic())
+        await waiting
+        return heap_sizes, limiter.snapshot()
+
+    heap_sizes, snapshot = asyncio.run(scenario())
+    assert max(heap_sizes) <= 3
+    assert snapshot['inflight'] == 1 and snapshot['queued'] == 0
+    assert snapshot['shed']['deadline'] == 50
+
+
+def test_AIMDは遅い応答がまとめて返っても1回だけ下げる():
+    limit = AIMDLimit(10, 1, 100, latency_target=0.1)
+    started_at = time.monotonic()
+    for _ in range(5):
+        limit.on_sample(started_at, 1.0, inflight=10, failed=False)
+    assert limit.limit == pytest.approx(9)
+    # 上限を下げた後に受け付けたリクエストが遅ければ、再び下げる
+    limit.on_sample(time.monotonic(), 1.0, inflight=9, failed=False)
+    assert limit.limit == pytest.approx(8.1)
+
+
+def test_AIMDは速い応答が続くと上げる():
+    limit = AIMDLimit(10, 1, 100, latency_target=0.1)
+    for _ in range(11):
+        limit.on_sample(time.monotonic(), 0.01, inflight=10, failed=False)
+    assert limit.value == 11
+    # 上限の半分も使っていない場合は上げない
+    limit.on_sample(time.monotonic(), 0.01, inflight=1, failed=False)
+    assert limit.value == 11
+
+
+def test_捨てたリクエストには503とRetry_Afterを返す():
+    limiter = make_limiter(queue_size=0)
+    app = FastAPI()
+
+    @app.get('/items')
+    def items():
+        return []
+
+    @app.get('/metrics')
+    def metrics():
+        return {}
+
+    client = TestClient(ConcurrencyLimitMiddleware(app, limiter))
+    assert client.get('/items').status_code == 200
+
+    # 処理中のリクエストで上限が埋まっている状態
+    limiter.inflight = limiter.limit.value
+    response = client.get('/items')
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+    assert response.json() == {'detail': 'Server is overloaded'}
+    assert limiter.snapshot()['shed']['queue_full'] == 1
+    # 計測値は過負荷の状態でも取得できる
+    assert client.get('/metrics').status_code == 200
+
+
+def test_metrics_api(client_fixture: TestClient, monkeypatch):
+    monkeypatch.setattr(get_settings(), 'metrics_token', 'secret')
+    response = client_fixture.get("/metrics", headers={"X-Metrics-Token": "secret"})
+    assert response.status_code == 200
+    assert set(response.json()['concurrency']) == {'limit', 'inflight', 'queued', 'shed'}
@@ -0,0 +1,82 @@
+# バックグラウンドジョブ関連のテストファイル
+# このファイルは、ジョブキューとワーカーが正しく動作するかを確認します
+# - コミットしたジョブだけが実行されること（トランザクショナル・アウトボックス）
+# - 失敗したジョブがバックオフ後にリトライされること
+# - 処理中のジョブが可視性タイムアウトまで他のワーカーから見えないこと
+
+import asyncio  # 非同期処理の実行
+from datetime import datetime  # 日時
+from jobs import queue, handlers  # キュー操作とジョブハンドラー
+from jobs.worker import JobWorker  # ワーカー
+from models import Job  # ジョブモデル
+from schemas import JobStatus  # ジョブの状態
+from tests.conftest import TestingSessionLocal  # テスト用セッション
+
+
+# テスト用のハンドラー（呼び出された payload を記録し、fail=True なら例外を発生させる）
+calls = []
+
+
+@handlers.handler('test.record')
+def record(db, payload):
+    calls.append(payload)
+    if payload.get('fail'):
+        raise RuntimeError('boom')
+
+
+def make_worker():
+    return JobWorker(session_factory=TestingSessionLocal, concurrency=1, poll_interval=0.01, visibility_timeout=30)
+
+
+def test_コミットしたジョブだけが実行される(db_fixture):
+    calls.clear()
+    queue.enqueue(db_fixture, 'test.record', {'n': 1})
+    db_fixture.rollback()
+    queue.enqueue(db_fixture, 'test.record', {'n': 2})
+    db_fixture.commit()
+
+    worker = make_worker()
+    assert asyncio.run(worker.run_once()) is True
+    assert asyncio.run(worker.run_once()) is False
+    assert calls == [{'n': 2}]
+    # 成功したジョブはキューから削除される
+    assert db_fixture.query(Job).count() == 0
+
+
+def test_失敗したジョブはリトライされる(db_fixture):
+    calls.clear()
+    queue.enqueue(db_fixture, 'test.record', {'fail': True})
+    db_fixture.commit()
+
+    assert asyncio.run(make_worker().run_once()) is True
+    job = db_fixture.query(Job).one()
+    assert job.status == JobStatus.PENDING
+    assert job.attempts == 1
+    assert job.locked_until is None
+    assert job.run_at > datetime.now()
+    assert 'boom' in job.last_error
+
+
+def test_最大試行回数を超えるとFAILEDになる(db_fixture):
+    job = queue.enqueue(db_fixture, 'test.record', {'fail': True})
+    job.max_attempts = 1
+    db_fixture.commit()
+
+    asyncio.run(make_worker().run_once())
+    db_fixture.refresh(job)
+    assert job.status == JobStatus.FAILED
+
+
+def test_処理中のジョブは他のワーカーから見えない(db_fixture):
+    queue.enqueue(db_fixture, 'test.record', {})
+    db_fixture.commit()
+
+    assert queue.claim(db_fixture, visibility_timeout=30) is not None
+    assert queue.claim(db_fixture, visibility_timeout=30) is None
+
+    # 可視性タイムアウトが切れると再取得できる
+    db_fixture.query(Job).update({Job.locked_until: datetime(2000, 1, 1)})
+    db_fixture.commit()
+    job = queue.claim(db_fixture, visibility_timeout=30)
+    assert job is not None
+    assert job.attempts == 2
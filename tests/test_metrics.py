@@ -0,0 +1,31 @@
+# 内部状態の計測値関連のテストファイル
+# このファイルは、SQL文のキャッシュのヒット率が数えられ、GET /metrics で取得できるかを確認します
+# GET /metrics はトークンを付けた場合だけ取得できることも確認します
+
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from cruds import item as item_cruds  # ビジネスロジック
+from config import get_settings
+import statement_cache  # SQL文のキャッシュの利用状況
+
+
+def test_同じ検索はキャッシュを再利用する(db_fixture, item_fixture):
+    item_cruds.find_by_id(db_fixture, 1, 1)
+    statement_cache.reset()
+    for id in (1, 2, 3):
+        item_cruds.find_by_id(db_fixture, id, 1)
+    assert statement_cache.snapshot() == {'hit': 3, 'miss': 0, 'other': 0, 'hit_rate': 1.0}
+
+
+def test_metrics_api(client_fixture: TestClient, db_fixture, item_fixture, monkeypatch):
+    client_fixture.get("/items")
+    # トークンが設定されていない場合は取得できない
+    assert client_fixture.get("/metrics").status_code == 403
+
+    monkeypatch.setattr(get_settings(), 'metrics_token', 'secret')
+    assert client_fixture.get("/metrics").status_code == 403
+    assert client_fixture.get("/metrics", headers={"X-Metrics-Token": "wrong"}).status_code == 403
+    response = client_fixture.get("/metrics", headers={"X-Metrics-Token": "secret"})
+    assert response.status_code == 200
+    cache = response.json()['statement_cache']
+    assert cache['hit'] + cache['miss'] > 0
+    assert 0 <= cache['hit_rate'] <= 1
@@ -0,0 +1,130 @@
+# プロファイリング関連のテストファイル
+# このファイルは、リクエスト単位のプロファイリングが正しく動作するかを確認します
+# - トークン付きのリクエストだけが計測され、ルートのラベル付きでスタックが記録されること
+# - 計測結果を一覧・ダウンロードできること
+# - ファイルへの書き出しがイベントループを止めないこと
+# - 他のプロセスが書き出した計測結果もファイルから取得できること
+
+import threading  # 書き出したスレッドの確認
+import time  # 処理時間の再現
+from datetime import datetime  # 計測日時
+from fastapi import FastAPI  # 計測対象のアプリケーション
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from config import get_settings
+import profiling  # プロファイリング機能
+
+
+def busy_handler():
+    # サンプルが取れるように少しの間CPUを使う
+    end = time.perf_counter() + 0.05
+    while time.perf_counter() < end:
+        pass
+
+
+def make_client(store, **options):
+    app = FastAPI()
+
+    @app.get('/items/{id}')
+    async def find_by_id(id: int):
+        busy_handler()
+        return {'id': id}
+
+    app.add_middleware(profiling.ProfilingMiddleware, profile_store=store, interval=0.001, **options)
+    return TestClient(app)
+
+
+def test_トークン付きのリクエストだけ計測される():
+    store = profiling.ProfileStore(keep=10)
+    client = make_client(store, token='secret', sample_rate=0)
+
+    response = client.get('/items/1')
+    assert 'x-profile-id' not in response.headers
+    assert store.list() == []
+
+    response = client.get('/items/1', headers={'X-Profile': 'wrong'})
+    assert store.list() == []
+
+    response = client.get('/items/1', headers={'X-Profile': 'secret'})
+    profile = store.get(response.headers['x-profile-id'])
+    assert profile.route == 'GET /items/{id}'
+    assert profile.path == '/items/1'
+    assert profile.samples > 0
+    collapsed = profile.collapsed()
+    assert collapsed.startswith('GET_/items/{id};')
+    assert 'busy_handler' in collapsed
+
+
+def test_N件に1件を計測する():
+    store = profiling.ProfileStore(keep=10)
+    client = make_client(store, token='', sample_rate=3)
+    for _ in range(6):
+        client.get('/items/1')
+    assert len(store.list()) == 2
+
+
+def test_ファイルへの書き出しはイベントループの外で行う(tmp_path):
+    threads = []
+
+    class RecordingStore(profiling.ProfileStore):
+        def save(self, profile):
+            threads.append(threading.get_ident())
+            super().save(profile)
+
+    store = RecordingStore(keep=10, directory=str(tmp_path))
+    client = make_client(store, token='secret', sample_rate=0)
+
+    @client.app.get('/loop')
+    async def loop_thread():
+        return {'thread': threading.get_ident()}
+
+    response = client.get('/loop', headers={'X-Profile': 'secret'})
+    profile_id = response.headers['x-profile-id']
+    assert threads and threads[0] != response.json()['thread']
+    assert (tmp_path / f'{profile_id}.collapsed').read_text() == store.get(profile_id).collapsed()
+
+
+def test_計測結果の取得API(client_fixture: TestClient, monkeypatch):
+    monkeypatch.setattr(get_settings(), 'profiling_token', 'secret')
+    profile = profiling.Profile(id='abc', route='GET /items', path='/items', started_at=datetime.now())
+    profile.stacks['main.py:handler'] = 3
+    monkeypatch.setattr(profiling, 'store', profiling.ProfileStore(keep=10))
+    profiling.store.add(profile)
+
+    assert client_fixture.get('/profiles').status_code == 403
+
+    headers = {'X-Profile-Token': 'secret'}
+    response = client_fixture.get('/profiles', headers=headers)
+    assert response.status_code == 200
+    assert response.json()[0]['id'] == 'abc'
+
+    response = client_fixture.get('/profiles/abc', headers=headers)
+    assert response.status_code == 200
+    assert response.text == 'GET_/items;main.py:handler 3\n'
+    assert client_fixture.get('/profiles/none', headers=headers).status_code == 404
+
+
+def test_他のプロセスの計測結果をファイルから取得する(client_fixture: TestClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(get_settings(), 'profiling_token', 'secret')
+    # 計測したプロセスとAPIに応答するプロセスが別の場合（同じディレクトリを共有する）
+    profile = profiling.Profile(
+        id='0123abcd', route='GET /items/{id}', path='/items/1', started_at=datetime.now(), duration_ms=12.5, samples=4
+    )
+    profile.stacks['main.py:handler;item.py:find_by_id'] = 3
+    profile.stacks['main.py:handler'] = 1
+    profiling.ProfileStore(keep=10, directory=str(tmp_path)).save(profile)
+    monkeypatch.setattr(profiling, 'store', profiling.ProfileStore(keep=10, directory=str(tmp_path)))
+
+    headers = {'X-Profile-Token': 'secret'}
+    response = client_fixture.get('/profiles', headers=headers)
+    assert response.status_code == 200
+    assert [(p['id'], p['route'], p['path'], p['samples']) for p in response.json()] == [
+        ('0123abcd', 'GET /items/{id}', '/items/1', 4)
+    ]
+
+    response = client_fixture.get('/profiles/0123abcd', headers=headers)
+    assert response.status_code == 200
+    assert response.text == profile.collapsed()
+    # 16進数でないIDはファイルを探さない
+    (tmp_path / 'other.json').write_text('{}')
+    assert client_fixture.get('/profiles/other', headers=headers).status_code == 404
+    assert client_fixture.get('/profiles/..', headers=headers).status_code == 404
@@ -0,0 +1,128 @@
+# 商品購入関連のテストファイル
+# このファイルは、商品購入API（POST /items/{id}/purchase）が正しく動作するかを確認します
+# - 販売中の商品は購入でき、売り切れになること
+# - 同じ冪等キーで再送しても注文が1つだけになること
+# - 同時に購入しても成功するのは1人だけであること
+
+from concurrent.futures import ThreadPoolExecutor  # 同時購入の再現
+import threading  # 同時に開始するためのバリア
+import pytest  # テストフレームワーク
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from cruds import auth as auth_cruds, order as order_cruds  # ビジネスロジック
+from main import app  # FastAPIアプリケーション
+from models import User, Item, Order  # データベースモデル
+from schemas import DecodedToken, ItemStatus  # データスキーマ
+from tests.conftest import TestingSessionLocal  # テスト用セッション
+
+
+@pytest.fixture
+def buyer_fixture(db_fixture, item_fixture):
+    """
+    購入者としてログインした状態を作るフィクスチャ
+    """
+    buyer = User(username="buyer", password="hashed_password", salt="test_salt")
+    db_fixture.add(buyer)
+    db_fixture.commit()
+    app.dependency_overrides[auth_cruds.get_current_user] = lambda: DecodedToken(username="buyer", user_id=buyer.id)
+    yield buyer
+    app.dependency_overrides.pop(auth_cruds.get_current_user)
+
+
+def test_purchase_正常系(client_fixture: TestClient, db_fixture, buyer_fixture):
+    response = client_fixture.post("/items/1/purchase")
+    assert response.status_code == 201
+    order = response.json()
+    assert order["item_id"] == 1
+    assert order["buyer_id"] == buyer_fixture.id
+    assert order["price"] == 10000
+    assert db_fixture.get(Item, 1).status == ItemStatus.SOLD_OUT
+
+    # 売り切れの商品は購入できない
+    response = client_fixture.post("/items/1/purchase")
+    assert response.status_code == 409
+
+
+def test_purchase_異常系(client_fixture: TestClient, buyer_fixture):
+    response = client_fixture.post("/items/10/purchase")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Item not found"
+
+
+def test_purchase_冪等キー(client_fixture: TestClient, db_fixture, buyer_fixture):
+    headers = {"Idempotency-Key": "abc"}
+    first = client_fixture.post("/items/1/purchase", headers=headers)
+    second = client_fixture.post("/items/1/purchase", headers=headers)
+    assert first.status_code == second.status_code == 201
+    assert first.json()["id"] == second.json()["id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert db_fixture.query(Order).count() == 1
+
+    # 同じキーを別の商品に使うとエラー
+    response = client_fixture.post("/items/2/purchase", headers=headers)
+    assert response.status_code == 422
+
+
+@pytest.fixture
+def hide_first_lookup_fixture(monkeypatch):
+    """
+    最初の冪等キーの検索だけ注文が見つからないようにするフィクスチャ
+    同じキーの再送が同時に届き、もう一方の注文がまだコミットされていない状況を再現します
+    """
+    find_by_idempotency_key = order_cruds.find_by_idempotency_key
+    calls = []
+
+    def find_after_first(db, buyer_id, idempotency_key):
+        calls.append(idempotency_key)
+        if len(calls) == 1:
+            return None
+        return find_by_idempotency_key(db, buyer_id, idempotency_key)
+
+    monkeypatch.setattr(order_cruds, "find_by_idempotency_key", find_after_first)
+    return calls
+
+
+def test_purchase_冪等キーの同時再送(client_fixture: TestClient, db_fixture, buyer_fixture, hide_first_lookup_fixture):
+    headers = {"Idempotency-Key": "abc"}
+    first = order_cruds.purchase(db_fixture, 1, buyer_fixture.id, "abc")
+
+    # 先に購入された後の再送は、売り切れの409ではなく同じ注文を返す
+    second = client_fixture.post("/items/1/purchase", headers=headers)
+    assert second.status_code == 201
+    assert second.json()["id"] == first.id
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert db_fixture.query(Order).count() == 1
+
+
+def test_purchase_冪等キーの同時再送_別の商品(client_fixture: TestClient, db_fixture, buyer_fixture, hide_first_lookup_fixture):
+    headers = {"Idempotency-Key": "abc"}
+    order_cruds.purchase(db_fixture, 1, buyer_fixture.id, "abc")
+
+    # 同じキーで別の商品を購入しようとすると、一意制約違反の後に検索し直して422エラーになる
+    response = client_fixture.post("/items/2/purchase", headers=headers)
+    assert response.status_code == 422
+    # 確保した商品は取り消されて販売中のまま
+    db_fixture.expire_all()
+    assert db_fixture.get(Item, 2).status == ItemStatus.ON_SALE
+    assert db_fixture.query(Order).count() == 1
+
+
+def test_purchase_同時購入(db_fixture, item_fixture):
+    buyers = [User(username=f"buyer{i}", password="hashed_password", salt="test_salt") for i in range(20)]
+    db_fixture.add_all(buyers)
+    db_fixture.commit()
+    buyer_ids = [buyer.id for buyer in buyers]
+    barrier = threading.Barrier(len(buyer_ids))
+
+    def buy(buyer_id):
+        db = TestingSessionLocal()
+        try:
+            barrier.wait()
+            return order_cruds.purchase(db, item_fixture[0].id, buyer_id) is not None
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(len(buyer_ids)) as executor:
+        results = list(executor.map(buy, buyer_ids))
+
+    assert results.count(True) == 1
+    assert db_fixture.query(Order).count() == 1
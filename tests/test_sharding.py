@@ -0,0 +1,227 @@
+# シャーディング関連のテストファイル
+# このファイルは、複数のSQLiteファイルをシャードとして、商品が出品者ごとに振り分けられるかを確認します
+# - 商品が出品者のシャードに保存され、IDが全シャードで重複しないこと
+# - 全件取得・検索が全シャードの結果をID順に結合して返すこと
+# - シャード追加後の再配置で、商品が担当のシャードに移動すること（移動中に移動元へ書き込まれた商品も失わないこと）
+# - シャーディングを有効にする前にメインのデータベースにあった商品も移動し、そのIDを使い回さないこと
+# - 全シャードへの並列問い合わせの時間が、シャードごとの時間の合計ではなく待った時間で記録されること
+
+from datetime import datetime, timedelta  # 日時計算
+import time  # 遅いクエリの再現
+import pytest  # テストフレームワーク
+from sqlalchemy import create_engine, select, insert, update, event  # データベースエンジン作成
+import sharding  # シャーディング機能
+import timing  # 処理時間の計測
+from cruds import item as item_cruds, order as order_cruds, archive as archive_cruds  # ビジネスロジック
+from database import Base  # データベースのベースクラス
+from models import User, Item, ArchivedItem  # データベースモデル
+from schemas import ItemCreate, ItemUpdate, ItemStatus  # データスキーマ
+
+
+@pytest.fixture
+def shard_urls(tmp_path):
+    """
+    テスト用のシャード（SQLiteファイル3つ）のURLを作成するフィクスチャ
+    """
+    return [f"sqlite:///{tmp_path / f'shard{i}.db'}" for i in range(3)]
+
+
+@pytest.fixture
+def primary_engine(tmp_path):
+    """
+    テスト用のメインのデータベースを作成するフィクスチャ
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def make_factory(primary_engine, urls):
+    factory = sharding.make_sessionmaker(primary_engine, urls, id_block_size=3)
+    for shard_factory in factory.class_.shard_factories.values():
+        sharding.create_shard_schema(shard_factory.kw['bind'])
+    return factory
+
+
+def items_by_shard(factory):
+    # シャードごとに保存されている商品の (ID, 出品者ID) を取得
+    result = {}
+    for shard_id, shard_factory in factory.class_.shard_factories.items():
+        with shard_factory() as session:
+            result[shard_id] = session.execute(select(Item.id, Item.user_id)).all()
+    return result
+
+
+def create_users_and_items(factory):
+    db = factory()
+    users = [User(username=f"user{i}", password="x", salt="x") for i in range(8)]
+    db.add_all(users)
+    db.commit()
+    for user in users:
+        item_cruds.create(db, ItemCreate(name=f"PC{user.id}", price=1000 * user.id), user.id)
+    return db, users
+
+
+def test_出品者のシャードに保存される(primary_engine, shard_urls):
+    factory = make_factory(primary_engine, shard_urls[:2])
+    db, users = create_users_and_items(factory)
+    shard_map = factory.class_.shard_map
+
+    stored = items_by_shard(factory)
+    # 商品が担当のシャードだけに保存されている
+    for shard_id, rows in stored.items():
+        assert all(shard_map.shard_for(user_id) == shard_id for _, user_id in rows)
+    # 両方のシャードが使われ、IDは重複しない
+    assert all(stored.values())
+    ids = [item_id for rows in stored.values() for item_id, _ in rows]
+    assert len(ids) == len(set(ids)) == len(users)
+
+    # 全件取得・検索はID順に結合される
+    assert [item.id for item in item_cruds.find_all(db)] == sorted(ids)
+    assert len(item_cruds.find_by_name(db, "PC")) == len(users)
+
+    # 出品者が決まる操作は担当のシャードに振り分けられる
+    user = users[3]
+    item = item_cruds.find_all(db)[3]
+    assert item_cruds.find_by_id(db, item.id, item.user_id).name == item.name
+    assert item_cruds.find_by_id(db, item.id, item.user_id + 1) is None
+    assert item_cruds.update(db, item.id, ItemUpdate(price=1), item.user_id).price == 1
+    assert item_cruds.delete(db, item.id, item.user_id) is not None
+    assert len(item_cruds.find_all(db)) == len(users) - 1
+
+    # 購入も商品のあるシャードで行われる
+    other = item_cruds.find_all(db)[0]
+    assert order_cruds.purchase(db, other.id, user.id if other.user_id != user.id else users[0].id) is not None
+    assert item_cruds.find_by_id(db, other.id, other.user_id).status == ItemStatus.SOLD_OUT
+    db.close()
+
+
+def test_シャード追加後の再配置(primary_engine, shard_urls):
+    db, users = create_users_and_items(make_factory(primary_engine, shard_urls[:2]))
+    db.close()
+
+    # シャードを追加すると、一部の出品者の担当シャードが変わる
+    factory = make_factory(primary_engine, shard_urls)
+    shard_map = factory.class_.shard_map
+    misplaced = sum(
+        1 for shard_id, rows in items_by_shard(factory).items()
+        for _, user_id in rows if shard_map.shard_for(user_id) != shard_id
+    )
+    assert misplaced > 0
+    assert sharding.rebalance(factory, batch_size=2, dry_run=True) == misplaced
+
+    assert sharding.rebalance(factory, batch_size=2) == misplaced
+    stored = items_by_shard(factory)
+    for shard_id, rows in stored.items():
+        assert all(shard_map.shard_for(user_id) == shard_id for _, user_id in rows)
+    assert sum(len(rows) for rows in stored.values()) == len(users)
+    # 再実行しても移動するものはない
+    assert sharding.rebalance(factory) == 0
+
+
+def test_再配置中に移動元へ書き込まれた商品を失わない(primary_engine, shard_urls):
+    factory = make_factory(primary_engine, shard_urls[:2])
+    source_factory, target_factory = factory.class_.shard_factories.values()
+    table = Item.__table__
+    now = datetime.now()
+    with source_factory() as source:
+        source.execute(insert(table), [
+            {'id': 1, 'name': 'PC1', 'price': 1000, 'status': ItemStatus.ON_SALE, 'user_id': 1, 'updated_at': now},
+            {'id': 2, 'name': 'PC2', 'price': 2000, 'status': ItemStatus.ON_SALE, 'user_id': 1, 'updated_at': now},
+        ])
+        source.commit()
+
+        def copy_while_writing():
+            # コピー中に、古いリングを使うプロセスが移動元へ商品を追加・更新する
+            with source_factory() as writer:
+                writer.execute(insert(table).values(
+                    id=3, name='PC3', price=3000, status=ItemStatus.ON_SALE, user_id=1, updated_at=now
+                ))
+                writer.execute(update(table).where(table.c.id == 2).values(price=1, updated_at=now + timedelta(seconds=1)))
+                writer.commit()
+            return target_factory()
+
+        writes = iter([copy_while_writing])
+        assert sharding._move(table, 1, source, lambda: next(writes, target_factory)(), dry_run=False) == 3
+        assert source.execute(select(table.c.id)).all() == []
+    with target_factory() as target:
+        assert target.execute(select(table.c.id, table.c.price).order_by(table.c.id)).all() == [(1, 1000), (2, 1), (3, 3000)]
+
+
+def test_shard_map():
+    before = sharding.ShardMap(["shard0", "shard1"])
+    after = sharding.ShardMap(["shard0", "shard1", "shard2"])
+    moved = sum(1 for user_id in range(3000) if before.shard_for(user_id) != after.shard_for(user_id))
+    # 移動するのはおおよそ3分の1だけ
+    assert 700 < moved < 1300
+    # 移動先は追加したシャードだけ
+    assert all(
+        after.shard_for(user_id) == "shard2"
+        for user_id in range(3000) if before.shard_for(user_id) != after.shard_for(user_id)
+    )
+
+
+def test_アーカイブ済みの商品も出品者のシャードに保存される(primary_engine, shard_urls):
+    factory = make_factory(primary_engine, shard_urls[:2])
+    db, users = create_users_and_items(factory)
+    for item in item_cruds.find_all(db):
+        item_cruds.update(db, item.id, ItemUpdate(status=ItemStatus.SOLD_OUT), item.user_id)
+
+    assert archive_cruds.archive_sold_out(db, timedelta(0)) == len(users)
+    assert item_cruds.find_all(db) == []
+    assert len(item_cruds.find_all(db, include_archived=True)) == len(users)
+    shard_map = factory.class_.shard_map
+    for shard_id, shard_factory in factory.class_.shard_factories.items():
+        with shard_factory() as session:
+            rows = session.execute(select(ArchivedItem.user_id)).all()
+        assert all(shard_map.shard_for(user_id) == shard_id for user_id, in rows)
+
+
+def test_メインのデータベースにあった商品を再配置で移動する(primary_engine, shard_urls):
+    # シャーディングを有効にする前の商品とアーカイブ済みの商品
+    with primary_engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {'id': i, 'username': f'user{i}', 'password': 'x', 'salt': 'x'} for i in range(1, 5)
+        ])
+        conn.execute(insert(Item.__table__), [
+            {'id': i, 'name': f'PC{i}', 'price': 1000 * i, 'status': ItemStatus.ON_SALE, 'user_id': i} for i in range(1, 5)
+        ])
+        conn.execute(insert(ArchivedItem.__table__).values(
+            id=50, name='OLD', price=1, status=ItemStatus.SOLD_OUT, user_id=1
+        ))
+
+    factory = make_factory(primary_engine, shard_urls[:2])
+    db = factory()
+    # 移動するまではシャードにないため見えない
+    assert item_cruds.find_all(db) == []
+    assert sharding.rebalance(factory, dry_run=True) == 5
+    assert sharding.rebalance(factory) == 5
+    assert [item.id for item in item_cruds.find_all(db)] == [1, 2, 3, 4]
+    assert [item.id for item in item_cruds.find_all(db, include_archived=True)] == [1, 2, 3, 4, 50]
+    with primary_engine.connect() as conn:
+        assert conn.execute(select(Item.id)).all() == []
+    # 新しい商品はアーカイブ済みの商品のIDも使い回さない
+    assert item_cruds.create(db, ItemCreate(name="NEW", price=100), 1).id > 50
+    assert sharding.rebalance(factory) == 0
+    db.close()
+
+
+def test_並列問い合わせの時間は待った時間で記録する(primary_engine, shard_urls):
+    factory = make_factory(primary_engine, shard_urls)
+
+    def slow_query(*args):
+        time.sleep(0.05)
+
+    for shard_factory in factory.class_.shard_factories.values():
+        event.listen(shard_factory.kw['bind'], 'before_cursor_execute', slow_query)
+    timings = {}
+    token = timing._timings.set(timings)
+    try:
+        with factory() as db:
+            start = time.perf_counter()
+            item_cruds.find_all(db)
+            elapsed = time.perf_counter() - start
+    finally:
+        timing._timings.reset(token)
+    # 3つのシャードに並列で問い合わせるため、合計（0.15秒）ではなく待った時間になる
+    assert 0.05 <= timings['db'] <= elapsed
@@ -0,0 +1,179 @@
+# 類似商品関連のテストファイル
+# このファイルは、商品名と説明のTF-IDFベクトルで似ている商品が見つかるかを確認します
+# - 似ている商品が類似度の高い順に返り、自分自身は含まれないこと
+# - 商品の変更が変更履歴から索引に差分として反映されること
+# - 保存した索引をメモリマップで読み込めること
+
+import numpy as np  # 配列
+import pytest  # テストフレームワーク
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from config import get_settings
+from cruds import item as item_cruds, order as order_cruds  # ビジネスロジック
+from jobs.handlers import get_handler  # ジョブハンドラー
+from models import User, Job, ItemChange  # データベースモデル
+from schemas import ItemCreate, ItemUpdate, ItemStatus  # データスキーマ
+import similarity  # 類似商品の索引
+from tests.conftest import TestingSessionLocal  # テスト用セッション
+
+
+ROWS = [
+    (1, "ソニー ヘッドホン", "ノイズキャンセリング 美品"),
+    (2, "ソニー ヘッドホン WH", "ノイズキャンセリング 箱付き"),
+    (3, "任天堂 ゲーム機", "コントローラー付き"),
+    (4, "ナイキ スニーカー", "27cm 未使用"),
+    (5, "ゲーム機 本体", "任天堂 ジャンク"),
+]
+
+
+@pytest.fixture(autouse=True)
+def reset_index(monkeypatch):
+    # テストごとにプロセス内の索引を作り直す（バックグラウンドの読み込みもテスト用のデータベースを使う）
+    reset_process(monkeypatch)
+    monkeypatch.setattr(similarity, 'session_factory', TestingSessionLocal)
+
+
+def reset_process(monkeypatch):
+    # 索引を持っていない別のプロセスの状態にする
+    monkeypatch.setattr(similarity, '_index', None)
+    monkeypatch.setattr(similarity, '_loaded_name', None)
+    monkeypatch.setattr(similarity, '_checked_at', 0.0)
+    monkeypatch.setattr(similarity, '_refresher', None)
+
+
+def item_changed(db, item_id, user_id, action='updated'):
+    # item.changed ジョブを実行してコミットする（ワーカーと同じ）
+    get_handler('item.changed')(db, {'item_id': item_id, 'user_id': user_id, 'action': action})
+    db.commit()
+
+
+def test_似ている商品が類似度の高い順に返る():
+    index = similarity.SimilarIndex.build(ROWS)
+    [headphones, game] = index.similar([ROWS[0], ROWS[2]], k=2)
+    assert headphones[0][0] == 2
+    assert game[0][0] == 5
+    assert all(item_id not in (1, 3) for item_id, _ in headphones + game)
+    assert headphones[0][1] >= headphones[1][1] > 0
+
+
+def test_変更が差分として反映される():
+    index = similarity.SimilarIndex.build(ROWS)
+    index.upsert(6, "ソニー ヘッドホン 1000X", "ノイズキャンセリング 美品")
+    index.remove(2)
+    [headphones] = index.similar([ROWS[0]], k=3)
+    assert headphones[0][0] == 6
+    assert 2 not in [item_id for item_id, _ in headphones]
+    assert len(index) == len(ROWS)
+
+
+def test_保存した索引をメモリマップで読み込める(tmp_path):
+    index = similarity.SimilarIndex.build(ROWS)
+    name = index.save(str(tmp_path))
+    loaded = similarity.SimilarIndex.load(str(tmp_path), name)
+    assert (tmp_path / 'CURRENT').read_text() == name
+    assert loaded.similar([ROWS[0]], k=2) == index.similar([ROWS[0]], k=2)
+
+
+def test_similar_api(client_fixture: TestClient, db_fixture, user_fixture):
+    for _, name, description in ROWS:
+        item_cruds.create(db_fixture, ItemCreate(name=name, description=description, price=1000), user_fixture.id)
+
+    # 索引はバックグラウンドで作成し、準備ができるまでは503を返す
+    response = client_fixture.get("/items/1/similar", params={"k": 2})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    similarity._refresher.join()
+
+    response = client_fixture.get("/items/1/similar", params={"k": 2})
+    assert response.status_code == 200
+    assert [result["item"]["id"] for result in response.json()][0] == 2
+    assert client_fixture.get("/items/99/similar").status_code == 404
+
+    # 売り切れになった商品は、item.changed ジョブが記録した変更履歴から索引に反映される
+    item_cruds.update(db_fixture, 2, ItemUpdate(status=ItemStatus.SOLD_OUT), user_fixture.id)
+    item_changed(db_fixture, 2, user_fixture.id)
+    similarity.refresh(db_fixture)
+    assert 2 not in [item_id for item_id, _ in similarity.get_index().similar([ROWS[0]])[0]]
+    assert 2 not in [result["item"]["id"] for result in client_fixture.get("/items/1/similar").json()]
+
+
+def test_購入された商品は索引から外れ_k件の販売中の商品を返す(db_fixture, user_fixture):
+    for _, name, description in ROWS + [(6, "ソニー ヘッドホン 1000X", "ノイズキャンセリング")]:
+        item_cruds.create(db_fixture, ItemCreate(name=name, description=description, price=1000), user_fixture.id)
+    similarity.refresh(db_fixture)
+    buyer = User(username="buyer", password="hashed_password", salt="test_salt")
+    db_fixture.add(buyer)
+    db_fixture.commit()
+
+    # 索引に反映される前でも、購入された商品を除いて k 件返す
+    order_cruds.purchase(db_fixture, 2, buyer.id)
+    order_cruds.purchase(db_fixture, 6, buyer.id)
+    results = item_cruds.find_similar(db_fixture, 1, k=2)
+    assert len(results) == 2
+    assert {result['item'].id for result in results}.isdisjoint({2, 6})
+
+    # 購入は item.changed ジョブを登録し、変更履歴から索引に反映される
+    for job in db_fixture.query(Job).filter(Job.name == 'item.changed', Job.payload['action'].as_string() == 'purchased'):
+        item_changed(db_fixture, job.payload['item_id'], job.payload['user_id'], 'purchased')
+    similarity.refresh(db_fixture)
+    assert {item_id for item_id, _ in similarity.get_index().similar([ROWS[0]])[0]}.isdisjoint({2, 6})
+
+
+def test_変更履歴から他のプロセスの索引に反映される(db_fixture, user_fixture):
+    for _, name, description in ROWS:
+        item_cruds.create(db_fixture, ItemCreate(name=name, description=description, price=1000), user_fixture.id)
+    similarity.refresh(db_fixture)
+    index = similarity.get_index()
+
+    # 別のプロセスのワーカーが item.changed ジョブを実行した
+    new_item = item_cruds.create(
+        db_fixture, ItemCreate(name="ソニー ヘッドホン 1000X", description="ノイズキャンセリング 美品", price=1000), user_fixture.id
+    )
+    item_cruds.delete(db_fixture, 2, user_fixture.id)
+    item_changed(db_fixture, new_item.id, user_fixture.id, 'created')
+    item_changed(db_fixture, 2, user_fixture.id, 'deleted')
+
+    similarity.refresh(db_fixture)
+    assert similarity.get_index() is index
+    assert index.watermark == 2
+    [headphones] = index.similar([ROWS[0]], k=3)
+    assert headphones[0][0] == new_item.id
+    assert 2 not in [item_id for item_id, _ in headphones]
+
+
+def test_変更履歴のIDの抜けは後から読み直す(db_fixture, user_fixture):
+    for _, name, description in ROWS:
+        item_cruds.create(db_fixture, ItemCreate(name=name, description=description, price=1000), user_fixture.id)
+    index = similarity.build_from_db(db_fixture)
+    # ID 2 の変更はまだコミットされていない（後からコミットされる）
+    db_fixture.add_all([ItemChange(id=1, item_id=1), ItemChange(id=3, item_id=3)])
+    db_fixture.commit()
+    assert similarity.apply_changes(db_fixture, index) == 2
+    assert index.watermark == 3 and set(index.gaps) == {2}
+
+    item_cruds.update(db_fixture, 2, ItemUpdate(status=ItemStatus.SOLD_OUT), user_fixture.id)
+    db_fixture.add(ItemChange(id=2, item_id=2))
+    db_fixture.commit()
+    assert similarity.apply_changes(db_fixture, index) == 1
+    assert index.gaps == {}
+    assert 2 not in [item_id for item_id, _ in index.similar([ROWS[0]])[0]]
+
+
+def test_作り直した索引を保存して読み込む(tmp_path, monkeypatch, db_fixture, user_fixture):
+    monkeypatch.setattr(get_settings(), 'similar_index_dir', str(tmp_path))
+    for _, name, description in ROWS:
+        item_cruds.create(db_fixture, ItemCreate(name=name, description=description, price=1000), user_fixture.id)
+
+    assert similarity.rebuild(db_fixture) == len(ROWS)
+    name = (tmp_path / 'CURRENT').read_text()
+    # 保存後の変更は、読み込んだプロセスが変更履歴から反映する
+    item_cruds.update(db_fixture, 2, ItemUpdate(status=ItemStatus.SOLD_OUT), user_fixture.id)
+    item_changed(db_fixture, 2, user_fixture.id)
+
+    # 別のプロセスは保存された索引をメモリマップで読み込む
+    reset_process(monkeypatch)
+    similarity.refresh(db_fixture)
+    index = similarity.get_index()
+    assert similarity._loaded_name == name
+    assert isinstance(index.ids, np.memmap)
+    assert index.watermark == 1
+    assert 2 not in [item_id for item_id, _ in index.similar([ROWS[0]])[0]]
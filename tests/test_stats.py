@@ -0,0 +1,59 @@
+# 統計情報関連のテストファイル
+# このファイルは、集計テーブルが商品の作成・更新・削除に合わせて差分更新されるかを確認します
+# - 状態ごとの件数・合計・パーセンタイルが正しいこと
+# - 定期ジョブの照合で集計のずれが補正されること
+
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from cruds import item as item_cruds, stats as stats_cruds  # ビジネスロジック
+from models import SellerStats  # データベースモデル
+from schemas import ItemCreate, ItemUpdate, ItemStatus  # データスキーマ
+
+
+def summary_by_status(db):
+    return {row['status']: row for row in stats_cruds.summary(db)}
+
+
+def test_作成更新削除で集計が更新される(db_fixture, user_fixture):
+    for price in range(100, 1100, 100):
+        item_cruds.create(db_fixture, ItemCreate(name="PC", price=price), user_fixture.id)
+
+    on_sale = summary_by_status(db_fixture)[ItemStatus.ON_SALE]
+    assert on_sale['count'] == 10
+    assert on_sale['total_price'] == 5500
+    # パーセンタイルは相対誤差1%以内
+    assert abs(on_sale['percentiles']['p50'] - 500) <= 5
+    assert abs(on_sale['percentiles']['p90'] - 900) <= 9
+
+    item_cruds.update(db_fixture, 1, ItemUpdate(status=ItemStatus.SOLD_OUT), user_fixture.id)
+    item_cruds.delete(db_fixture, 2, user_fixture.id)
+
+    summary = summary_by_status(db_fixture)
+    assert summary[ItemStatus.ON_SALE]['count'] == 8
+    assert summary[ItemStatus.SOLD_OUT]['count'] == 1
+    assert summary[ItemStatus.SOLD_OUT]['total_price'] == 100
+
+    seller = {row['status']: row for row in stats_cruds.find_by_seller(db_fixture, user_fixture.id)['statuses']}
+    assert seller[ItemStatus.ON_SALE]['count'] == 8
+    assert seller[ItemStatus.ON_SALE]['total_price'] == 5200
+
+
+def test_照合でずれが補正される(db_fixture, item_fixture):
+    # item_fixture は集計を通さずに作成しているため、集計とずれている
+    assert stats_cruds.reconcile(db_fixture) > 0
+    assert summary_by_status(db_fixture)[ItemStatus.ON_SALE]['count'] == 2
+    assert db_fixture.query(SellerStats).one().total_price == 30000
+    # 補正後はずれがない
+    assert stats_cruds.reconcile(db_fixture) == 0
+
+
+def test_stats_api(client_fixture: TestClient, db_fixture, user_fixture):
+    item_cruds.create(db_fixture, ItemCreate(name="PC", price=1000), user_fixture.id)
+    response = client_fixture.get("/stats")
+    assert response.status_code == 200
+    on_sale = response.json()[0]
+    assert on_sale['status'] == 'ON_SALE'
+    assert on_sale['count'] == 1
+
+    response = client_fixture.get(f"/stats/sellers/{user_fixture.id}")
+    assert response.status_code == 200
+    assert response.json()['statuses'][0]['total_price'] == 1000
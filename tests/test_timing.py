@@ -0,0 +1,74 @@
+# 処理時間計測関連のテストファイル
+# このファイルは、Server-Timing ヘッダーにフェーズごとの処理時間が出力されるかを確認します
+# - キューでの待ち時間・認証・DB・処理・検証/シリアライズ・合計の内訳が出力されること
+# - キューで待った時間が検証/シリアライズの時間に含まれないこと
+# - ストリーミングレスポンスがそのまま流れること
+
+import asyncio  # 同時リクエストの再現
+import httpx  # 非同期のテストクライアント
+from fastapi import APIRouter, FastAPI  # 計測対象のアプリケーション
+from fastapi.responses import StreamingResponse  # ストリーミングレスポンス
+from fastapi.testclient import TestClient  # FastAPIのテストクライアント
+from concurrency import AIMDLimit, ConcurrencyLimiter, ConcurrencyLimitMiddleware  # 同時実行数の制限
+from timing import TimedRoute, TimingMiddleware  # 処理時間の計測
+
+
+def parse_server_timing(header: str):
+    # "auth;dur=0.1, db;dur=0.2" を {"auth": 0.1, "db": 0.2} に変換
+    return {name: float(dur.split('=')[1]) for name, dur in (part.strip().split(';') for part in header.split(','))}
+
+
+def test_server_timing(client_fixture: TestClient, item_fixture):
+    client_fixture.post("/auth/signup", json={"username": "user1", "password": "test1234"})
+    token = client_fixture.post("/auth/login", data={"username": "user1", "password": "test1234"}).json()
+    response = client_fixture.get("/items/1", headers={"Authorization": f"Bearer {token['access_token']}"})
+
+    timings = parse_server_timing(response.headers["server-timing"])
+    assert set(timings) == {"queue", "auth", "db", "app", "serde", "total"}
+    assert timings["auth"] > 0
+    assert timings["db"] > 0
+    assert timings["serde"] > 0
+    assert timings["auth"] + timings["db"] + timings["app"] + timings["serde"] <= timings["total"] + 0.01
+    assert float(response.headers["x-process-time"]) > 0
+
+
+def test_キューで待った時間はqueueに記録する():
+    router = APIRouter(route_class=TimedRoute)
+
+    @router.get('/slow')
+    async def slow():
+        await asyncio.sleep(0.1)
+        return {'ok': True}
+
+    app = FastAPI()
+    app.include_router(router)
+    limiter = ConcurrencyLimiter(AIMDLimit(1, 1, 1, latency_target=60), queue_size=10)
+    app.add_middleware(ConcurrencyLimitMiddleware, concurrency_limiter=limiter)
+    app.add_middleware(TimingMiddleware)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+            return await asyncio.gather(*(client.get('/slow') for _ in range(3)))
+
+    timings = [parse_server_timing(response.headers['server-timing']) for response in asyncio.run(scenario())]
+    # 2件目・3件目は前のリクエストを待つが、その時間は serde ではなく queue に入る
+    assert sorted(t['queue'] for t in timings)[-1] >= 150
+    assert all(t['serde'] < 50 for t in timings)
+    assert all(t['app'] >= 100 for t in timings)
+
+
+def test_streaming_response():
+    app = FastAPI()
+
+    @app.get('/stream')
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f'{i}\n'
+        return StreamingResponse(chunks(), media_type='text/plain')
+
+    app.add_middleware(TimingMiddleware)
+    response = TestClient(app).get('/stream')
+    assert response.status_code == 200
+    assert response.text == '0\n1\n2\n'
+    assert 'total;dur=' in response.headers['server-timing']
@@ -0,0 +1,74 @@
+# 書き込みのグループコミット関連のテストファイル
+# このファイルは、同時に届いた書き込みが1つのトランザクションにまとめてコミットされるかを確認します
+# - まとめた書き込みがそれぞれ自分の結果を受け取ること
+# - 1つの書き込みが失敗しても他の書き込みはコミットされること
+# - 同じ商品への後の書き込みが失敗しても、先の書き込みの結果からレスポンスを作れること
+
+import pytest  # テストフレームワーク
+from sqlalchemy import event  # コミット回数の計測
+from cruds import item as item_cruds  # ビジネスロジック
+from models import Item  # データベースモデル
+from schemas import ItemCreate, ItemUpdate, ItemResponse, ItemStatus  # データスキーマ
+from write_batch import WriteBatcher  # グループコミット
+from tests.conftest import TestingSessionLocal, engine  # テスト用データベース
+
+
+@pytest.fixture
+def commit_counter():
+    # データベースへの実際のコミット回数を数える
+    commits = []
+    listener = lambda connection: commits.append(connection)
+    event.listen(engine, 'commit', listener)
+    yield commits
+    event.remove(engine, 'commit', listener)
+
+
+def test_同時の書き込みがまとめてコミットされる(db_fixture, user_fixture, commit_counter):
+    batcher = WriteBatcher(TestingSessionLocal, window=0.2, max_size=10)
+    futures = [
+        batcher.submit(lambda db, i=i: item_cruds.create(db, ItemCreate(name=f"PC{i}", price=1000 + i), user_fixture.id))
+        for i in range(10)
+    ]
+    items = [future.result(timeout=5) for future in futures]
+
+    assert [item.price for item in items] == [1000 + i for i in range(10)]
+    # コミット後も結果の属性を読める
+    assert all(item.id is not None and item.status == ItemStatus.ON_SALE for item in items)
+    assert len(commit_counter) == 1
+    assert db_fixture.query(Item).count() == 10
+
+
+def test_失敗した書き込みだけがロールバックされる(db_fixture, user_fixture):
+    batcher = WriteBatcher(TestingSessionLocal, window=0.2, max_size=3)
+
+    def failing(db):
+        item_cruds.create(db, ItemCreate(name="NG", price=1), user_fixture.id)
+        raise ValueError('failed')
+
+    created = batcher.submit(lambda db: item_cruds.create(db, ItemCreate(name="PC1", price=1000), user_fixture.id))
+    failed = batcher.submit(failing)
+    missing = batcher.submit(lambda db: item_cruds.update(db, 999, ItemUpdate(status=ItemStatus.SOLD_OUT), user_fixture.id))
+
+    assert created.result(timeout=5).name == "PC1"
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    assert missing.result(timeout=5) is None
+    assert [item.name for item in db_fixture.query(Item)] == ["PC1"]
+
+
+def test_同じ商品への書き込みが失敗しても先の結果を返せる(db_fixture, user_fixture):
+    item = item_cruds.create(db_fixture, ItemCreate(name="PC", price=1000), user_fixture.id)
+    batcher = WriteBatcher(TestingSessionLocal, window=0.2, max_size=3)
+
+    def failing(db):
+        item_cruds.update(db, item.id, ItemUpdate(price=3000), user_fixture.id)
+        raise ValueError('failed')
+
+    updated = batcher.submit(lambda db: item_cruds.update(db, item.id, ItemUpdate(price=2000), user_fixture.id))
+    failed = batcher.submit(failing)
+
+    assert ItemResponse.model_validate(updated.result(timeout=5)).price == 2000
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    db_fixture.expire_all()
+    assert db_fixture.get(Item, item.id).price == 2000
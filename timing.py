@@ -0,0 +1,175 @@
+# リクエスト処理時間の計測ファイル
+# このファイルは、リクエストの処理時間をフェーズごとに計測し、Server-Timing ヘッダーで返す機能を提供します
+# - queue: 同時実行数の制限のキューで待っていた時間
+# - auth : 認証（get_current_user）にかかった時間
+# - db   : データベースへのクエリにかかった時間
+# - app  : エンドポイント関数の処理時間（データベースの時間を除く）
+# - serde: 入力の検証・レスポンスのシリアライズにかかった時間（ルートの処理のうち、認証・DB・エンドポイント関数以外）
+# - total: レスポンスヘッダーを送るまでの時間（ミドルウェアやルーティングの時間も含むため、各フェーズの合計より長くなります）
+# ブラウザの開発者ツールで、フェーズごとの内訳をそのまま確認できます
+
+# 必要なライブラリをインポート
+from contextlib import contextmanager  # with文で使える計測関数
+from contextvars import ContextVar  # リクエストごとの計測値
+import functools  # エンドポイント関数のラップ
+import inspect  # 非同期関数かどうかの判定
+import time  # 時間計測
+from fastapi.routing import APIRoute  # FastAPIのルート
+from sqlalchemy import event  # データベースのイベント
+from sqlalchemy.engine import Engine  # データベースエンジン
+
+
+# 処理中のリクエストのフェーズごとの計測値（秒）
+# スレッドプールで動く依存関係にも同じ辞書が引き継がれるため、どこで計測しても同じリクエストに集計されます
+_timings: ContextVar[dict | None] = ContextVar('timings', default=None)
+
+# Server-Timing ヘッダーに出力するフェーズ
+PHASES = ('queue', 'auth', 'db', 'app', 'serde')
+# ルートの処理の中で計測するフェーズ（serde はルートの処理時間からこれらを除いた時間）
+_ROUTE_PHASES = ('auth', 'db', 'app')
+
+
+def record(name: str, seconds: float):
+    """
+    処理中のリクエストにフェーズの時間を加算する関数
+    リクエストの外（バックグラウンドジョブなど）から呼び出された場合は何もしません
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    """
+    with文の中の処理時間をフェーズの時間として加算する関数
+    例: with timing.phase('auth'): ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+# データベースのクエリ時間を計測（全てのエンジンが対象）
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _timings.get() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if starts:
+        record('db', time.perf_counter() - starts.pop())
+
+
+def _timed_endpoint(endpoint):
+    # エンドポイント関数の処理時間から、その間のデータベースの時間を除いて app に加算する
+    # include_router でルートが作り直される際に二重にラップしないようにする
+    if getattr(endpoint, '_timed', False):
+        return endpoint
+
+    def finish(timings, start, db_before):
+        if timings is not None:
+            elapsed = time.perf_counter() - start
+            timings['app'] = timings.get('app', 0.0) + elapsed - (timings.get('db', 0.0) - db_before)
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            timings = _timings.get()
+            db_before = timings.get('db', 0.0) if timings is not None else 0.0
+            start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                finish(timings, start, db_before)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            timings = _timings.get()
+            db_before = timings.get('db', 0.0) if timings is not None else 0.0
+            start = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                finish(timings, start, db_before)
+    wrapper._timed = True
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    エンドポイント関数と、入力の検証・レスポンスのシリアライズの処理時間を計測するルート
+    APIRouter(route_class=TimedRoute) のように指定して使います
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        # ルートの処理（リクエスト本文の解析・検証、依存関係、エンドポイント関数、レスポンスのシリアライズ）を計測し、
+        # その間の認証・DB・エンドポイント関数の時間を除いた分を serde に加算する
+        # （ミドルウェアやキューで待つ時間は含まないため、混雑していても serde は増えません）
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            timings = _timings.get()
+            if timings is None:
+                return await handler(request)
+            before = sum(timings.get(name, 0.0) for name in _ROUTE_PHASES)
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                elapsed = time.perf_counter() - start
+                measured = sum(timings.get(name, 0.0) for name in _ROUTE_PHASES) - before
+                timings['serde'] = timings.get('serde', 0.0) + max(0.0, elapsed - measured)
+
+        return timed_handler
+
+
+def server_timing(timings: dict, total: float):
+    """
+    Server-Timing ヘッダーの値を作成する関数（時間はミリ秒）
+    """
+    parts = [f'{name};dur={timings.get(name, 0.0) * 1000:.3f}' for name in PHASES]
+    parts.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(parts)
+
+
+class TimingMiddleware:
+    """
+    リクエストの処理時間を計測して Server-Timing と X-Process-Time ヘッダーを付けるASGIミドルウェア
+    レスポンス本文には手を加えないため、ストリーミングレスポンスもそのまま流れます
+    （ストリーミングの場合、total はレスポンスヘッダーを送るまでの時間です）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                total = time.perf_counter() - start
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', server_timing(timings, total).encode()))
+                headers.append((b'x-process-time', str(total).encode()))
+                message['headers'] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
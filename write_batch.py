@@ -0,0 +1,156 @@
+# 書き込みのグループコミット機能ファイル
+# このファイルは、短い時間内に届いた商品の書き込み（作成・更新・削除）を1つのトランザクションにまとめてコミットする機能を提供します
+# PostgreSQLではコミットごとにディスクへの書き込み（fsync）が発生するため、まとめることで書き込みのスループットが上がります
+# - write_batch_window_ms ミリ秒、または write_batch_max_size 件のどちらかに達したらまとめてコミットします
+# - 各操作はセーブポイントの中で実行するため、1つの操作が失敗しても他の操作には影響しません
+#   （各操作の結果はセーブポイントの中で読み込んでセッションから切り離すため、後の操作のロールバックで読めなくなることもありません）
+# - 呼び出し元には、コミットが完了してから各自の結果（または例外）が返ります
+# write_batch_window_ms が0の場合（既定）は無効で、従来どおり各リクエストが個別にコミットします
+
+# 必要なライブラリをインポート
+import asyncio  # 非同期処理
+from concurrent.futures import Future  # 操作ごとの結果
+import logging  # ログ出力
+import queue  # 操作の受け渡し
+import threading  # まとめてコミットするスレッド
+import time  # 待ち時間の計測
+from sqlalchemy import inspect  # ORMオブジェクトの状態の確認
+from sqlalchemy.exc import NoInspectionAvailable  # ORMオブジェクト以外の結果
+from sqlalchemy.orm import sessionmaker  # データベースセッション
+from config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _batch_session_factory(session_factory):
+    # commit() を flush() に置き換えたセッションのファクトリを作成する
+    # cruds の関数は最後に commit() を呼ぶため、そのまま使うとまとめたトランザクションが途中で確定してしまう
+    class BatchSession(session_factory.class_):
+        def commit(self):
+            self.flush()
+
+        def commit_batch(self):
+            # まとめた操作を実際にコミットする
+            super().commit()
+
+    return sessionmaker(class_=BatchSession, **{**session_factory.kw, 'expire_on_commit': False})
+
+
+class WriteBatcher:
+    """
+    書き込み操作をまとめてコミットするクラス
+    操作は「セッションを受け取って結果を返す関数」で、関数の中でロールバックしないものに限ります
+    """
+
+    def __init__(self, session_factory, window: float, max_size: int):
+        # まとめたトランザクションを実行するセッションのファクトリ
+        self.session_factory = _batch_session_factory(session_factory)
+        # 最初の操作が届いてから待つ時間（秒）
+        self.window = window
+        # 1つのトランザクションにまとめる操作の最大数
+        self.max_size = max_size
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='write-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, operation):
+        """
+        操作を登録する関数
+        コミット後に結果が設定される Future を返します
+        """
+        future = Future()
+        self._queue.put((operation, future))
+        return future
+
+    async def run(self, operation):
+        """
+        操作を登録し、コミットが完了するまで待って結果を返す関数
+        """
+        return await asyncio.wrap_future(self.submit(operation))
+
+    def _run(self):
+        # 最初の操作が届いたら、待ち時間か最大数に達するまで操作を集めて実行する
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch):
+        # 各操作をセーブポイントの中で実行し、最後に1回だけコミットする
+        db = self.session_factory()
+        try:
+            outcomes = []
+            for operation, future in batch:
+                try:
+                    with db.begin_nested():
+                        outcomes.append((future, _detach(db, operation(db)), None))
+                except Exception as e:
+                    # 失敗した操作だけをロールバックし、他の操作は続ける
+                    outcomes.append((future, None, e))
+            try:
+                db.commit_batch()
+            except Exception as e:
+                db.rollback()
+                if len(batch) > 1:
+                    # まとめたコミットが失敗した場合は、1件ずつやり直して失敗した操作を特定する
+                    logger.warning('Batched commit of %s writes failed, retrying individually: %r', len(batch), e)
+                    for item in batch:
+                        self._execute([item])
+                    return
+                outcomes = [(future, None, e) for future, _, _ in outcomes]
+        finally:
+            db.close()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def _detach(db, result):
+    # 操作の結果がORMオブジェクトの場合は、全ての属性を読み込んでからセッションから切り離す
+    # 後の操作が同じ商品を変更して失敗すると、セーブポイントのロールバックで結果の属性が期限切れになり、
+    # セッションを閉じた後に呼び出し元がレスポンスを作れなくなるため
+    try:
+        state = inspect(result)
+    except NoInspectionAvailable:
+        return result
+    if not state.deleted:
+        db.refresh(result)
+    db.expunge(result)
+    return result
+
+
+# アプリケーション全体で共有するグループコミットの実行役（最初に使うときに作成）
+_batcher = None
+_lock = threading.Lock()
+
+
+def enabled():
+    """
+    グループコミットが有効かどうかを返す関数
+    """
+    return get_settings().write_batch_window_ms > 0
+
+
+def get_batcher():
+    """
+    アプリケーション全体で共有する WriteBatcher を取得する関数
+    """
+    global _batcher
+    with _lock:
+        if _batcher is None:
+            from database import SessionLocal
+            settings = get_settings()
+            _batcher = WriteBatcher(SessionLocal, settings.write_batch_window_ms / 1000, settings.write_batch_max_size)
+        return _batcher